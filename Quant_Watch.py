@@ -39,11 +39,26 @@
 import time
 import requests
 import math
+import heapq
 import statistics
 import threading
 import subprocess
 import json
-from flask import Flask, jsonify, render_template_string, request
+import os
+import bisect
+import ipaddress
+import gzip
+import zlib
+import functools
+import re
+import sys
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import Flask, Response, jsonify, render_template_string, request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- Voice and Parsing Libraries ---
 try:
@@ -63,21 +78,44 @@ except (ImportError, FileNotFoundError):
     print("="*50)
     VOICE_ENABLED = False
 
+# --- Optional acceleration: NumPy FFT untuk pencarian pola pada histori panjang ---
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # --- Configuration ---
 ALLOWED_INTERVALS = ["15", "30", "60", "120", "240", "360", "720", "D", "W", "M"]
-BYBIT_API_URL = "https://api.bybit.com/v5/market/kline"
-BYBIT_SYMBOLS_URL = "https://api.bybit.com/v5/market/tickers"
-CACHE_TTL_SECONDS = 15
+BYBIT_API_URL = "https://api.bybit.com/v5/market"
+BYBIT_REQUESTS_PER_SECOND = 10  # Batas sisi klien per endpoint Bybit
+HTTP_POOL_SIZE = 8  # Koneksi keep-alive: handler request, reload cache di background, dan asisten suara
+HTTP_MAX_RETRIES = 3  # Retry request idempoten (GET) saat 429/5xx
+HTTP_MAX_BACKOFF_SECONDS = 30  # Jika server minta menunggu lebih lama, request gagal alih-alih menahan thread
+HTTP_LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Batas atas histogram latensi
+STAGE_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)  # Batas atas histogram waktu per tahap
+CACHE_TTL_SECONDS = 15  # Periode refresh candle yang sedang terbentuk; candle yang sudah close tidak pernah kedaluwarsa
+INTERVAL_MS = {"D": 86400000, "W": 604800000, "M": 31 * 86400000}
+CACHE_STALE_SECONDS = 45  # Entri basi masih boleh dipakai selama ini sambil di-reload
+CACHE_MAX_ENTRIES = 256  # Jumlah pasangan symbol/interval di memori
+PREDICTION_MODES = ["recursive", "direct"]  # recursive: cari ulang per candle; direct: satu pencarian untuk semua candle
+VOICE_PREDICTION_MODE = "recursive"  # Mode prediksi yang dipakai asisten suara
+FFT_MIN_SERIES_LENGTH = 2048  # Di bawah ini, profil dot product pure Python lebih cepat dari FFT
+PREDICTION_CACHE_DIR = "prediction_cache"
+PREDICTION_CACHE_MAX_ENTRIES = 1024  # Jumlah prediksi di memori
+PREDICTION_MODEL_VERSION = 1  # Naikkan saat model prediksi berubah, agar prediksi lama di disk diabaikan
+RESPONSE_CACHE_MAX_ENTRIES = 256  # Body /api/candles yang sudah diserialisasi di memori
+PROFILER_DEFAULT_SECONDS = 10
+PROFILER_MAX_SECONDS = 120  # Durasi profil terpanjang untuk satu request
+PROFILER_DEFAULT_HZ = 100
+PROFILER_MAX_HZ = 250  # Batas laju sampling, agar profil tidak pernah memakan lebih dari sedikit CPU
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
-cache = {}
 
 # --- Global variables for voice assistant ---
 VALID_TICKERS = []
 
-# --- HTML & JavaScript Template (UNMODIFIED) ---
+# --- HTML & JavaScript Template ---
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -171,6 +209,11 @@ HTML_TEMPLATE = """
             </select>
             <label for="num_predictions">Predictions:</label>
             <input type="number" id="num_predictions" value="5" min="1" max="20">
+            <label for="mode">Mode:</label>
+            <select id="mode">
+                <option value="recursive">Recursive</option>
+                <option value="direct">Direct</option>
+            </select>
             <button id="fetchButton">Fetch & Predict</button>
             <div id="status"></div>
         </div>
@@ -196,6 +239,7 @@ HTML_TEMPLATE = """
         </div>
     </div>
     <script>
+        const CHART_REFRESH_MS = 5000;
         document.addEventListener('DOMContentLoaded', function () {
             const statusEl = document.getElementById('status');
             const fetchButton = document.getElementById('fetchButton');
@@ -254,11 +298,12 @@ HTML_TEMPLATE = """
                 const symbol = symbolInput.value.toUpperCase().trim();
                 const interval = document.getElementById('interval').value;
                 const numPredictions = document.getElementById('num_predictions').value;
+                const mode = document.getElementById('mode').value;
                 if (!symbol) { statusEl.innerText = 'Error: Symbol cannot be empty.'; return; }
                 statusEl.innerText = 'Fetching data from Bybit...';
                 fetchButton.disabled = true;
                 try {
-                    const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}`);
+                    const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${mode}`);
                     if (!response.ok) throw new Error((await response.json()).error || `HTTP error! status: ${response.status}`);
                     statusEl.innerText = 'Data received. Predicting...';
                     const data = await response.json();
@@ -266,10 +311,12 @@ HTML_TEMPLATE = """
                     xAxis.set("baseInterval", intervalConfig);
                     series.data.setAll(data.candles);
                     predictedSeries.data.setAll(data.predicted);
+                    chartQuery = `symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${mode}`;
                     statusEl.innerText = 'Prediction complete.';
                 } catch (error) {
                     console.error('Error:', error);
                     statusEl.innerText = `Error: ${error.message}`;
+                    chartQuery = null;
                     if (series) series.data.setAll([]);
                     if (predictedSeries) predictedSeries.data.setAll([]);
                 } finally {
@@ -291,6 +338,28 @@ HTML_TEMPLATE = """
             });
             document.getElementById('cancel-position-btn').addEventListener('click', () => { positionModal.classList.remove('visible'); });
             createChart();
+            // Auto-refresh: only the candles from the last one shown onwards are requested; the last one is patched, newer ones appended
+            let chartQuery = null;
+            async function refreshChart() {
+                if (!chartQuery || !series || series.data.length === 0) return;
+                const query = chartQuery;
+                try {
+                    const response = await fetch(`/api/candles?${query}&since=${series.data.getIndex(series.data.length - 1).t}`);
+                    if (!response.ok || query !== chartQuery) return;
+                    const data = await response.json();
+                    if (data.full) series.data.setAll(data.candles);
+                    else data.candles.forEach(candle => {
+                        const last = series.data.length - 1;
+                        if (candle.t === series.data.getIndex(last).t) series.data.setIndex(last, candle);
+                        else if (candle.t > series.data.getIndex(last).t) { series.data.push(candle); series.data.removeIndex(0); }
+                    });
+                    predictedSeries.data.setAll(data.predicted);
+                } catch (error) {
+                    console.error('Chart refresh failed:', error);
+                }
+            }
+            setInterval(refreshChart, CHART_REFRESH_MS);
+
             fetchButton.addEventListener('click', fetchDataAndPredict);
             symbolInput.addEventListener('keydown', (event) => { if (event.key === 'Enter') fetchDataAndPredict(); });
             fetchDataAndPredict();
@@ -300,78 +369,467 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# --- Typed Candle Series ---
+class CandleSeries:
+    """Candle berbentuk kolom, di-parse sekali saat fetch: ts sebagai int64, OHLCV sebagai float64."""
+    __slots__ = ("ts", "open", "high", "low", "close", "volume")
+    COLUMNS = [("ts", "q"), ("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"), ("volume", "d")]
+
+    def __init__(self, ts=None, open=None, high=None, low=None, close=None, volume=None):
+        for (name, typecode), column in zip(self.COLUMNS, (ts, open, high, low, close, volume)):
+            setattr(self, name, array(typecode) if column is None else column)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        return cls(*(array(typecode, (int(row[k]) if typecode == "q" else float(row[k]) for row in rows))
+                     for k, (_, typecode) in enumerate(cls.COLUMNS)))
+
+    @classmethod
+    def concat(cls, *parts):
+        columns = [array(typecode) for _, typecode in cls.COLUMNS]
+        for part in parts:
+            for column, source in zip(columns, part.columns()): column.extend(source)
+        return cls(*columns)
+
+    def columns(self): return [getattr(self, name) for name, _ in self.COLUMNS]
+    def __len__(self): return len(self.ts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): return CandleSeries(*(column[index] for column in self.columns()))
+        return tuple(column[index] for column in self.columns())
+
+    def to_dicts(self):
+        return [{"t": t, "o": o, "h": h, "l": l, "c": c, "v": v} for t, o, h, l, c, v in zip(*self.columns())]
+
+# --- Instrumentasi Hot Path ---
+class StageTimers:
+    """
+    Histogram latensi per tahap hot path (fetch kline, prediksi, request, analisis suara), supaya terlihat ke mana
+    waktu respons habis. Diukur dengan context manager timer() atau decorator timed(); disajikan oleh /metrics.
+    """
+    def __init__(self, buckets_ms=STAGE_LATENCY_BUCKETS_MS):
+        self.buckets_ms, self.stages, self.lock = buckets_ms, {}, threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.setdefault(stage, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(self.buckets_ms) + 1)})
+            stats["count"] += 1
+            stats["sum_ms"] += seconds * 1000
+            stats["buckets"][bisect.bisect_left(self.buckets_ms, seconds * 1000)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(stage, time.perf_counter() - started)
+
+    def timed(self, stage):
+        # Decorator: setiap panggilan fungsi diukur sebagai `stage`, baik selesai normal maupun melempar exception
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage): return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def stats(self):
+        # Per tahap, dengan format yang sama seperti ExchangeClient.stats() (tanpa outcomes)
+        bounds = [str(bound) for bound in self.buckets_ms] + ["+Inf"]
+        with self.lock:
+            return {stage: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3), "buckets": dict(zip(bounds, stats["buckets"]))}
+                    for stage, stats in self.stages.items()}
+
+stage_timers = StageTimers()
+
+# --- Exchange HTTP Client ---
+class TokenBucket:
+    """Token bucket thread-safe: acquire() menunggu sampai ada token; pause() menahan semua pemanggil selama waktu dari server."""
+    def __init__(self, rate, capacity=None):
+        self.rate, self.capacity = rate, capacity or rate
+        self.tokens, self.updated, self.paused_until = self.capacity, time.monotonic(), 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until: wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else: wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens, self.updated = 0.0, self.paused_until
+
+class ExchangeClient:
+    """
+    Client HTTP ber-pool untuk satu exchange: satu Session keep-alive (pool blocking berisi pool_size koneksi),
+    token bucket per endpoint, backoff mengikuti header rate limit (Retry-After, reset timestamp Bybit) sehingga
+    429 menahan endpoint untuk semua thread, dan histogram latensi per endpoint. Hanya GET yang di-retry.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, pool_size, rate_limits, default_rate):
+        self.base_url, self.session = base_url, requests.Session()
+        # urllib3 hanya me-retry kegagalan koneksi; status ditangani di request()
+        retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.buckets, self.default_rate = {path: TokenBucket(rate) for path, rate in rate_limits.items()}, default_rate
+        self.latency, self.lock = {}, threading.Lock()
+
+    def bucket(self, path):
+        with self.lock: return self.buckets.setdefault(path, TokenBucket(self.default_rate))
+
+    def request(self, method, path, params=None, headers=None, timeout=(5, 10)):
+        # Timeout 5s connect, 10s read; mengembalikan response terakhir (pemanggil tetap raise_for_status())
+        bucket, retries, attempt = self.bucket(path), HTTP_MAX_RETRIES if method.upper() == "GET" else 0, 0
+        while True:
+            bucket.acquire()
+            started = time.monotonic()
+            try: response = self.session.request(method, self.base_url + path, params=params, headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException:
+                self._observe(path, time.monotonic() - started, "error")
+                raise
+            self._observe(path, time.monotonic() - started, str(response.status_code))
+            wait = self._limit_wait(response)
+            if wait is not None: bucket.pause(min(wait, HTTP_MAX_BACKOFF_SECONDS))
+            if response.status_code not in self.RETRY_STATUSES or attempt >= retries: return response
+            wait = 2 ** attempt if wait is None else wait
+            if wait > HTTP_MAX_BACKOFF_SECONDS: return response
+            if response.status_code != 429: time.sleep(wait)  # 429 sudah menunggu di bucket.acquire()
+            attempt += 1
+
+    def _limit_wait(self, response):
+        # Detik sampai exchange menerima request lagi, atau None jika tidak ada batas
+        headers = response.headers
+        try:
+            if headers.get("Retry-After"): return max(0.0, float(headers["Retry-After"]))
+            if headers.get("X-Bapi-Limit-Reset-Timestamp") and (response.status_code == 429 or headers.get("X-Bapi-Limit-Status") == "0"):
+                return max(0.0, int(headers["X-Bapi-Limit-Reset-Timestamp"]) / 1000 - time.time())
+        except ValueError: pass
+        return 1.0 if response.status_code == 429 else None
+
+    def _observe(self, path, seconds, outcome):
+        with self.lock:
+            stats = self.latency.setdefault(path, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1), "outcomes": {}})
+            stats["count"] += 1
+            stats["sum_ms"] += seconds * 1000
+            stats["buckets"][bisect.bisect_left(HTTP_LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+
+    def stats(self):
+        # Per endpoint: jumlah request, total latensi, jumlah per bucket latensi (batas atas dalam ms) dan per status
+        bounds = [str(bound) for bound in HTTP_LATENCY_BUCKETS_MS] + ["+Inf"]
+        with self.lock:
+            return {path: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3), "buckets": dict(zip(bounds, stats["buckets"])),
+                           "outcomes": dict(stats["outcomes"])} for path, stats in self.latency.items()}
+
+bybit_http = ExchangeClient(BYBIT_API_URL, HTTP_POOL_SIZE, {}, BYBIT_REQUESTS_PER_SECOND)
+
 # --- Data Fetching & Caching ---
+class KlineCache:
+    """
+    Cache kline berbatas: LRU di atas max_entries, TTL, dan single-flight loading.
+    Entri basi (kurang dari stale_ttl lewat TTL-nya) tetap dikembalikan sambil di-reload di background;
+    pemanggil bersamaan untuk key yang sama menunggu satu fetch yang sama.
+    loader(previous) menerima nilai lama untuk key tersebut (atau None) agar bisa refresh inkremental;
+    ttl(value) opsional menentukan TTL per nilai.
+    """
+    class _Flight:
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, max_entries, ttl, stale_ttl):
+        self.max_entries, self.ttl, self.stale_ttl = max_entries, ttl, stale_ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (fresh_until, value), LRU di depan
+        self.inflight = {}  # key -> _Flight
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "waits": 0, "evictions": 0, "loads": 0, "load_errors": 0}
+
+    def get(self, key, loader, ttl=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.monotonic()
+            if entry and now < entry[0] + self.stale_ttl:
+                self.entries.move_to_end(key)
+                if now < entry[0]:
+                    self.counters["hits"] += 1
+                else:
+                    self.counters["stale_hits"] += 1
+                    if key not in self.inflight:
+                        flight = self.inflight[key] = self._Flight()
+                        threading.Thread(target=self._load, args=(key, loader, ttl, flight, entry[1]), daemon=True).start()
+                return entry[1]
+            self.counters["misses"] += 1
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader: flight = self.inflight[key] = self._Flight()
+            else: self.counters["waits"] += 1
+        if leader: self._load(key, loader, ttl, flight, entry[1] if entry else None)
+        else: flight.done.wait()
+        if flight.error is not None: raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, ttl, flight, previous):
+        try: flight.value = loader(previous)
+        except Exception as e: flight.error = e
+        with self.lock:
+            self.counters["loads"] += 1
+            if flight.error is not None: self.counters["load_errors"] += 1
+            elif flight.value:  # Hasil kosong tidak disimpan
+                self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl(flight.value)), flight.value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+            del self.inflight[key]
+        flight.done.set()
+
+    def clear(self):
+        with self.lock: self.entries.clear()
+
+    def stats(self):
+        with self.lock: return {**self.counters, "size": len(self.entries), "max_entries": self.max_entries, "inflight": len(self.inflight)}
+
+cache = KlineCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_STALE_SECONDS)
+
+def interval_to_ms(interval):
+    return INTERVAL_MS.get(interval) or int(interval) * 60000
+
+def candle_close_ms(interval, ts):
+    # Waktu close (= awal candle berikutnya) candle yang terbentuk pada `ts`, di grid UTC Bybit:
+    # minggu mulai hari Senin, bulan mulai tanggal 1 (bukan ts + INTERVAL_MS["M"])
+    if interval == "M":
+        day = datetime.fromtimestamp(ts / 1000, timezone.utc)
+        return int(datetime(day.year + day.month // 12, day.month % 12 + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    offset = 4 * 86400000 if interval == "W" else 0  # 1970-01-01 hari Kamis
+    return ((ts - offset) // interval_to_ms(interval) + 1) * interval_to_ms(interval) + offset
+
+@stage_timers.timed("get_bybit_data")
 def get_bybit_data(symbol, interval):
-    """Fetches candlestick data from the Bybit v5 API with in-memory caching."""
-    cache_key = f"{symbol}-{interval}"
-    current_time = time.time()
-    if cache_key in cache:
-        last_fetch_time, cached_data = cache[cache_key]
-        if current_time - last_fetch_time < CACHE_TTL_SECONDS:
-            return cached_data
+    """Fetches candlestick data from the Bybit v5 API through the shared KlineCache."""
+    return cache.get(f"{symbol}-{interval}", lambda previous: fetch_bybit_data(symbol, interval, previous),
+                     ttl=lambda candles: forming_candle_ttl(interval, candles))
+
+def forming_candle_ttl(interval, candles):
+    # CACHE_TTL_SECONDS untuk candle yang terbentuk, tapi tidak melewati waktu close-nya
+    return max(0.0, min(CACHE_TTL_SECONDS, candle_close_ms(interval, candles.ts[-1]) / 1000 - time.time()))
+
+@stage_timers.timed("fetch_bybit_data")
+def fetch_bybit_data(symbol, interval, previous=None):
+    # Dengan `previous` (cache lama), hanya candle sejak candle terakhirnya yang diminta lalu digabung
     params = {"category": "spot", "symbol": symbol, "interval": interval, "limit": 500}
+    if previous: params["start"] = previous.ts[-1]
     try:
-        response = requests.get(BYBIT_API_URL, params=params)
+        response = bybit_http.request("GET", "/kline", params=params)
         response.raise_for_status()
         data = response.json()
         if data.get("retCode") != 0: raise ValueError(data.get("retMsg", "Unknown Bybit API error"))
-        candles = list(reversed(data["result"]["list"]))
-        if not candles: return []
-        cache[cache_key] = (current_time, candles)
-        return candles
+        fresh = CandleSeries.from_rows(reversed(data["result"]["list"]))
+        if not previous or not fresh or fresh.ts[0] > previous.ts[-1]: return fresh
+        return CandleSeries.concat(previous[:bisect.bisect_left(previous.ts, fresh.ts[0])], fresh)[-500:]
     except requests.exceptions.RequestException as e: raise ConnectionError(f"Gagal terhubung ke API Bybit: {e}")
     except (ValueError, KeyError) as e: raise ValueError(f"Error saat memproses respons Bybit: {e}")
 
 # --- Prediction Model (Pure Python) ---
-def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5):
+def rolling_window_norms(data_series, window_size):
+    num_windows = len(data_series) - window_size + 1
+    if window_size <= 0 or num_windows <= 0: return []
+    squares = [x * x for x in data_series]
+    sum_sq = sum(squares[:window_size])
+    nonzero = sum(1 for sq in squares[:window_size] if sq)  # jendela yang semuanya nol tetap bernilai tepat 0.0
+    norms = [math.sqrt(sum_sq) if nonzero else 0.0]
+    for i in range(window_size, len(squares)):
+        entering, leaving = squares[i], squares[i - window_size]
+        sum_sq += entering - leaving
+        nonzero += (entering != 0) - (leaving != 0)
+        norms.append(math.sqrt(max(sum_sq, 0.0)) if nonzero else 0.0)
+    return norms
+
+def sliding_dot_profile(data_series, query, num_windows):
+    if np is not None and len(data_series) >= FFT_MIN_SERIES_LENGTH:
+        # Cross-correlation via FFT: O(n log n) untuk semua jendela sekaligus.
+        size = 1 << (len(data_series) - 1).bit_length()
+        spectrum = np.fft.rfft(np.asarray(data_series, dtype=float), size) * np.conj(np.fft.rfft(np.asarray(query, dtype=float), size))
+        return np.fft.irfft(spectrum, size)[:num_windows].tolist()
+    profile = [0.0] * num_windows
+    for k, q in enumerate(query):
+        if q: profile = [acc + q * x for acc, x in zip(profile, data_series[k : k + num_windows])]
+    return profile
+
+# Top-k dengan heap terbatas (tanpa sort penuh); skor seri tetap memilih indeks terkecil lebih dulu.
+def select_top_k(scores, k, indices=None):
+    if k <= 0: return []
+    if indices is None: indices = range(len(scores))
+    return heapq.nlargest(k, indices, key=scores.__getitem__)
+
+# `dots` boleh berisi dot profile terhadap jendela terbaru yang sudah dipelihara pemanggil (lihat PatternForecaster).
+def top_similar_windows(data_series, window_size, top_n, num_windows, norms, dots=None):
+    current_norm = norms[-1]
+    if current_norm == 0 or num_windows <= 0: return None
+    if dots is None: dots = sliding_dot_profile(data_series, data_series[-window_size:], num_windows)
+    similarities = [dot / (h_norm * current_norm) if h_norm > 0 else 0.0 for dot, h_norm in zip(dots, norms)]
+    return select_top_k(similarities, top_n, (i for i in range(num_windows) if norms[i] > 0)) or None
+
+def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5, norms=None, dots=None):
     if len(data_series) < 2 * window_size: return None
-    def dot_product(v1, v2): return sum(x * y for x, y in zip(v1, v2))
-    def norm(v): return math.sqrt(sum(x * x for x in v))
-    current_pattern = data_series[-window_size:]
-    current_norm = norm(current_pattern)
-    if current_norm == 0: return None
-    similarities = []
-    for i in range(len(data_series) - window_size):
-        historical_pattern = data_series[i : i + window_size]
-        historical_norm = norm(historical_pattern)
-        if historical_norm > 0:
-            similarity = dot_product(historical_pattern, current_pattern) / (historical_norm * current_norm)
-            similarities.append({"sim": similarity, "outcome_index": i + window_size})
-    if not similarities: return None
-    similarities.sort(key=lambda x: x["sim"], reverse=True)
-    top_patterns = similarities[:top_n]
+    if norms is None: norms = rolling_window_norms(data_series, window_size)
+    top_patterns = top_similar_windows(data_series, window_size, top_n, len(data_series) - window_size, norms, dots)
     if not top_patterns: return None
-    avg_outcome = statistics.mean(data_series[p["outcome_index"]] for p in top_patterns)
+    avg_outcome = statistics.mean(data_series[i + window_size] for i in top_patterns)
     return avg_outcome
 
-def predict_next_candles(candles_data, num_predictions=5):
-    if len(candles_data) < 50: return []
-    data = [[float(c[i]) for i in range(6)] for c in candles_data]
-    upper_wicks = [d[2] - max(d[1], d[4]) for d in data]
-    lower_wicks = [min(d[1], d[4]) - d[3] for d in data]
+# Mode "direct": satu kali pencarian, lalu rata-rata `horizon` outcome berikutnya dari pola teratas per langkah.
+def find_similar_pattern_paths(data_series, window_size=20, top_n=5, horizon=1, norms=None):
+    if horizon < 1 or len(data_series) < 2 * window_size: return None
+    if norms is None: norms = rolling_window_norms(data_series, window_size)
+    top_patterns = top_similar_windows(data_series, window_size, top_n, len(data_series) - window_size - horizon + 1, norms)
+    if not top_patterns: return None
+    return [statistics.mean(data_series[i + window_size + h] for i in top_patterns) for h in range(horizon)]
+
+# Forecaster bertahap: log return, norma per jendela dan dot profile jendela terbaru disimpan antar langkah,
+# sehingga setiap close prediksi hanya menambah satu log return dan satu norma jendela baru, dan profile
+# digeser sepanjang diagonalnya dalam O(n). Forecast rekursif = satu scan penuh + O(n) per langkah.
+class PatternForecaster:
+    def __init__(self, closes, window_size=20, top_n=5):
+        self.window_size = window_size
+        self.top_n = top_n
+        self.log_returns = [math.log(closes[j] / closes[j-1]) for j in range(1, len(closes)) if closes[j-1] > 0]
+        self.last_close = closes[-1] if closes else 0.0
+        self.norms = rolling_window_norms(self.log_returns, window_size)
+        newest = self.log_returns[-window_size:] if len(self.log_returns) >= window_size else []
+        self._sum_sq = sum(x * x for x in newest)
+        self._nonzero = sum(1 for x in newest if x * x)
+        self._dots = None  # Dibangun oleh pencarian rekursif pertama, lalu diperbarui setiap append
+
+    # Dot product jendela terbaru dengan setiap jendela sebelumnya yang punya nilai berikutnya; None bila seri terlalu pendek.
+    def dot_profile(self):
+        num_windows = len(self.log_returns) - self.window_size
+        if num_windows < self.window_size: return None
+        if self._dots is None:
+            self._dots = sliding_dot_profile(self.log_returns, self.log_returns[-self.window_size:], num_windows)
+        return self._dots
+
+    def append_close(self, close):
+        if self.last_close > 0:
+            log_return = math.log(close / self.last_close)
+            self.log_returns.append(log_return)
+            size = self.window_size
+            if self._dots is not None:
+                # Jendela j terhadap query baru = jendela j - 1 terhadap query lama, dikurangi suku pertama query lama
+                # dan ditambah nilai baru. Jendela 0 tidak punya pendahulu, jadi dihitung penuh.
+                series, dropped = self.log_returns, self.log_returns[-size - 1]
+                first = sum(q * x for q, x in zip(series[-size:], series))
+                self._dots = [first] + [dot - dropped * series[j] + log_return * series[j + size] for j, dot in enumerate(self._dots)]
+            if len(self.log_returns) == size:
+                self._sum_sq = sum(x * x for x in self.log_returns)
+                self._nonzero = sum(1 for x in self.log_returns if x * x)
+            elif len(self.log_returns) > size:
+                leaving_value = self.log_returns[-size - 1]
+                entering, leaving = log_return * log_return, leaving_value * leaving_value
+                self._sum_sq += entering - leaving
+                self._nonzero += (entering != 0) - (leaving != 0)
+            if len(self.log_returns) >= size:
+                self.norms.append(math.sqrt(max(self._sum_sq, 0.0)) if self._nonzero else 0.0)
+        self.last_close = close
+
+    def predict_next_close(self):
+        if not self.log_returns: return None
+        predicted_log_return = find_similar_patterns_pure_python(self.log_returns, self.window_size, self.top_n, norms=self.norms, dots=self.dot_profile())
+        if predicted_log_return is None: return None
+        return self.last_close * math.exp(predicted_log_return)
+
+    def predict_close_path(self, horizon):
+        path = find_similar_pattern_paths(self.log_returns, self.window_size, self.top_n, horizon, norms=self.norms)
+        if path is None: return None
+        closes, close = [], self.last_close
+        for log_return in path:
+            close *= math.exp(log_return)
+            closes.append(close)
+        return closes
+
+@stage_timers.timed("predict_next_candles")
+def predict_next_candles(candles, num_predictions=5, mode="recursive"):
+    if mode not in PREDICTION_MODES: raise ValueError(f"Mode prediksi tidak dikenal: {mode}")
+    if not isinstance(candles, CandleSeries): candles = CandleSeries.from_rows(candles)
+    if len(candles) < 50: return []
+    upper_wicks = [h - max(o, c) for o, h, c in zip(candles.open, candles.high, candles.close)]
+    lower_wicks = [min(o, c) - l for o, l, c in zip(candles.open, candles.low, candles.close)]
     avg_upper_wick = statistics.mean(upper_wicks) if upper_wicks else 0
     avg_lower_wick = statistics.mean(lower_wicks) if lower_wicks else 0
     predictions = []
-    current_candles = data[:]
+    forecaster = PatternForecaster(candles.close.tolist())
+    last_ts = candles.ts[-1]
+    interval_ms = candles.ts[-1] - candles.ts[-2]
+    direct_path = forecaster.predict_close_path(num_predictions) if mode == "direct" else None
     for i in range(num_predictions):
-        closes = [c[4] for c in current_candles]
-        log_returns_close = [math.log(closes[j] / closes[j-1]) for j in range(1, len(closes)) if closes[j-1] > 0]
-        if not log_returns_close: break
-        predicted_log_return = find_similar_patterns_pure_python(log_returns_close)
-        if predicted_log_return is None: break
-        last_close = current_candles[-1][4]
-        predicted_close = last_close * math.exp(predicted_log_return)
+        if mode == "direct": predicted_close = direct_path[i] if direct_path else None
+        else: predicted_close = forecaster.predict_next_close()
+        if predicted_close is None: break
+        last_close = forecaster.last_close
         pred_open = last_close
         pred_high = max(pred_open, predicted_close) + avg_upper_wick
         pred_low = min(pred_open, predicted_close) - avg_lower_wick
-        last_ts = int(current_candles[-1][0])
-        interval_ms = int(current_candles[-1][0]) - int(current_candles[-2][0])
-        new_ts = last_ts + interval_ms
-        new_candle = [new_ts, pred_open, pred_high, pred_low, predicted_close, 0]
-        current_candles.append(new_candle)
-        predictions.append({"t": new_ts, "o": pred_open, "h": pred_high, "l": pred_low, "c": predicted_close})
+        last_ts += interval_ms
+        forecaster.append_close(predicted_close)
+        predictions.append({"t": last_ts, "o": pred_open, "h": pred_high, "l": pred_low, "c": predicted_close})
     return predictions
 
+# --- Prediction Cache ---
+prediction_cache = KlineCache(PREDICTION_CACHE_MAX_ENTRIES, float("inf"), 0)
+
+def get_prediction(symbol, interval, candles, num_predictions=5, mode="recursive"):
+    """
+    Prediksi dari candle yang sudah close (candle yang terbentuk diabaikan) lewat cache bersama
+    /api/candles dan asisten suara. Key: (symbol, interval, ts candle close terakhir, versi model,
+    panjang input, mode, horizon), jadi tiap prediksi dihitung sekali per candle close, lalu
+    diambil dari memori, atau dari PREDICTION_CACHE_DIR setelah restart.
+    Kalau candle yang terbentuk diabaikan, diprediksi satu langkah lebih dan langkah pertama
+    (pengganti candle yang terbentuk) dibuang: prediksi tetap mulai satu interval setelahnya.
+    """
+    closed = candles
+    if closed and candle_close_ms(interval, closed.ts[-1]) > time.time() * 1000:
+        closed = closed[:-1]
+    if len(closed) < 50: return []
+    skipped = len(candles) - len(closed)
+    horizon = num_predictions + skipped
+    name = f"v{PREDICTION_MODEL_VERSION}-{closed.ts[-1]}-{len(closed)}-{mode}-{horizon}.json"
+    predicted = prediction_cache.get(f"{symbol}-{interval}/{name}",
+                                     lambda previous: load_or_predict(symbol, interval, name, closed, horizon, mode))
+    return predicted[skipped:]
+
+def load_or_predict(symbol, interval, name, closed, num_predictions, mode):
+    # Baca dari disk, atau hitung lalu simpan; prediksi untuk candle yang lebih lama dihapus
+    if not symbol.isalnum(): return predict_next_candles(closed, num_predictions, mode)  # symbol dipakai sebagai nama direktori
+    path = os.path.join(PREDICTION_CACHE_DIR, symbol, interval)
+    try:
+        with open(os.path.join(path, name)) as f: return json.load(f)
+    except (OSError, ValueError): pass
+    predicted = predict_next_candles(closed, num_predictions, mode)
+    if predicted:
+        try:
+            os.makedirs(path, exist_ok=True)
+            current = f"v{PREDICTION_MODEL_VERSION}-{closed.ts[-1]}-"
+            for old in os.listdir(path):
+                if not old.startswith(current): os.remove(os.path.join(path, old))
+            tmp = os.path.join(path, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w") as f: json.dump(predicted, f)
+            os.replace(tmp, os.path.join(path, name))
+        except OSError as e:  # mis. penulis lain menghapus file yang sama; prediksi tetap dilayani dari memori
+            app.logger.warning(f"Gagal menyimpan prediksi {name} untuk {symbol}/{interval}: {e}")
+    return predicted
+
 # --- [TERMUX INDONESIA] FUNGSI PERINTAH SUARA ---
 
 def speak(text):
@@ -389,7 +847,7 @@ def get_all_bybit_tickers():
     print("Mengambil ticker yang tersedia dari Bybit untuk koreksi otomatis...")
     try:
         params = {"category": "spot"}
-        response = requests.get(BYBIT_SYMBOLS_URL, params=params)
+        response = bybit_http.request("GET", "/tickers", params=params)
         response.raise_for_status()
         data = response.json()
         if data.get("retCode") == 0:
@@ -417,7 +875,8 @@ def find_closest_ticker(text, ticker_list):
         return best_match[0]
     return None
 
-def analyze_and_speak(ticker):
+@stage_timers.timed("analyze_and_speak")
+def analyze_and_speak(ticker, mode=VOICE_PREDICTION_MODE):
     """Melakukan analisis dan mengucapkan hasilnya dalam Bahasa Indonesia."""
     symbol = f"{ticker}USDT"
     interval = "60"
@@ -429,24 +888,24 @@ def analyze_and_speak(ticker):
     print(f"Menganalisis {symbol} pada timeframe {interval}m dengan {num_predictions} prediksi...")
     
     try:
-        raw_candles = get_bybit_data(symbol, interval)
-        if not raw_candles:
+        candles = get_bybit_data(symbol, interval)
+        if not candles:
             speak(f"Maaf, saya tidak dapat menemukan data untuk {ticker_name}.")
             return
 
-        predicted_candles = predict_next_candles(raw_candles, num_predictions)
+        predicted_candles = get_prediction(symbol, interval, candles, num_predictions, mode)
         if not predicted_candles:
             speak(f"Maaf, saya tidak dapat membuat prediksi untuk {ticker_name}.")
             return
 
-        last_price = float(raw_candles[-1][4])
+        last_price = candles.close[-1]
         predicted_closes = [p['c'] for p in predicted_candles]
         final_predicted_price = predicted_closes[-1]
         
         direction = "naik" if final_predicted_price > last_price else "turun"
         percent_change = abs((final_predicted_price - last_price) / last_price * 100)
         
-        combined_prices = [float(c[4]) for c in raw_candles[-10:]] + predicted_closes
+        combined_prices = candles.close[-10:].tolist() + predicted_closes
         consolidation_low = min(combined_prices)
         consolidation_high = max(combined_prices)
         
@@ -511,34 +970,195 @@ def voice_command_loop():
             print(f"Terjadi error tak terduga di loop suara: {e}")
             time.sleep(2)
 
+# --- Response Cache ---
+response_cache = KlineCache(RESPONSE_CACHE_MAX_ENTRIES, float("inf"), 0)
+
+def candles_etag(candles, *params):
+    """ETag kuat: parameter, ts candle terakhir dan checksum candle yang terbentuk (satu-satunya yang berubah sebelum close)."""
+    return "-".join(map(str, params + (PREDICTION_MODEL_VERSION, len(candles), candles.ts[-1], f"{zlib.crc32(repr(candles[-1]).encode()):08x}")))
+
+def cached_json_response(etag, render):
+    """
+    If-None-Match dijawab 304 sebelum apa pun dihitung. Selain itu body dari render() diserialisasi
+    sekali per ETag dan disimpan (JSON dan gzip) di response_cache.
+    """
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match: return Response(status=304, headers=headers)
+    body, compressed = response_cache.get(etag, lambda previous: encode_json_body(render()))
+    if request.accept_encodings.quality("gzip") > 0: return Response(compressed, mimetype="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(body, mimetype="application/json", headers=headers)
+
+def encode_json_body(data):
+    body = json.dumps(data, separators=(",", ":")).encode()
+    return body, gzip.compress(body, 6)
+
+# --- Metrik Prometheus ---
+def prometheus_labels(**labels):
+    # {name="value",...}; json.dumps meng-escape backslash, tanda kutip dan newline sesuai format teks Prometheus
+    if not labels: return ""
+    return "{" + ",".join(f"{name}={json.dumps(str(value))}" for name, value in labels.items()) + "}"
+
+def prometheus_family(name, kind, help_text, samples):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+
+def prometheus_histogram(name, stats, **labels):
+    # Baris sampel dari satu histogram stats() (count, sum_ms, jumlah per bucket dengan batas atas dalam ms): kumulatif, dalam detik
+    lines, total = [], 0
+    for bound, count in stats["buckets"].items():
+        total += count
+        le = bound if bound == "+Inf" else f"{int(bound) / 1000:g}"
+        lines.append(f"{name}_bucket{prometheus_labels(**labels, le=le)} {total}")
+    lines.append(f"{name}_sum{prometheus_labels(**labels)} {stats['sum_ms'] / 1000:g}")
+    lines.append(f"{name}_count{prometheus_labels(**labels)} {stats['count']}")
+    return lines
+
+def prometheus_metrics():
+    """Body /metrics dalam format teks Prometheus (0.0.4): timer per tahap, latensi request Bybit dan efektivitas cache."""
+    stages, endpoints = stage_timers.stats(), bybit_http.stats()
+    caches = {"klines": cache.stats(), "predictions": prediction_cache.stats(), "responses": response_cache.stats()}
+    lines = prometheus_family("stage_duration_seconds", "histogram", "Time spent per hot-path stage.", [
+        line for stage, stats in sorted(stages.items()) for line in prometheus_histogram("stage_duration_seconds", stats, stage=stage)])
+    lines += prometheus_family("exchange_request_duration_seconds", "histogram", "Exchange HTTP request latency per endpoint.", [
+        line for path, stats in sorted(endpoints.items()) for line in prometheus_histogram("exchange_request_duration_seconds", stats, exchange="bybit", endpoint=path)])
+    lines += prometheus_family("exchange_requests_total", "counter", "Exchange HTTP requests per endpoint and outcome (status code or error).", [
+        f"exchange_requests_total{prometheus_labels(exchange='bybit', endpoint=path, outcome=outcome)} {count}"
+        for path, stats in sorted(endpoints.items()) for outcome, count in sorted(stats["outcomes"].items())])
+    lines += prometheus_family("cache_events_total", "counter", "Cache lookups and loads per outcome.", [
+        f"cache_events_total{prometheus_labels(cache=name, event=event)} {stats[event]}"
+        for name, stats in caches.items() for event in ("hits", "stale_hits", "misses", "waits", "evictions", "loads", "load_errors")])
+    lines += prometheus_family("cache_hit_ratio", "gauge", "Share of cache lookups served without a load, since start.", [
+        f"cache_hit_ratio{prometheus_labels(cache=name)} {(stats['hits'] + stats['stale_hits']) / max(1, stats['hits'] + stats['stale_hits'] + stats['misses']):g}"
+        for name, stats in caches.items()])
+    lines += prometheus_family("cache_entries", "gauge", "Entries held per cache.", [
+        f"cache_entries{prometheus_labels(cache=name)} {stats['size']}" for name, stats in caches.items()])
+    lines += prometheus_family("cache_inflight_loads", "gauge", "Loads in progress per cache (requests queued behind a fetch or prediction).", [
+        f"cache_inflight_loads{prometheus_labels(cache=name)} {stats['inflight']}" for name, stats in caches.items()])
+    return "\n".join(lines) + "\n"
+
+# --- Sampling Profiler ---
+profiler_lock = threading.Lock()  # Satu profil dalam satu waktu
+
+def is_loopback(address):
+    try: return ipaddress.ip_address(address).is_loopback
+    except ValueError: return False  # None, atau bukan alamat IP
+
+def thread_cpu_seconds(native_id):
+    """
+    Waktu CPU yang dipakai sebuah thread, dibaca dari clock CPU per-thread Linux (clock id yang diturunkan glibc dari tid:
+    CPUCLOCK_SCHED | CPUCLOCK_PERTHREAD_MASK). Tid yang sudah selesai gagal dengan EINVAL. None di platform lain.
+    """
+    if not sys.platform.startswith("linux"): return None
+    try: return time.clock_gettime((~native_id << 3) | 6)
+    except OSError: return None
+
+def sample_thread_stacks(seconds, hz, mode="cpu", thread_filter=""):
+    """
+    Mengambil sampel stack Python setiap thread (yang namanya memuat thread_filter) `hz` kali per detik selama `seconds`,
+    dan mengembalikan {collapsed stack: bobot}; akar stack adalah nama thread dengan angka diganti N ("Thread-N (_load)").
+    mode="wall" menghitung setiap sampel, termasuk thread yang sedang menunggu; mode="cpu" memberi bobot mikrodetik CPU
+    yang dipakai thread sejak sampel sebelumnya, sehingga thread yang diam tidak muncul. Thread pemanggil tidak ikut disampel.
+    """
+    stacks, labels, last_cpu, me, interval = Counter(), {}, {}, threading.get_ident(), 1 / hz
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            if ident == me or thread is None or thread_filter not in thread.name: continue
+            weight = 1
+            if mode == "cpu":
+                cpu, previous = thread_cpu_seconds(thread.native_id), last_cpu.get(ident)
+                last_cpu[ident] = cpu
+                if cpu is None or previous is None: continue
+                weight = round((cpu - previous) * 1e6)
+                if weight <= 0: continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in labels:
+                    labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                names.append(labels[code])
+                frame = frame.f_back
+            stacks[";".join([re.sub(r"\d+", "N", thread.name).replace(";", ":")] + names[::-1])] += weight
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return stacks
+
 # --- Flask Routes ---
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/api/candles')
+@stage_timers.timed("api_candles")
 def api_candles():
     symbol = request.args.get('symbol', 'BTCUSDT').upper()
     interval = request.args.get('interval', '15')
     num_predictions = request.args.get('predictions', 5, type=int)
     num_predictions = max(1, min(num_predictions, 20)) 
+    mode = request.args.get('mode', 'recursive')
+    since = request.args.get('since', type=int)  # ts candle terakhir yang sudah ada di chart
     if interval not in ALLOWED_INTERVALS: return jsonify({"error": "Invalid interval"}), 400
+    if mode not in PREDICTION_MODES: return jsonify({"error": "Invalid mode"}), 400
     try:
-        raw_candles = get_bybit_data(symbol, interval)
-        if not raw_candles: return jsonify({"error": "No data from Bybit API (check symbol)"}), 404
-        historical = [{"t": int(c[0]), "o": float(c[1]), "h": float(c[2]), "l": float(c[3]), "c": float(c[4]), "v": float(c[5])} for c in raw_candles]
-        predicted = predict_next_candles(raw_candles, num_predictions)
-        return jsonify({"symbol": symbol, "interval": interval, "candles": historical, "predicted": predicted})
+        candles = get_bybit_data(symbol, interval)
+        if not candles: return jsonify({"error": "No data from Bybit API (check symbol)"}), 404
+        # Dengan `since` di dalam jendela, hanya candle sejak ts itu yang dikirim (candle itu mungkin sudah berubah);
+        # "full" memberi tahu chart apakah datanya diganti semua atau cukup di-patch
+        delta = since is not None and candles.ts[0] <= since
+        shown = candles[bisect.bisect_left(candles.ts, since):] if delta else candles
+        return cached_json_response(candles_etag(candles, symbol, interval, mode, num_predictions, since if delta else "full"), lambda: {
+            "symbol": symbol, "interval": interval, "mode": mode, "full": not delta, "candles": shown.to_dicts(),
+            "predicted": get_prediction(symbol, interval, candles, num_predictions, mode)})
     except (ConnectionError, ValueError) as e: return jsonify({"error": str(e)}), 500
     except Exception as e:
         app.logger.error(f"An unexpected error occurred: {e}")
         return jsonify({"error": "An internal server error occurred."}), 500
 
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    return jsonify({**cache.stats(), "predictions": prediction_cache.stats()})
+
+@app.route('/api/http_stats')
+def api_http_stats():
+    return jsonify({"bybit": bybit_http.stats()})
+
+@app.route('/api/stage_stats')
+def api_stage_stats():
+    return jsonify(stage_timers.stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(prometheus_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/api/admin/profile')
+def profile_threads():
+    """
+    Menyampel semua thread selama ?seconds= (default PROFILER_DEFAULT_SECONDS) dan mengembalikan collapsed stacks
+    ("frame;frame bobot" per baris) yang siap untuk flamegraph.pl, inferno atau speedscope. ?mode=cpu (default) atau wall,
+    ?hz= laju sampling, ?thread= filter nama thread. Tidak ada biaya sampai dipanggil; request menunggu selama durasinya,
+    dan profil kedua selagi satu masih berjalan mendapat 409. Hanya untuk localhost, karena satu request
+    menahan thread server sampai PROFILER_MAX_SECONDS.
+    """
+    if not is_loopback(request.remote_addr): return jsonify({"error": "The profiler is only served to localhost"}), 403
+    seconds = max(0.1, min(request.args.get('seconds', PROFILER_DEFAULT_SECONDS, type=float), PROFILER_MAX_SECONDS))
+    hz = max(1, min(request.args.get('hz', PROFILER_DEFAULT_HZ, type=int), PROFILER_MAX_HZ))
+    mode = request.args.get('mode', 'cpu')
+    if mode not in ("cpu", "wall"): return jsonify({"error": "Invalid mode"}), 400
+    if mode == "cpu" and thread_cpu_seconds(threading.get_native_id()) is None:
+        return jsonify({"error": "Per-thread CPU clocks are not available here; use mode=wall"}), 400
+    if not profiler_lock.acquire(blocking=False): return jsonify({"error": "A profile is already running"}), 409
+    try: stacks = sample_thread_stacks(seconds, hz, mode, request.args.get('thread', ''))
+    finally: profiler_lock.release()
+    body = "".join(f"{stack} {weight}\n" for stack, weight in stacks.most_common())
+    return Response(body, content_type="text/plain; charset=utf-8",
+                    headers={"Content-Disposition": f"attachment; filename=profile-{mode}-{int(time.time())}.folded"})
+
 # --- Main Execution ---
 if __name__ == '__main__':
     if VOICE_ENABLED:
         get_all_bybit_tickers()
-        voice_thread = threading.Thread(target=voice_command_loop, daemon=True)
+        voice_thread = threading.Thread(target=voice_command_loop, name="voice_command_loop", daemon=True)
         voice_thread.start()
     
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,205 @@
+"""
+Offline benchmark suite for the prediction engine.
+
+Loads one of the apps (main.py, Quant_Watch.py or fully-automatic-project/main.py) as a
+module and times its prediction stages on seeded synthetic candles, so no exchange access
+is needed:
+
+- find_similar_patterns_pure_python: one neighbour search over the log returns
+- predict_next_candles: a full multi-step forecast, recursive and direct
+- walk_forward and simulate (bot only): the two halves of run_backtest_simulation,
+  i.e. WalkForwardPredictor over the whole history, then simulate_backtest on it
+
+History length, window_size, top_n and num_predictions are swept one at a time around
+the defaults. Every stage reports its time (best and median of the repeats) and its peak
+traced memory. Results are written as JSON; pass an earlier file as --baseline to compare.
+
+    python benchmark.py --target fully-automatic-project/main.py --output new.json --baseline old.json
+
+The speedups measured here must not change results; tests/ checks that with pytest
+(python -m pytest -q), reusing these generators.
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HISTORY_LENGTHS = [500, 2000, 10000, 100000]
+QUICK_HISTORY_LENGTHS = [500, 2000]
+SWEEP_HISTORY_LENGTH = 10000  # history used while sweeping the other parameters (2000 with --quick)
+WINDOW_SIZES = [10, 20, 40]
+TOP_NS = [1, 5, 20]
+NUM_PREDICTIONS = [1, 5, 20, 50]
+GENERATORS = ["random_walk", "regime"]
+INTERVAL_MS = 3600000
+MIN_REPEAT_SECONDS = 0.5  # repeat a stage until this much time has been measured...
+MAX_REPEATS = 5  # ...but never more often than this
+
+# --- Synthetic Candles ---
+def random_walk_candles(count, seed, start_price=100.0, volatility=0.01):
+    """Geometric random walk with constant volatility, as Bybit kline rows (lists of strings, oldest first)."""
+    rng = random.Random(seed)
+    return _candle_rows(rng, count, start_price, lambda: (0.0, volatility))
+
+def regime_switching_candles(count, seed, start_price=100.0, switch_probability=0.01):
+    """
+    Random walk whose drift and volatility follow a Markov chain of market regimes (bull,
+    bear, range, crash), so the pattern search sees trends, ranges and volatility clusters.
+    """
+    rng = random.Random(seed)
+    regimes = [(0.0008, 0.006), (-0.0008, 0.008), (0.0, 0.004), (-0.003, 0.02)]  # (drift, volatility) per candle
+    state = {"regime": regimes[0]}
+    def next_regime():
+        if rng.random() < switch_probability:
+            state["regime"] = rng.choice(regimes)
+        return state["regime"]
+    return _candle_rows(rng, count, start_price, next_regime)
+
+def _candle_rows(rng, count, price, regime):
+    rows, start_ts = [], 1_700_000_000_000
+    for i in range(count):
+        drift, volatility = regime()
+        open_price = price
+        price = open_price * math.exp(drift + volatility * rng.gauss(0, 1))
+        high = max(open_price, price) * (1 + abs(rng.gauss(0, volatility / 2)))
+        low = min(open_price, price) * (1 - abs(rng.gauss(0, volatility / 2)))
+        volume = rng.lognormvariate(3, 1)
+        rows.append([str(start_ts + i * INTERVAL_MS), repr(open_price), repr(high), repr(low), repr(price), repr(volume), repr(volume * price)])
+    return rows
+
+GENERATOR_FUNCTIONS = {"random_walk": random_walk_candles, "regime": regime_switching_candles}
+
+# --- Measurement ---
+def measure(function):
+    """
+    Runs `function` until MIN_REPEAT_SECONDS have been measured (at most MAX_REPEATS times),
+    then once more under tracemalloc for the peak memory, which tracing would distort.
+    """
+    durations = []
+    while len(durations) < MAX_REPEATS and (not durations or sum(durations) < MIN_REPEAT_SECONDS):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds_min": min(durations), "seconds_median": statistics.median(durations), "repeats": len(durations), "peak_kib": round(peak / 1024, 1)}
+
+def load_target(path):
+    """Imports an app script as a module; its Flask app is created but never started."""
+    spec = importlib.util.spec_from_file_location("benchmark_target", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# --- Stages ---
+def stage_cases(app, candles, generator, length, quick):
+    """Yields (stage, params, function) for every benchmarked call on `candles`."""
+    closes = candles.close.tolist()
+    log_returns = [math.log(closes[i] / closes[i - 1]) for i in range(1, len(closes))]
+    base = {"generator": generator, "history": length}
+    has_backtest = hasattr(app, "WalkForwardPredictor") and hasattr(app, "simulate_backtest")
+
+    def walk_forward(num_predictions=20, window_size=20, top_n=5):
+        return app.WalkForwardPredictor(candles, 50, num_predictions, "recursive", window_size, top_n)
+
+    sweep_length = 2000 if quick else SWEEP_HISTORY_LENGTH
+    windows = WINDOW_SIZES if length == sweep_length else [20]
+    top_ns = TOP_NS if length == sweep_length else [5]
+    horizons = NUM_PREDICTIONS if length == sweep_length else [20]
+
+    for window_size in windows:
+        for top_n in top_ns:
+            if window_size != 20 and top_n != 5: continue  # one parameter at a time
+            params = {**base, "window_size": window_size, "top_n": top_n}
+            yield "find_similar_patterns", params, lambda w=window_size, k=top_n: app.find_similar_patterns_pure_python(log_returns, w, k)
+            if has_backtest:
+                yield "walk_forward", {**params, "num_predictions": 20}, lambda w=window_size, k=top_n: walk_forward(20, w, k)
+    for num_predictions in horizons:
+        for mode in app.PREDICTION_MODES:
+            yield "predict_next_candles", {**base, "num_predictions": num_predictions, "mode": mode}, lambda n=num_predictions, m=mode: app.predict_next_candles(candles, n, m)
+        if has_backtest and num_predictions != 20:
+            yield "walk_forward", {**base, "window_size": 20, "top_n": 5, "num_predictions": num_predictions}, lambda n=num_predictions: walk_forward(n)
+    if has_backtest:
+        predictor = walk_forward()
+        yield "simulate", {**base, "num_predictions": 20}, lambda: app.simulate_backtest(predictor, candles.ts[0], 10.0, 10, 4.0)
+
+def run_suite(app, seed, generators, quick):
+    results = []
+    for generator in generators:
+        for length in QUICK_HISTORY_LENGTHS if quick else HISTORY_LENGTHS:
+            candles = app.CandleSeries.from_rows(GENERATOR_FUNCTIONS[generator](length, seed))
+            for stage, params, function in stage_cases(app, candles, generator, length, quick):
+                result = {"stage": stage, "params": params, **measure(function)}
+                print(f"{stage:<22} {json.dumps(params, sort_keys=True):<100} {result['seconds_min'] * 1000:>10.2f} ms {result['peak_kib']:>10.1f} KiB", flush=True)
+                results.append(result)
+    return results
+
+# --- Reporting ---
+def result_key(result):
+    return result["stage"], json.dumps(result["params"], sort_keys=True)
+
+def compare(results, baseline, tolerance):
+    """Prints the time and memory ratio against the baseline per stage; returns the regressions."""
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'stage':<22} {'params':<100} {'time':>8} {'memory':>8}")
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None: continue
+        time_ratio = result["seconds_min"] / old["seconds_min"] if old["seconds_min"] else float("inf")
+        memory_ratio = result["peak_kib"] / old["peak_kib"] if old["peak_kib"] else float("inf")
+        flag = "  REGRESSION" if time_ratio > 1 + tolerance else ""
+        print(f"{result['stage']:<22} {json.dumps(result['params'], sort_keys=True):<100} {time_ratio:>7.2f}x {memory_ratio:>7.2f}x{flag}")
+        if flag: regressions.append(result)
+    return regressions
+
+def git_commit(path):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(path)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the prediction engine on synthetic candles.")
+    parser.add_argument("--target", default=os.path.join("fully-automatic-project", "main.py"), help="app script to benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generator", choices=GENERATORS, action="append", help="candle generator (repeatable; default: all)")
+    parser.add_argument("--quick", action="store_true", help="short histories only")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="slowdown that counts as a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    app = load_target(args.target)
+    results = run_suite(app, args.seed, args.generator or GENERATORS, args.quick)
+    report = {
+        "meta": {"target": args.target, "commit": git_commit(args.target), "seed": args.seed, "quick": args.quick,
+                 "python": platform.python_version(), "platform": platform.platform(), "numpy": getattr(app, "np", None) is not None,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
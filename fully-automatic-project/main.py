@@ -11,40 +11,205 @@
 import time
 import requests
 import math
+import heapq
+import random
 import statistics
 import threading
 import json
 import logging
 import hmac
 import hashlib
+import base64
+import socket
+import struct
+import sys
 import os
+import itertools
+import bisect
+import re
+import ipaddress
+import gzip
+import zlib
+import mmap
+import shutil
+import signal
+import sqlite3
+import functools
+import multiprocessing
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
 from urllib.parse import urlencode
-from flask import Flask, jsonify, render_template_string, request
-from datetime import datetime
+from flask import Flask, Response, jsonify, render_template_string, request
+from werkzeug.serving import make_server
+from datetime import datetime, timezone
 # --- FIX: Import modules for robust requests ---
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+try: import fcntl # POSIX only: cross-process writer lock for the kline store
+except ImportError: fcntl = None
+# --- Optional: NumPy enables FFT cross-correlation for long pattern searches ---
+try: import numpy as np
+except ImportError: np = None
+# --- Optional: websocket-client enables the streaming market data feed (REST polling otherwise) ---
+try: import websocket
+except ImportError: websocket = None
 
 
 # --- Configuration ---
 ALLOWED_INTERVALS = ["15", "30", "60", "120", "240", "360", "720", "D", "W", "M"]
 BYBIT_API_URL = "https://api.bybit.com/v5/market"
 BINGX_API_URL = "https://open-api.bingx.com"
-SETTINGS_FILE = "settings.json"
+SETTINGS_FILE = "settings.json" # Imported into the state store once (older versions kept settings and the trade list in JSON files)
 TRADELIST_FILE = "tradelist.json"
+STATE_DB_FILE = "bot_state.db" # Shared by the HTTP worker processes and the trading engine (SQLite, WAL mode)
+STATE_POLL_SECONDS = 0.2 # How often each process checks the store for trade list changes made by the others
+STATE_JOURNAL_RETENTION_DAYS = 90 # Position, trade list, settings and status events kept in the store's journal
+STATE_COMPACT_SECONDS = 3600 # How often the engine prunes the journal and truncates the store's WAL file
+SERVE_WORKERS = max(2, os.cpu_count() or 1) # HTTP worker processes in --serve mode
+ENGINE_ADMIN_PORT = 5001 # --serve mode: the engine process's own /metrics and /api/admin/profile, on localhost only
 TRADE_COOLDOWN_SECONDS = 300 # 5 minutes
+PREDICTION_MODES = ["recursive", "direct"] # recursive: re-search after each predicted candle; direct: one search for the whole path
+FFT_MIN_SERIES_LENGTH = 2048 # Below this, the pure Python dot profile beats the FFT
+KLINE_STORE_DIR = "kline_store"
+HISTORY_DOWNLOAD_CONCURRENCY = 4 # Parallel kline range requests per history download
+ANALYSIS_CONCURRENCY = 16 # Trade list items analyzed at once
+ANALYSIS_CLOSE_DELAY_SECONDS = 2 # Grace period after a candle closes before its item is analyzed, so Bybit serves the closed candle
+ANALYSIS_RETRY_SECONDS = 30 # Retry period while an item's newest closed candle is not available yet (or its analysis failed)
+BYBIT_REQUESTS_PER_SECOND = 10 # Client-side cap per Bybit endpoint, e.g. all kline requests (history downloads and analysis)
+BINGX_REQUESTS_PER_SECOND = 10 # Client-side cap per BingX endpoint
+BINGX_ORDERS_PER_SECOND = 5 # Client-side cap on order placement, kept well under BingX's per-account limit
+HTTP_MAX_RETRIES = 3 # Retries of idempotent (GET) requests on 429/5xx
+HTTP_MAX_BACKOFF_SECONDS = 30 # A longer server-requested wait fails the request instead of holding a worker thread
+HTTP_LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000) # Upper bounds of the per-endpoint latency histograms
+STAGE_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000) # Upper bounds of the per-stage timing histograms
+KLINE_PAGE_SIZE = 1000 # Bybit's maximum kline limit per request
+CACHE_TTL_SECONDS = 15 # Refresh period of the forming candle in the live kline cache; closed candles never expire
+CACHE_MAX_ENTRIES = 256 # symbol/interval pairs kept in the live kline cache
+BYBIT_WS_URL = "wss://stream.bybit.com/v5/public/linear" # Overridden by the "market_data_url" setting (e.g. the stand-in feed server)
+MARKET_DATA_PING_SECONDS = 20 # Bybit closes public streams that stay silent longer than this
+MARKET_DATA_POLL_SECONDS = 2 # REST ticker polling period while no stream is available
+FEED_SERVER_PORT = 8765
+PROFILER_DEFAULT_SECONDS = 10
+PROFILER_MAX_SECONDS = 120 # Longest profile one request may take
+PROFILER_DEFAULT_HZ = 100
+PROFILER_MAX_HZ = 250 # Sampling rate cap, so a profile never costs more than a sliver of one core
+STATUS_FEED_HISTORY = 1000 # Trade list changes kept for dashboards catching up (or resuming with Last-Event-ID)
+PNL_STATUS_MIN_SECONDS = 5 # Live PnL of a position is written to the store (and pushed to dashboards) at most this often...
+PNL_STATUS_MIN_CHANGE_PCT = 0.1 # ...and only once its PnL % moved by this much; every tick would be a write transaction
+SSE_MIN_INTERVAL_SECONDS = 0.5 # Changes within this window reach a dashboard as one coalesced batch
+SSE_KEEPALIVE_SECONDS = 15 # Idle streams send a comment line this often, so proxies keep them open and dead clients are noticed
+INTERVAL_MS = {"D": 86400000, "W": 604800000, "M": 31 * 86400000} # "M" uses the longest month, so a candle is never stored before it closes
+PATTERN_LIBRARY_DIR = "pattern_library"
+PATTERN_LSH_TABLES = 16 # More tables: better recall, more candidates to rerank per query
+PATTERN_LSH_BITS = 12 # More bits: smaller buckets, fewer candidates per table
+PATTERN_LIBRARY_DAYS = 365 # Default history indexed per (symbol, interval)
+PREDICTION_CACHE_DIR = "prediction_cache"
+PREDICTION_CACHE_MAX_ENTRIES = 1024 # Forecasts kept in memory
+PREDICTION_MODEL_VERSION = 1 # Bump when the forecaster changes, so forecasts cached on disk by older code are ignored
+RESPONSE_CACHE_MAX_ENTRIES = 256 # Serialized /api/candles bodies kept in memory
 
-# --- FIX: Create a robust requests session with retries ---
-session = requests.Session()
-retry_strategy = Retry(
-    total=5,  # Total number of retries
-    backoff_factor=1,  # Wait 1s, 2s, 4s, 8s, 16s between retries
-    status_forcelist=[429, 500, 502, 503, 504],  # Retry on these HTTP status codes
-    allowed_methods=["HEAD", "GET", "OPTIONS"] # Only retry on safe methods
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
+# --- Hot-path Instrumentation ---
+class StageTimers:
+    # Latency histogram per hot-path stage (Bybit fetches, predictions, BingX requests, lock waits, trade worker cycles) and
+    # gauges for queue depths, so a bot falling behind shows where its time goes. Served in Prometheus' format by /metrics.
+    def __init__(self, buckets_ms=STAGE_LATENCY_BUCKETS_MS): self.buckets_ms, self.lock, self.stages, self.gauges = buckets_ms, threading.Lock(), {}, {}
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.setdefault(stage, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(self.buckets_ms) + 1)})
+            stats["count"] += 1; stats["sum_ms"] += seconds * 1000; stats["buckets"][bisect.bisect_left(self.buckets_ms, seconds * 1000)] += 1
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(stage, time.perf_counter() - started)
+    def timed(self, stage):
+        # Decorator: every call of the function is timed as `stage`, whether it returns or raises
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage): return function(*args, **kwargs)
+            return wrapper
+        return decorate
+    def add(self, gauge, delta):
+        with self.lock: self.gauges[gauge] = self.gauges.get(gauge, 0) + delta
+    def stats(self):
+        # Same layout as ExchangeClient.stats() per stage, plus the current gauge values
+        with self.lock: return {"stages": {stage: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3), "buckets": dict(zip([*map(str, self.buckets_ms), "+Inf"], stats["buckets"]))} for stage, stats in self.stages.items()}, "gauges": dict(self.gauges)}
+
+stage_timers = StageTimers()
+
+# --- Client-side rate limiting ---
+class TokenBucket:
+    # Thread-safe token bucket: acquire() blocks until a token is available, refilling at `rate` tokens per second
+    def __init__(self, rate, capacity=None): self.rate, self.capacity = rate, capacity or rate; self.tokens, self.updated, self.lock, self.paused_until = self.capacity, time.monotonic(), threading.Lock(), 0.0
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic(); self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate); self.updated = now
+                if now < self.paused_until: wait = self.paused_until - now
+                elif self.tokens >= 1: self.tokens -= 1; return
+                else: wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    def pause(self, seconds):
+        # Server-requested backoff: no token is handed out for `seconds`, and the bucket restarts empty
+        with self.lock: self.paused_until = max(self.paused_until, time.monotonic() + seconds); self.tokens, self.updated = 0.0, self.paused_until
+
+# --- Exchange HTTP Clients ---
+class ExchangeClient:
+    # Pooled HTTP client for one exchange: a keep-alive Session whose connection pool fits the threads using it, a token bucket per
+    # endpoint (exchange limits are per endpoint), backoff driven by the exchange's rate limit headers, and a latency histogram per
+    # endpoint. A 429 pauses the endpoint's bucket for every thread instead of one thread sleeping through a blind retry schedule.
+    # Only idempotent GETs are retried (on 429/5xx); orders are never sent twice.
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    def __init__(self, base_url, pool_size, rate_limits, default_rate):
+        self.base_url, self.session, self.lock = base_url, requests.Session(), threading.Lock()
+        # Blocking pool: threads beyond pool_size wait for a kept-alive connection instead of opening throwaway ones.
+        # urllib3 retries connection failures only; statuses are handled below.
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True, max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5, respect_retry_after_header=False))
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.buckets, self.default_rate, self.latency = {path: TokenBucket(rate) for path, rate in rate_limits.items()}, default_rate, {}
+    def bucket(self, path):
+        with self.lock: return self.buckets.setdefault(path, TokenBucket(self.default_rate))
+
+    def request(self, method, path, params=None, headers=None, timeout=(5, 10)): # 5s connect, 10s read
+        # Returns the final response (callers raise_for_status() as before); connection failures raise requests' exceptions
+        bucket, retries = self.bucket(path), HTTP_MAX_RETRIES if method.upper() == "GET" else 0
+        for attempt in itertools.count():
+            bucket.acquire(); started = time.monotonic()
+            try: response = self.session.request(method, self.base_url + path, params=params, headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException: self._observe(path, time.monotonic() - started, "error"); raise
+            self._observe(path, time.monotonic() - started, str(response.status_code))
+            wait = self._limit_wait(response)
+            if wait is not None: bucket.pause(min(wait, HTTP_MAX_BACKOFF_SECONDS)) # Also when the quota just ran out on a success
+            if response.status_code not in self.RETRY_STATUSES or attempt >= retries: return response
+            wait = 2 ** attempt if wait is None else wait
+            if wait > HTTP_MAX_BACKOFF_SECONDS: return response
+            if response.status_code != 429: time.sleep(wait) # A 429 waits in bucket.acquire(), like every other thread
+    def _limit_wait(self, response):
+        # Seconds until the exchange accepts requests again: Retry-After, or Bybit's reset timestamp once its quota is exhausted
+        headers = response.headers
+        try:
+            if headers.get("Retry-After"): return max(0.0, float(headers["Retry-After"]))
+            if headers.get("X-Bapi-Limit-Reset-Timestamp") and (response.status_code == 429 or headers.get("X-Bapi-Limit-Status") == "0"):
+                return max(0.0, int(headers["X-Bapi-Limit-Reset-Timestamp"]) / 1000 - time.time())
+        except ValueError: pass
+        return 1.0 if response.status_code == 429 else None
+
+    def _observe(self, path, seconds, outcome):
+        with self.lock:
+            stats = self.latency.setdefault(path, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1), "outcomes": {}})
+            stats["count"] += 1; stats["sum_ms"] += seconds * 1000; stats["buckets"][bisect.bisect_left(HTTP_LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+    def stats(self):
+        # Per endpoint: request count, total latency, requests per latency bucket (keyed by upper bound in ms) and per status
+        with self.lock: return {path: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3), "buckets": dict(zip([*map(str, HTTP_LATENCY_BUCKETS_MS), "+Inf"], stats["buckets"])), "outcomes": dict(stats["outcomes"])} for path, stats in self.latency.items()}
+
+# Pools fit the threads issuing requests: the analysis pool, history downloads, the market data bus and Flask handlers
+bybit_http = ExchangeClient(BYBIT_API_URL, ANALYSIS_CONCURRENCY + HISTORY_DOWNLOAD_CONCURRENCY + 4, {"/kline": BYBIT_REQUESTS_PER_SECOND, "/tickers": BYBIT_REQUESTS_PER_SECOND}, BYBIT_REQUESTS_PER_SECOND)
+bingx_http = ExchangeClient(BINGX_API_URL, ANALYSIS_CONCURRENCY + 4, {"/openApi/swap/v2/trade/order": BINGX_ORDERS_PER_SECOND}, BINGX_REQUESTS_PER_SECOND)
 
 # --- Helper functions for JSON persistence ---
 def load_from_json(filename, default_data):
@@ -55,27 +220,226 @@ def load_from_json(filename, default_data):
     return default_data
 
 def save_to_json(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+    # Written to a temporary file, synced and renamed over the old one, so a crash leaves either the old or the new file
+    with open(filename + ".tmp", 'w') as f:
+        json.dump(data, f, indent=4); f.flush(); os.fsync(f.fileno())
+    os.replace(filename + ".tmp", filename)
 
-# --- Global State Management ---
-SETTINGS = load_from_json(SETTINGS_FILE, {
+# --- Shared State Store (SQLite) ---
+DEFAULT_SETTINGS = {
     "bingx_api_key": "YOUR_BINGX_API_KEY",
     "bingx_secret_key": "YOUR_BINGX_SECRET_KEY",
     "mode": "demo",
     "risk_usdt": 10,
     "leverage": 10,
-    "trigger_percentage": 4.0  # NEW: Configurable trade entry threshold
-})
-TRADE_LIST = load_from_json(TRADELIST_FILE, [])
-BOT_STATUS = {}
-ACTIVE_POSITIONS = {}
-
-# --- Thread-safe Locks ---
-settings_lock = threading.Lock()
-trade_list_lock = threading.Lock()
-status_lock = threading.Lock()
-positions_lock = threading.Lock()
+    "trigger_percentage": 4.0,  # NEW: Configurable trade entry threshold
+    "prediction_mode": "recursive",  # "recursive" or "direct" (see PREDICTION_MODES)
+    "use_pattern_library": False  # Search the cross-symbol pattern library instead of the symbol's own candles
+}
+
+class StateStore:
+    # Bot state shared by every process: the settings, the trade list, the status per item, the open positions the bot-side TP/SL
+    # protects, the analysis schedule and the trade list change feed, in one SQLite database in WAL mode (readers never block the
+    # writer). Each thread of each process opens its own connection, and every change is one short IMMEDIATE transaction, so a
+    # read-modify-write never interleaves with another process's and the other processes see it as soon as it commits.
+    # Every event (a position opened or closed, a trade list item added or removed, a settings change, a new status message) is
+    # also appended to the journal table in the same transaction: one insert per event, never a rewrite of the whole state.
+    # Position changes are synced to disk before they return (synchronous=FULL), since they follow an order the exchange already
+    # filled; a restarted engine resumes the TP/SL checks of the positions it finds. settings.json and tradelist.json of older
+    # versions are imported once.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS trade_list (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, symbol TEXT NOT NULL, interval TEXT NOT NULL, item TEXT NOT NULL, UNIQUE (symbol, interval));
+        CREATE TABLE IF NOT EXISTS bot_status (item_id TEXT PRIMARY KEY, status TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS positions (item_id TEXT PRIMARY KEY, position TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS next_runs (item_id TEXT PRIMARY KEY, deadline REAL);
+        CREATE TABLE IF NOT EXISTS feed (version INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, kind TEXT NOT NULL, item_id TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS journal_ts ON journal (ts);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+    def __init__(self, path): self.path, self.local, self.init_lock, self.initialized_pid = path, threading.local(), threading.Lock(), None
+    def _connection(self):
+        # Opened lazily, so importing the module touches no file. A forked child never uses its parent's connection.
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.pid == os.getpid(): return conn
+        self.initialize()
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False); conn.execute("PRAGMA synchronous=NORMAL")
+        self.local.conn, self.local.pid = conn, os.getpid(); return conn
+    def initialize(self):
+        with self.init_lock:
+            if self.initialized_pid == os.getpid(): return
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL"); conn.executescript(self.SCHEMA); conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("SELECT 1 FROM meta WHERE key = 'imported_json'").fetchone() is None:
+                    conn.executemany("INSERT OR IGNORE INTO settings VALUES (?, ?)", [(key, json.dumps(value)) for key, value in load_from_json(SETTINGS_FILE, {}).items()])
+                    conn.executemany("INSERT OR IGNORE INTO trade_list (id, symbol, interval, item) VALUES (?, ?, ?, ?)", [(item['id'], item['symbol'], item['interval'], json.dumps(item)) for item in load_from_json(TRADELIST_FILE, [])])
+                    conn.execute("INSERT INTO meta VALUES ('imported_json', '1')")
+                conn.execute("COMMIT")
+            finally: conn.close()
+            self.initialized_pid = os.getpid()
+    def close(self):
+        # Closes this thread's connection, e.g. before forking
+        conn = getattr(self.local, "conn", None); self.local.conn = None
+        if conn is not None and self.local.pid == os.getpid(): conn.close()
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE", durable=False):
+        # IMMEDIATE takes the write lock up front; DEFERRED reads one consistent snapshot. A durable commit also survives a power
+        # loss (WAL mode with synchronous=NORMAL only loses the newest commits then, never consistency, so the rest skip the fsync)
+        conn = self._connection()
+        if durable: conn.execute("PRAGMA synchronous=FULL")
+        try:
+            conn.execute(f"BEGIN {mode}")
+            try: yield conn
+            except BaseException: conn.execute("ROLLBACK"); raise
+            conn.execute("COMMIT")
+        finally:
+            if durable: conn.execute("PRAGMA synchronous=NORMAL")
+    def _publish(self, conn, kind, data):
+        version = conn.execute("INSERT INTO feed (kind, data) VALUES (?, ?)", (kind, json.dumps(data))).lastrowid
+        conn.execute("DELETE FROM feed WHERE version <= ?", (version - STATUS_FEED_HISTORY,))
+    def _record(self, conn, kind, item_id, data): conn.execute("INSERT INTO journal (ts, kind, item_id, data) VALUES (?, ?, ?, ?)", (time.time(), kind, item_id, json.dumps(data)))
+    def _trade_list(self, conn): return [json.loads(item) for item, in conn.execute("SELECT item FROM trade_list ORDER BY seq")]
+    def _set_status(self, conn, item_id, status):
+        # None removes the entry; only actual changes are pushed to the dashboards, and only a new message (not a PnL tick) is journaled
+        row = conn.execute("SELECT status FROM bot_status WHERE item_id = ?", (item_id,)).fetchone(); previous = json.loads(row[0]) if row else None
+        if previous == status: return
+        if status is None: conn.execute("DELETE FROM bot_status WHERE item_id = ?", (item_id,))
+        else: conn.execute("INSERT OR REPLACE INTO bot_status VALUES (?, ?)", (item_id, json.dumps(status)))
+        self._publish(conn, "status", {item_id: status})
+        if (previous or {}).get("message") != (status or {}).get("message"): self._record(conn, "status", item_id, status)
+
+    def settings(self): return {**DEFAULT_SETTINGS, **{key: json.loads(value) for key, value in self._connection().execute("SELECT key, value FROM settings")}}
+    def update_settings(self, changes):
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)", [(key, json.dumps(value)) for key, value in changes.items()])
+            self._record(conn, "settings", None, {key: "***" if "key" in key else value for key, value in changes.items()}) # API keys stay out of the journal
+    def trade_list(self): return self._trade_list(self._connection())
+    def add_trade_item(self, item, status):
+        # False when the list already has the item's symbol and interval
+        with self.transaction() as conn:
+            if conn.execute("INSERT OR IGNORE INTO trade_list (id, symbol, interval, item) VALUES (?, ?, ?, ?)", (item['id'], item['symbol'], item['interval'], json.dumps(item))).rowcount == 0: return False
+            self._record(conn, "trade_add", item['id'], item); self._set_status(conn, item['id'], status); self._publish(conn, "trade_list", self._trade_list(conn)); return True
+    def remove_trade_item(self, item_id):
+        # A position still open goes with the item; the journal keeps it, since the bot no longer protects it
+        with self.transaction(durable=True) as conn:
+            item = conn.execute("SELECT item FROM trade_list WHERE id = ?", (item_id,)).fetchone(); position = conn.execute("SELECT position FROM positions WHERE item_id = ?", (item_id,)).fetchone()
+            for table in ("trade_list", "positions", "next_runs"): conn.execute(f"DELETE FROM {table} WHERE {'id' if table == 'trade_list' else 'item_id'} = ?", (item_id,))
+            if item: self._record(conn, "trade_remove", item_id, {"item": json.loads(item[0]), "position": json.loads(position[0]) if position else None})
+            self._set_status(conn, item_id, None); self._publish(conn, "trade_list", self._trade_list(conn))
+    def status(self, item_id):
+        row = self._connection().execute("SELECT status FROM bot_status WHERE item_id = ?", (item_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    def set_status(self, item_id, status):
+        with self.transaction() as conn: self._set_status(conn, item_id, status)
+    def positions(self): return {item_id: json.loads(position) for item_id, position in self._connection().execute("SELECT item_id, position FROM positions")}
+    def position(self, item_id):
+        row = self._connection().execute("SELECT position FROM positions WHERE item_id = ?", (item_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    def open_position(self, item_id, position, reason, clear_status=False):
+        with self.transaction(durable=True) as conn:
+            conn.execute("INSERT OR REPLACE INTO positions VALUES (?, ?)", (item_id, json.dumps(position))); self._record(conn, "position_open", item_id, {"position": position, "reason": reason})
+            if clear_status: self._set_status(conn, item_id, None)
+    def close_position(self, item_id, status, reason):
+        # Removes the position (if it is still open) and sets the item's status in one transaction
+        with self.transaction(durable=True) as conn:
+            row = conn.execute("SELECT position FROM positions WHERE item_id = ?", (item_id,)).fetchone()
+            if row: conn.execute("DELETE FROM positions WHERE item_id = ?", (item_id,)); self._record(conn, "position_close", item_id, {"position": json.loads(row[0]), "reason": reason})
+            self._set_status(conn, item_id, status)
+    def next_runs(self): return dict(self._connection().execute("SELECT item_id, deadline FROM next_runs"))
+    def set_next_runs(self, deadlines):
+        # {item id: epoch seconds, None while running}; written by the trading engine's scheduler
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO next_runs VALUES (?, ?)", deadlines.items()); self._publish(conn, "next_runs", deadlines)
+    def clear_next_runs(self):
+        with self.transaction() as conn: conn.execute("DELETE FROM next_runs")
+    def snapshot(self):
+        # Trade list, statuses and next runs as of one instant, with the feed version they include
+        with self.transaction("DEFERRED") as conn:
+            return {"trade_list": self._trade_list(conn), "bot_status": {item_id: json.loads(status) for item_id, status in conn.execute("SELECT item_id, status FROM bot_status")},
+                    "next_runs": dict(conn.execute("SELECT item_id, deadline FROM next_runs"))}, self._feed_version(conn)
+    def _feed_version(self, conn): return conn.execute("SELECT COALESCE(MAX(version), 0) FROM feed").fetchone()[0]
+    def feed_version(self): return self._feed_version(self._connection())
+    def feed_changes(self, after, until):
+        # (oldest version still kept, [(version, kind, data)] in (after, until])
+        conn = self._connection(); oldest = conn.execute("SELECT MIN(version) FROM feed").fetchone()[0]
+        return oldest, [(version, kind, json.loads(data)) for version, kind, data in conn.execute("SELECT version, kind, data FROM feed WHERE version > ? AND version <= ? ORDER BY version", (after, until))]
+    def journal(self, after=0, limit=100, item_id=None):
+        # Journal entries with seq > after, oldest first, optionally of one item
+        query, args = "SELECT seq, ts, kind, item_id, data FROM journal WHERE seq > ?", [after]
+        if item_id is not None: query += " AND item_id = ?"; args.append(item_id)
+        return [{"seq": seq, "ts": ts, "kind": kind, "item_id": item, "data": json.loads(data)} for seq, ts, kind, item, data in self._connection().execute(query + " ORDER BY seq LIMIT ?", (*args, limit))]
+    def recover(self):
+        # Run by a starting engine. Opening the store already replayed (or discarded) the WAL frames a crash left behind; this checks
+        # the database and returns the open positions, whose TP/SL the engine goes on checking.
+        conn = self._connection(); problems = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        if problems != ["ok"]: raise sqlite3.DatabaseError(f"{self.path} is damaged: {'; '.join(problems[:5])}")
+        return self.positions()
+    def compact(self, retention_seconds):
+        # Drops journal entries older than the retention, then copies the WAL into the database and truncates it, so it never
+        # grows without bound and a restart has little to replay. The checkpoint stops short while a reader still needs older
+        # frames and the next run finishes it. Returns (entries dropped, WAL frames left).
+        with self.transaction() as conn: dropped = conn.execute("DELETE FROM journal WHERE ts < ?", (time.time() - retention_seconds,)).rowcount
+        conn = self._connection(); conn.execute("PRAGMA optimize"); busy, wal_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return dropped, max(0, wal_frames - checkpointed) if busy else 0
+
+state = StateStore(STATE_DB_FILE)
+
+item_locks, item_locks_guard = {}, threading.Lock()
+
+@contextmanager
+def trade_item_lock(item_id):
+    # Serializes order decisions per trade list item between the TP/SL loop and the analysis pool (both in the engine); the wait is timed
+    with item_locks_guard: lock = item_locks.setdefault(item_id, threading.Lock())
+    with stage_timers.timer("trade_item_lock_wait"): lock.acquire()
+    try: yield
+    finally: lock.release()
+
+# --- Trade List Push (Server-Sent Events) ---
+def sse_event(kind, data, version): return f"id: {version}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+class StatusFeed:
+    # Trade list UI changes, streamed by /api/trade_list/stream instead of every dashboard polling the whole list. Writers append
+    # only what they changed to the store's feed table, in the transaction making the change: ("status", {id: status or None}),
+    # ("next_runs", {id: epoch or None}) or ("trade_list", list), so every process sees them. One watcher thread per process polls
+    # the newest version every STATE_POLL_SECONDS and wakes that process's dashboards, which wait on the feed's own condition.
+    # The batch rendered for one dashboard is reused by every other dashboard of the process at the same version.
+    def __init__(self, store): self.store, self.cond, self.version, self.rendered, self.watcher = store, threading.Condition(), 0, {}, None # from version -> SSE text
+    def current(self):
+        with self.cond:
+            if self.watcher is None or not self.watcher.is_alive(): # Not started yet, or this is a forked child
+                self.version = self.store.feed_version(); self.watcher = threading.Thread(target=self._watch, name="status_feed", daemon=True); self.watcher.start()
+            return self.version
+    def _watch(self):
+        while True:
+            time.sleep(STATE_POLL_SECONDS)
+            try: version = self.store.feed_version()
+            except sqlite3.Error as e: app.logger.warning(f"Status feed poll failed: {e}"); continue
+            with self.cond: self._update_locked(version)
+    def _update_locked(self, version):
+        if version != self.version: self.version = version; self.rendered.clear(); self.cond.notify_all()
+    def wait(self, version, timeout):
+        # (new version, SSE text of the changes after `version` coalesced per kind, latest entry winning). The text is "" when nothing
+        # changed within `timeout`, and None when `version` is not in the history any more: the dashboard must resync from a snapshot.
+        self.current()
+        with self.cond:
+            if version > self.version: self._update_locked(self.store.feed_version()) # The watcher may lag behind a snapshot just taken
+            if version > self.version: return self.version, None
+            if self.version == version: self.cond.wait(timeout)
+            if self.version == version: return version, ""
+            latest = self.version
+            if version not in self.rendered:
+                oldest, changes = self.store.feed_changes(version, latest)
+                if oldest is None or oldest > version + 1: return latest, None
+                merged = {}
+                for _, kind, data in changes:
+                    if kind == "trade_list": merged[kind] = data
+                    else: merged.setdefault(kind, {}).update(data)
+                self.rendered[version] = "".join(sse_event(kind, data, latest) for kind, data in merged.items())
+            return latest, self.rendered[version]
+
+status_feed = StatusFeed(state)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
@@ -123,24 +487,29 @@ HTML_TEMPLATE = """
 </head>
 <body>
     <div id="chartdiv"></div><div class="controls-wrapper"><button id="toggle-controls-btn" title="Toggle Controls">☰</button><div class="controls-overlay"><label for="symbol">Symbol:</label><input type="text" id="symbol" value="BTCUSDT"><label for="interval">Timeframe:</label><select id="interval"><option value="60">1 hour</option><option value="240">4 hours</option><option value="D">Daily</option></select><label for="num_predictions">Predictions:</label><input type="number" id="num_predictions" value="20" min="1" max="50"><button id="fetchButton">Fetch</button><button id="add-to-list-btn" class="add-btn">Add to Trade List</button><div id="status"></div></div></div>
-    <div class="panels-container"><div id="settings-panel" class="panel"><h3>Settings</h3><div class="setting-item"><label for="api-key">API Key:</label><input type="text" id="api-key"></div><div class="setting-item"><label for="secret-key">Secret Key:</label><input type="password" id="secret-key"></div><div class="setting-item"><label for="mode">Mode:</label><select id="mode"><option value="demo">Demo</option><option value="live">Live</option></select></div><div class="setting-item"><label for="risk-usdt">Risk (USDT):</label><input type="number" id="risk-usdt" value="10"></div><div class="setting-item"><label for="leverage">Leverage:</label><input type="number" id="leverage" value="10"></div><div class="setting-item"><label for="trigger-percentage">Trigger %:</label><input type="number" id="trigger-percentage" value="4.0" step="0.1" min="0"></div><button id="save-settings-btn">Save Settings</button></div><div id="tradelist-panel" class="panel"><h3>Live Trade List</h3><table id="trade-list-table"><thead><tr><th>Symbol</th><th>Timeframe</th><th>Status</th><th>PnL</th><th>Manual Control</th></tr></thead><tbody></tbody></table></div><div id="backtest-panel" class="panel"><h3>Backtest <button id="toggle-backtest-size-btn" title="Maximize">□</button></h3><div id="backtest-controls"><input type="text" id="backtest-symbol" value="BTCUSDT"><select id="backtest-interval"><option value="60">1 hour</option><option value="240">4 hours</option><option value="D">Daily</option></select><input type="date" id="backtest-start"><input type="date" id="backtest-end"><button id="run-backtest-btn">Run</button><div id="backtest-status" style="color: #ffc107;"></div></div><div id="backtest-results"><div id="equitychartdiv"></div><div id="backtest-stats"></div><div id="backtest-trades-table-container" style="height: 80px; overflow-y: auto;"><table id="backtest-trades-table" class="trade-list-table"><thead><tr><th>Exit Time</th><th>Side</th><th>PnL</th><th>Return %</th><th>Reason</th></tr></thead><tbody></tbody></table></div></div></div></div>
+    <div class="panels-container"><div id="settings-panel" class="panel"><h3>Settings</h3><div class="setting-item"><label for="api-key">API Key:</label><input type="text" id="api-key"></div><div class="setting-item"><label for="secret-key">Secret Key:</label><input type="password" id="secret-key"></div><div class="setting-item"><label for="mode">Mode:</label><select id="mode"><option value="demo">Demo</option><option value="live">Live</option></select></div><div class="setting-item"><label for="risk-usdt">Risk (USDT):</label><input type="number" id="risk-usdt" value="10"></div><div class="setting-item"><label for="leverage">Leverage:</label><input type="number" id="leverage" value="10"></div><div class="setting-item"><label for="trigger-percentage">Trigger %:</label><input type="number" id="trigger-percentage" value="4.0" step="0.1" min="0"></div><div class="setting-item"><label for="prediction-mode">Prediction:</label><select id="prediction-mode"><option value="recursive">Recursive</option><option value="direct">Direct</option></select></div><div class="setting-item"><label for="use-pattern-library">Pattern Library:</label><input type="checkbox" id="use-pattern-library"></div><button id="save-settings-btn">Save Settings</button></div><div id="tradelist-panel" class="panel"><h3>Live Trade List</h3><table id="trade-list-table"><thead><tr><th>Symbol</th><th>Timeframe</th><th>Status</th><th>PnL</th><th>Next Analysis</th><th>Manual Control</th></tr></thead><tbody></tbody></table></div><div id="backtest-panel" class="panel"><h3>Backtest <button id="toggle-backtest-size-btn" title="Maximize">□</button></h3><div id="backtest-controls"><input type="text" id="backtest-symbol" value="BTCUSDT"><select id="backtest-interval"><option value="60">1 hour</option><option value="240">4 hours</option><option value="D">Daily</option></select><input type="date" id="backtest-start"><input type="date" id="backtest-end"><button id="run-backtest-btn">Run</button><div id="backtest-status" style="color: #ffc107;"></div></div><div id="backtest-results"><div id="equitychartdiv"></div><div id="backtest-stats"></div><div id="backtest-trades-table-container" style="height: 80px; overflow-y: auto;"><table id="backtest-trades-table" class="trade-list-table"><thead><tr><th>Exit Time</th><th>Side</th><th>PnL</th><th>Return %</th><th>Reason</th></tr></thead><tbody></tbody></table></div></div></div></div>
 <script>
 document.addEventListener('DOMContentLoaded', function () {
     let root, chart, equityRoot;
     async function manualTrade(side, symbol, id) { if (!confirm(`Are you sure you want to place a manual ${side.toUpperCase()} order for ${symbol}?`)) return; try { const response = await fetch('/api/manual_trade', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ side, symbol, id }) }); const result = await response.json(); alert(result.message || result.error); } catch (error) { alert(`Error placing manual trade: ${error}`); } }
     async function manualClose(symbol, id) { if (!confirm(`Are you sure you want to close the position for ${symbol}?`)) return; try { const response = await fetch('/api/manual_close', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ symbol, id }) }); const result = await response.json(); alert(result.message || result.error); } catch (error) { alert(`Error closing position: ${error}`); } }
-    async function refreshTradeList() { const response = await fetch('/api/trade_list'); const { trade_list, bot_status } = await response.json(); const tableBody = document.querySelector('#trade-list-table tbody'); tableBody.innerHTML = ''; trade_list.forEach(item => { const status = bot_status[item.id] || { message: "Initializing...", color: "#fff" }; let pnlCell = '<td>-</td>'; if (status.pnl !== undefined) { const pnl = status.pnl; const pnl_pct = status.pnl_pct; const pnlColor = pnl > 0 ? '#28a745' : (pnl < 0 ? '#dc3545' : '#fff'); pnlCell = `<td style="color: ${pnlColor}; font-weight: bold;">${pnl.toFixed(2)} <span style="font-size:0.8em; opacity: 0.8;">(${pnl_pct.toFixed(2)}%)</span></td>`; } const row = `<tr><td>${item.symbol}</td><td>${item.interval_text}</td><td style="color:${status.color}">${status.message}</td>${pnlCell}<td><button class="manual-trade-btn long-btn" data-id="${item.id}" data-symbol="${item.symbol}">Long</button><button class="manual-trade-btn short-btn" data-id="${item.id}" data-symbol="${item.symbol}">Short</button><button class="manual-trade-btn close-btn" data-id="${item.id}" data-symbol="${item.symbol}">Close</button><button class="remove-btn" data-id="${item.id}">X</button></td></tr>`; tableBody.insertAdjacentHTML('beforeend', row); }); document.querySelectorAll('.remove-btn').forEach(btn => { btn.addEventListener('click', () => removeTradeItem(btn.dataset.id)); }); document.querySelectorAll('.long-btn').forEach(btn => { btn.addEventListener('click', () => manualTrade('long', btn.dataset.symbol, btn.dataset.id)); }); document.querySelectorAll('.short-btn').forEach(btn => { btn.addEventListener('click', () => manualTrade('short', btn.dataset.symbol, btn.dataset.id)); }); document.querySelectorAll('.close-btn').forEach(btn => { btn.addEventListener('click', () => manualClose(btn.dataset.symbol, btn.dataset.id)); }); };
+    let tradeState = { trade_list: [], bot_status: {}, next_runs: {} };
+    async function refreshTradeList() { const response = await fetch('/api/trade_list'); tradeState = await response.json(); renderTradeList(); };
+    function watchTradeList() { if (!window.EventSource) { refreshTradeList(); setInterval(refreshTradeList, 1000); return; } const source = new EventSource('/api/trade_list/stream'); source.addEventListener('snapshot', e => { tradeState = JSON.parse(e.data); renderTradeList(); }); source.addEventListener('trade_list', e => { tradeState.trade_list = JSON.parse(e.data); renderTradeList(); }); source.addEventListener('status', e => { for (const [id, status] of Object.entries(JSON.parse(e.data))) { if (status === null) delete tradeState.bot_status[id]; else tradeState.bot_status[id] = status; } renderTradeList(); }); source.addEventListener('next_runs', e => { Object.assign(tradeState.next_runs, JSON.parse(e.data)); renderTradeList(); }); };
+    function renderTradeList() { const { trade_list, bot_status, next_runs } = tradeState; const tableBody = document.querySelector('#trade-list-table tbody'); tableBody.innerHTML = ''; trade_list.forEach(item => { const status = bot_status[item.id] || { message: "Initializing...", color: "#fff" }; let pnlCell = '<td>-</td>'; if (status.pnl !== undefined) { const pnl = status.pnl; const pnl_pct = status.pnl_pct; const pnlColor = pnl > 0 ? '#28a745' : (pnl < 0 ? '#dc3545' : '#fff'); pnlCell = `<td style="color: ${pnlColor}; font-weight: bold;">${pnl.toFixed(2)} <span style="font-size:0.8em; opacity: 0.8;">(${pnl_pct.toFixed(2)}%)</span></td>`; } const row = `<tr><td>${item.symbol}</td><td>${item.interval_text}</td><td style="color:${status.color}">${status.message}</td>${pnlCell}<td>${item.id in next_runs ? (next_runs[item.id] === null ? 'Running' : new Date(next_runs[item.id] * 1000).toLocaleString()) : '-'}</td><td><button class="manual-trade-btn long-btn" data-id="${item.id}" data-symbol="${item.symbol}">Long</button><button class="manual-trade-btn short-btn" data-id="${item.id}" data-symbol="${item.symbol}">Short</button><button class="manual-trade-btn close-btn" data-id="${item.id}" data-symbol="${item.symbol}">Close</button><button class="remove-btn" data-id="${item.id}">X</button></td></tr>`; tableBody.insertAdjacentHTML('beforeend', row); }); document.querySelectorAll('.remove-btn').forEach(btn => { btn.addEventListener('click', () => removeTradeItem(btn.dataset.id)); }); document.querySelectorAll('.long-btn').forEach(btn => { btn.addEventListener('click', () => manualTrade('long', btn.dataset.symbol, btn.dataset.id)); }); document.querySelectorAll('.short-btn').forEach(btn => { btn.addEventListener('click', () => manualTrade('short', btn.dataset.symbol, btn.dataset.id)); }); document.querySelectorAll('.close-btn').forEach(btn => { btn.addEventListener('click', () => manualClose(btn.dataset.symbol, btn.dataset.id)); }); };
     let xAxis, yAxis; function createMainChart() { if (root) root.dispose(); root = am5.Root.new("chartdiv"); root.setThemes([am5themes_Animated.new(root), am5themes_Dark.new(root)]); chart = root.container.children.push(am5xy.XYChart.new(root, { panX: true, wheelX: "panX", pinchZoomX: true })); chart.set("cursor", am5xy.XYCursor.new(root, { behavior: "panX" })).lineY.set("visible", false); xAxis = chart.xAxes.push(am5xy.DateAxis.new(root, { baseInterval: { timeUnit: "minute", count: 60 }, renderer: am5xy.AxisRendererX.new(root, { minGridDistance: 70 }) })); yAxis = chart.yAxes.push(am5xy.ValueAxis.new(root, { renderer: am5xy.AxisRendererY.new(root, {}) })); let series = chart.series.push(am5xy.CandlestickSeries.new(root, { name: "Historical", xAxis: xAxis, yAxis: yAxis, valueXField: "t", openValueYField: "o", highValueYField: "h", lowValueYField: "l", valueYField: "c" })); let predictedSeries = chart.series.push(am5xy.CandlestickSeries.new(root, { name: "Predicted", xAxis: xAxis, yAxis: yAxis, valueXField: "t", openValueYField: "o", highValueYField: "h", lowValueYField: "l", valueYField: "c" })); predictedSeries.columns.template.setAll({ fill: am5.color(0xaaaaaa), stroke: am5.color(0xaaaaaa) }); chart.set("scrollbarX", am5.Scrollbar.new(root, { orientation: "horizontal" })); };
-    async function fetchChartData() { createMainChart(); const symbol = document.getElementById('symbol').value.toUpperCase().trim(); const interval = document.getElementById('interval').value; const numPredictions = document.getElementById('num_predictions').value; if (!symbol) { document.getElementById('status').innerText = 'Error: Symbol cannot be empty.'; return; } document.getElementById('status').innerText = 'Fetching chart data...'; try { const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}`); if (!response.ok) throw new Error((await response.json()).error); const data = await response.json(); const intervalConfig = !isNaN(interval) ? { timeUnit: "minute", count: parseInt(interval) } : { timeUnit: { 'D': 'day', 'W': 'week', 'M': 'month' }[interval] || 'day', count: 1 }; xAxis.set("baseInterval", intervalConfig); chart.series.getIndex(0).data.setAll(data.candles); chart.series.getIndex(1).data.setAll(data.predicted); document.getElementById('status').innerText = 'Chart updated.'; } catch (error) { document.getElementById('status').innerText = `Error: ${error.message}`; } finally { setTimeout(() => { document.getElementById('status').innerText = ''; }, 3000); }};
-    async function saveSettings() { const settings = { bingx_api_key: document.getElementById('api-key').value, bingx_secret_key: document.getElementById('secret-key').value, mode: document.getElementById('mode').value, risk_usdt: parseFloat(document.getElementById('risk-usdt').value), leverage: parseInt(document.getElementById('leverage').value), trigger_percentage: parseFloat(document.getElementById('trigger-percentage').value) }; await fetch('/api/settings', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(settings) }); alert('Settings saved!'); };
-    async function loadSettings() { const response = await fetch('/api/settings'); const settings = await response.json(); document.getElementById('api-key').value = settings.bingx_api_key; document.getElementById('secret-key').value = settings.bingx_secret_key; document.getElementById('mode').value = settings.mode; document.getElementById('risk-usdt').value = settings.risk_usdt; document.getElementById('leverage').value = settings.leverage; document.getElementById('trigger-percentage').value = settings.trigger_percentage; };
+    let chartQuery = null; // Auto-refresh: only the candles from the last one shown onwards are requested; the last one is patched, newer ones appended
+    async function refreshChart() { const candles = chart && chart.series.getIndex(0).data; if (!chartQuery || !candles || candles.length === 0) return; const query = chartQuery; try { const response = await fetch(`/api/candles?${query}&since=${candles.getIndex(candles.length - 1).t}`); if (!response.ok || query !== chartQuery) return; const data = await response.json(); if (data.full) candles.setAll(data.candles); else data.candles.forEach(candle => { const last = candles.length - 1; if (candle.t === candles.getIndex(last).t) candles.setIndex(last, candle); else if (candle.t > candles.getIndex(last).t) { candles.push(candle); candles.removeIndex(0); } }); chart.series.getIndex(1).data.setAll(data.predicted); } catch (error) { console.error('Chart refresh failed:', error); } };
+    async function fetchChartData() { chartQuery = null; createMainChart(); const symbol = document.getElementById('symbol').value.toUpperCase().trim(); const interval = document.getElementById('interval').value; const numPredictions = document.getElementById('num_predictions').value; const predictionMode = document.getElementById('prediction-mode').value; if (!symbol) { document.getElementById('status').innerText = 'Error: Symbol cannot be empty.'; return; } document.getElementById('status').innerText = 'Fetching chart data...'; try { const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${predictionMode}`); if (!response.ok) throw new Error((await response.json()).error); const data = await response.json(); const intervalConfig = !isNaN(interval) ? { timeUnit: "minute", count: parseInt(interval) } : { timeUnit: { 'D': 'day', 'W': 'week', 'M': 'month' }[interval] || 'day', count: 1 }; xAxis.set("baseInterval", intervalConfig); chart.series.getIndex(0).data.setAll(data.candles); chart.series.getIndex(1).data.setAll(data.predicted); chartQuery = `symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${predictionMode}`; document.getElementById('status').innerText = 'Chart updated.'; } catch (error) { document.getElementById('status').innerText = `Error: ${error.message}`; } finally { setTimeout(() => { document.getElementById('status').innerText = ''; }, 3000); }};
+    async function saveSettings() { const settings = { bingx_api_key: document.getElementById('api-key').value, bingx_secret_key: document.getElementById('secret-key').value, mode: document.getElementById('mode').value, risk_usdt: parseFloat(document.getElementById('risk-usdt').value), leverage: parseInt(document.getElementById('leverage').value), trigger_percentage: parseFloat(document.getElementById('trigger-percentage').value), prediction_mode: document.getElementById('prediction-mode').value, use_pattern_library: document.getElementById('use-pattern-library').checked }; await fetch('/api/settings', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(settings) }); alert('Settings saved!'); };
+    async function loadSettings() { const response = await fetch('/api/settings'); const settings = await response.json(); document.getElementById('api-key').value = settings.bingx_api_key; document.getElementById('secret-key').value = settings.bingx_secret_key; document.getElementById('mode').value = settings.mode; document.getElementById('risk-usdt').value = settings.risk_usdt; document.getElementById('leverage').value = settings.leverage; document.getElementById('trigger-percentage').value = settings.trigger_percentage; document.getElementById('prediction-mode').value = settings.prediction_mode || 'recursive'; document.getElementById('use-pattern-library').checked = !!settings.use_pattern_library; };
     async function addTradeItem() { const item = { symbol: document.getElementById('symbol').value.toUpperCase().trim(), interval: document.getElementById('interval').value, interval_text: document.getElementById('interval').options[document.getElementById('interval').selectedIndex].text, predictions: parseInt(document.getElementById('num_predictions').value) }; await fetch('/api/trade_list/add', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(item) }); refreshTradeList(); };
     async function removeTradeItem(id) { await fetch('/api/trade_list/remove', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ id: id }) }); refreshTradeList(); };
     let backtestRunning = false;
     async function runBacktest() { if (backtestRunning) return; backtestRunning = true; const statusEl = document.getElementById('backtest-status'); const resultsEl = document.getElementById('backtest-results'); statusEl.textContent = 'Fetching historical data...'; resultsEl.style.display = 'none'; const payload = { symbol: document.getElementById('backtest-symbol').value.toUpperCase(), interval: document.getElementById('backtest-interval').value, start_date: document.getElementById('backtest-start').value, end_date: document.getElementById('backtest-end').value, }; try { statusEl.textContent = 'Running simulation...'; const response = await fetch('/api/backtest', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(payload) }); if (!response.ok) throw new Error((await response.json()).error); const results = await response.json(); displayBacktestResults(results); statusEl.textContent = 'Backtest complete.'; } catch (error) { statusEl.textContent = `Error: ${error.message}`; } finally { backtestRunning = false; } }
-    function displayBacktestResults(results) { document.getElementById('backtest-results').style.display = 'block'; const stats = results.metrics; const statsEl = document.getElementById('backtest-stats'); statsEl.innerHTML = `<div>Net Profit: <span style="color:${stats.net_profit > 0 ? '#28a745' : '#dc3545'}">${stats.net_profit.toFixed(2)} USDT</span></div><div>Win Rate: <span>${stats.win_rate.toFixed(2)}%</span></div><div>Profit Factor: <span>${stats.profit_factor.toFixed(2)}</span></div><div>Total Trades: <span>${stats.total_trades}</span></div><div>Avg Trade PnL: <span>${stats.avg_trade_pnl.toFixed(2)}</span></div><div>Max Drawdown: <span style="color:#dc3545">${stats.max_drawdown.toFixed(2)}%</span></div>`; const tradesTableBody = document.querySelector('#backtest-trades-table tbody'); tradesTableBody.innerHTML = ''; results.trades.forEach(trade => { const pnlColor = trade.pnl > 0 ? '#28a745' : '#dc3545'; const row = `<tr><td>${new Date(trade.exit_time).toLocaleString()}</td><td>${trade.direction}</td><td style="color:${pnlColor}">${trade.pnl.toFixed(2)}</td><td style="color:${pnlColor}">${trade.return_pct.toFixed(2)}%</td><td>${trade.exit_reason || 'N/A'}</td></tr>`; tradesTableBody.insertAdjacentHTML('afterbegin', row); }); createEquityChart(results.equity_curve); }
+    function displayBacktestResults(results) { document.getElementById('backtest-results').style.display = 'block'; const stats = results.metrics; const statsEl = document.getElementById('backtest-stats'); statsEl.innerHTML = `<div>Net Profit: <span style="color:${stats.net_profit > 0 ? '#28a745' : '#dc3545'}">${stats.net_profit.toFixed(2)} USDT</span></div><div>Win Rate: <span>${stats.win_rate.toFixed(2)}%</span></div><div>Profit Factor: <span>${stats.profit_factor === null ? '∞' : stats.profit_factor.toFixed(2)}</span></div><div>Total Trades: <span>${stats.total_trades}</span></div><div>Avg Trade PnL: <span>${stats.avg_trade_pnl.toFixed(2)}</span></div><div>Max Drawdown: <span style="color:#dc3545">${stats.max_drawdown.toFixed(2)}%</span></div>`; const tradesTableBody = document.querySelector('#backtest-trades-table tbody'); tradesTableBody.innerHTML = ''; results.trades.forEach(trade => { const pnlColor = trade.pnl > 0 ? '#28a745' : '#dc3545'; const row = `<tr><td>${new Date(trade.exit_time).toLocaleString()}</td><td>${trade.direction}</td><td style="color:${pnlColor}">${trade.pnl.toFixed(2)}</td><td style="color:${pnlColor}">${trade.return_pct.toFixed(2)}%</td><td>${trade.exit_reason || 'N/A'}</td></tr>`; tradesTableBody.insertAdjacentHTML('afterbegin', row); }); createEquityChart(results.equity_curve); }
     function createEquityChart(data) { if (equityRoot) equityRoot.dispose(); equityRoot = am5.Root.new("equitychartdiv"); equityRoot.setThemes([am5themes_Dark.new(equityRoot)]); let chart = equityRoot.container.children.push(am5xy.XYChart.new(equityRoot, { panX: true, wheelX: "zoomX", pinchZoomX: true, paddingLeft: 0, paddingRight: 0 })); let xAxis = chart.xAxes.push(am5xy.DateAxis.new(equityRoot, { baseInterval: { timeUnit: "day", count: 1 }, renderer: am5xy.AxisRendererX.new(equityRoot, { minGridDistance: 50 }), })); let yAxis = chart.yAxes.push(am5xy.ValueAxis.new(equityRoot, { renderer: am5xy.AxisRendererY.new(equityRoot, {}) })); let series = chart.series.push(am5xy.LineSeries.new(equityRoot, { name: "Equity", xAxis: xAxis, yAxis: yAxis, valueYField: "equity", valueXField: "time", stroke: am5.color(0x00aaff), fill: am5.color(0x00aaff), })); series.fills.template.setAll({ fillOpacity: 0.1, visible: true }); series.data.setAll(data); }
-    function initialize() { loadSettings(); refreshTradeList(); setInterval(refreshTradeList, 1000); const today = new Date(); const yesterday = new Date(today); yesterday.setDate(yesterday.getDate() - 1); const threeMonthsAgo = new Date(today); threeMonthsAgo.setMonth(threeMonthsAgo.getMonth() - 3); document.getElementById('backtest-end').valueAsDate = yesterday; document.getElementById('backtest-start').valueAsDate = threeMonthsAgo; document.getElementById('toggle-controls-btn').addEventListener('click', () => document.querySelector('.controls-overlay').classList.toggle('hidden')); document.getElementById('fetchButton').addEventListener('click', fetchChartData); document.getElementById('add-to-list-btn').addEventListener('click', addTradeItem); document.getElementById('save-settings-btn').addEventListener('click', saveSettings); document.getElementById('run-backtest-btn').addEventListener('click', runBacktest); document.getElementById('toggle-backtest-size-btn').addEventListener('click', (e) => { const btn = e.target; const container = document.querySelector('.panels-container'); const chartContainer = document.getElementById('chartdiv'); container.classList.toggle('is-maximized'); if (container.classList.contains('is-maximized')) { btn.textContent = '−'; btn.title = "Minimize"; chartContainer.style.height = '40px'; } else { btn.textContent = '□'; btn.title = "Maximize"; chartContainer.style.height = 'calc(100% - 250px)'; } setTimeout(() => { if (equityRoot) { equityRoot.resize(); } if (root) { root.resize(); } }, 350); }); }
+    function initialize() { loadSettings(); watchTradeList(); setInterval(refreshChart, 5000); const today = new Date(); const yesterday = new Date(today); yesterday.setDate(yesterday.getDate() - 1); const threeMonthsAgo = new Date(today); threeMonthsAgo.setMonth(threeMonthsAgo.getMonth() - 3); document.getElementById('backtest-end').valueAsDate = yesterday; document.getElementById('backtest-start').valueAsDate = threeMonthsAgo; document.getElementById('toggle-controls-btn').addEventListener('click', () => document.querySelector('.controls-overlay').classList.toggle('hidden')); document.getElementById('fetchButton').addEventListener('click', fetchChartData); document.getElementById('add-to-list-btn').addEventListener('click', addTradeItem); document.getElementById('save-settings-btn').addEventListener('click', saveSettings); document.getElementById('run-backtest-btn').addEventListener('click', runBacktest); document.getElementById('toggle-backtest-size-btn').addEventListener('click', (e) => { const btn = e.target; const container = document.querySelector('.panels-container'); const chartContainer = document.getElementById('chartdiv'); container.classList.toggle('is-maximized'); if (container.classList.contains('is-maximized')) { btn.textContent = '−'; btn.title = "Minimize"; chartContainer.style.height = '40px'; } else { btn.textContent = '□'; btn.title = "Maximize"; chartContainer.style.height = 'calc(100% - 250px)'; } setTimeout(() => { if (equityRoot) { equityRoot.resize(); } if (root) { root.resize(); } }, 350); }); }
     initialize();
 });
 </script>
@@ -148,34 +517,117 @@ document.addEventListener('DOMContentLoaded', function () {
 </html>
 """
 
+# --- Typed Candle Series ---
+class CandleSeries:
+    # Columnar candles parsed once at fetch time: ts as int64, OHLCV as float64. Columns are arrays, or read-only memoryviews
+    # when the series is a zero-copy view of the kline store or of the sweep's shared memory block.
+    __slots__ = ("ts", "open", "high", "low", "close", "volume")
+    COLUMNS = [("ts", "q"), ("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"), ("volume", "d")]
+    def __init__(self, ts=None, open=None, high=None, low=None, close=None, volume=None):
+        for (name, typecode), column in zip(self.COLUMNS, (ts, open, high, low, close, volume)): setattr(self, name, array(typecode) if column is None else column)
+    @classmethod
+    def from_rows(cls, rows):
+        # Exchange rows are lists of strings: [ts, open, high, low, close, volume, turnover]
+        rows = rows if isinstance(rows, list) else list(rows)
+        return cls(*(array(typecode, (int(row[k]) if typecode == 'q' else float(row[k]) for row in rows)) for k, (_, typecode) in enumerate(cls.COLUMNS)))
+    @classmethod
+    def concat(cls, *parts):
+        columns = [array(typecode) for _, typecode in cls.COLUMNS]
+        for part in parts:
+            for column, source in zip(columns, part.columns()): column.extend(source)
+        return cls(*columns)
+    def columns(self): return [getattr(self, name) for name, _ in self.COLUMNS]
+    def __len__(self): return len(self.ts)
+    def __getitem__(self, index):
+        if isinstance(index, slice): return CandleSeries(*(column[index] for column in self.columns()))
+        return tuple(column[index] for column in self.columns())
+    def rows(self): return list(zip(*self.columns())) # (ts, o, h, l, c, v) tuples
+    def to_dicts(self): return [{"t": t, "o": o, "h": h, "l": l, "c": c} for t, o, h, l, c in zip(self.ts, self.open, self.high, self.low, self.close)]
+
 # --- Data Fetching & Prediction (FIXED) ---
+@stage_timers.timed("get_bybit_data")
 def get_bybit_data(symbol, interval, start_ts=None, end_ts=None, limit=1000):
     # CHANGED: "category" is now "linear" for perpetual contracts
     params = {"category": "linear", "symbol": symbol, "interval": interval, "limit": limit}
     if start_ts: params['start'] = int(start_ts)
     if end_ts: params['end'] = int(end_ts)
     try:
-        # Use the global session with retries and add a timeout
-        response = session.get(f"{BYBIT_API_URL}/kline", params=params, timeout=(5, 10)) # 5s connect, 10s read
+        # Pooled, rate limited, with header-driven retries
+        response = bybit_http.request("GET", "/kline", params=params)
         response.raise_for_status()
         data = response.json()
         if data.get("retCode") != 0: raise ValueError(data.get("retMsg"))
-        return list(reversed(data["result"]["list"]))
+        return CandleSeries.from_rows(reversed(data["result"]["list"]))
     except (requests.exceptions.RequestException, ValueError) as e:
         # This error will now only be raised after all retries have failed
         # Log the error but re-raise a more generic ConnectionError to be handled by the worker
         app.logger.warning(f"Bybit kline API error for {symbol}: {e}")
         raise ConnectionError(f"Failed to fetch Bybit kline data for {symbol} after retries.")
 
+class KlineCache:
+    # Bounded LRU cache with per-value TTL and single-flight loading: concurrent callers for a key wait on one load.
+    # Values less than stale_ttl past their TTL are served while one background thread reloads them (stale-while-revalidate).
+    # loader(previous) gets the value held for the key, expired or not, so it can refresh incrementally. Empty results are not stored.
+    class _Flight:
+        def __init__(self): self.done, self.value, self.error = threading.Event(), None, None
+    def __init__(self, max_entries, ttl, stale_ttl=0):
+        self.max_entries, self.ttl, self.stale_ttl, self.lock = max_entries, ttl, stale_ttl, threading.Lock()
+        self.entries, self.inflight = OrderedDict(), {} # key -> (fresh_until, value), least recently used first; key -> _Flight
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "waits": 0, "evictions": 0, "loads": 0, "load_errors": 0}
+    def get(self, key, loader, ttl=None):
+        with self.lock:
+            entry, now = self.entries.get(key), time.monotonic()
+            if entry and now < entry[0] + self.stale_ttl:
+                self.entries.move_to_end(key)
+                if now < entry[0]: self.counters["hits"] += 1
+                else:
+                    self.counters["stale_hits"] += 1
+                    if key not in self.inflight: flight = self.inflight[key] = self._Flight(); threading.Thread(target=self._load, args=(key, loader, ttl, flight, entry[1]), daemon=True).start()
+                return entry[1]
+            self.counters["misses"] += 1; flight = self.inflight.get(key); leader = flight is None
+            if leader: flight = self.inflight[key] = self._Flight()
+            else: self.counters["waits"] += 1
+        if leader: self._load(key, loader, ttl, flight, entry[1] if entry else None)
+        else: flight.done.wait()
+        if flight.error is not None: raise flight.error
+        return flight.value
+    def _load(self, key, loader, ttl, flight, previous):
+        try: flight.value = loader(previous)
+        except Exception as e: flight.error = e
+        with self.lock:
+            self.counters["loads"] += 1
+            if flight.error is not None: self.counters["load_errors"] += 1
+            elif flight.value:
+                self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl(flight.value)), flight.value); self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries: self.entries.popitem(last=False); self.counters["evictions"] += 1
+            del self.inflight[key]
+        flight.done.set()
+    def stats(self):
+        with self.lock: return {**self.counters, "size": len(self.entries), "max_entries": self.max_entries, "inflight": len(self.inflight)}
+
+live_kline_cache = KlineCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS) # No stale serving: trade decisions always see the latest closed candle
+
+def get_live_candles(symbol, interval):
+    # The newest KLINE_PAGE_SIZE candles. The first load fetches a full page; refreshes fetch only the candles from the last
+    # cached (possibly still forming) one onwards and merge them into a new series, since readers may hold the cached one.
+    # The forming candle refreshes every CACHE_TTL_SECONDS, and never later than its close.
+    def refresh(previous):
+        if not previous: return get_bybit_data(symbol, interval, limit=KLINE_PAGE_SIZE)
+        fresh = get_bybit_data(symbol, interval, start_ts=previous.ts[-1], limit=KLINE_PAGE_SIZE)
+        if not fresh or fresh.ts[0] > previous.ts[-1]: return fresh # More than a page behind: the fresh page is the whole window
+        return CandleSeries.concat(previous[:bisect.bisect_left(previous.ts, fresh.ts[0])], fresh)[-KLINE_PAGE_SIZE:]
+    return live_kline_cache.get(f"{symbol}-{interval}", refresh, ttl=lambda candles: max(0.0, min(CACHE_TTL_SECONDS, (candles.ts[-1] + interval_to_ms(interval)) / 1000 - time.time())))
+
 
+@stage_timers.timed("get_bybit_ticker_data")
 def get_bybit_ticker_data(symbols):
     if not isinstance(symbols, list): symbols = [symbols]
     if not symbols: return {}
     # CHANGED: "category" is now "linear" for perpetual contracts
     params = {"category": "linear", "symbol": ",".join(symbols)}
     try:
-        # Use the global session with retries and add a timeout
-        response = session.get(f"{BYBIT_API_URL}/tickers", params=params, timeout=(5, 10))
+        # Pooled, rate limited, with header-driven retries
+        response = bybit_http.request("GET", "/tickers", params=params)
         response.raise_for_status()
         data = response.json()
         if data.get("retCode") == 0:
@@ -185,52 +637,560 @@ def get_bybit_ticker_data(symbols):
         app.logger.error(f"Bybit ticker API error after retries: {e}")
         return {}
 
-def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5):
+# --- Streaming Market Data ---
+class MarketDataSubscription:
+    # Collects the (kind, key) updates published since the last wait(): ("ticker", symbol) or ("kline", (symbol, interval))
+    def __init__(self, kinds): self.kinds, self.updates, self.cond = set(kinds), set(), threading.Condition()
+    def notify(self, kind, key):
+        if kind in self.kinds:
+            with self.cond: self.updates.add((kind, key)); self.cond.notify_all()
+    def wait(self, timeout):
+        # Returns as soon as an update is pending, or after `timeout` seconds with an empty set
+        with self.cond:
+            if not self.updates: self.cond.wait(timeout)
+            updates, self.updates = self.updates, set(); return updates
+
+class MarketDataBus:
+    # One upstream market data connection per process: Bybit's public WebSocket (tickers.<symbol>, kline.<interval>.<symbol>)
+    # when websocket-client is installed, REST ticker polling otherwise and while the stream reconnects. Keeps the last price per
+    # symbol and the last candle per (symbol, interval), and publishes every update to the in-process subscriptions.
+    # Each owner (worker) declares what it needs with track(); the socket is subscribed to the union.
+    def __init__(self, url):
+        self.url, self.lock, self.subscriptions, self.tracked = url, threading.Lock(), [], {} # owner -> (symbols, (symbol, interval) pairs)
+        self.prices, self.candles, self.connected, self.thread = {}, {}, False, None # symbol -> price; (symbol, interval) -> candle dict
+    def start(self, url=None):
+        if url: self.url = url
+        if self.thread is None: self.thread = threading.Thread(target=self._run, name="market_data", daemon=True); self.thread.start()
+    def track(self, owner, symbols=(), klines=()):
+        with self.lock: self.tracked[owner] = (set(symbols), set(klines))
+    def subscribe(self, kinds=("ticker", "kline")):
+        subscription = MarketDataSubscription(kinds)
+        with self.lock: self.subscriptions.append(subscription)
+        return subscription
+    def prices_for(self, symbols):
+        with self.lock: return {symbol: self.prices[symbol] for symbol in symbols if symbol in self.prices}
+    def latest_candle(self, symbol, interval):
+        with self.lock: return self.candles.get((symbol, interval))
+    def status(self):
+        with self.lock: return {"transport": "websocket" if websocket is not None else "rest", "connected": self.connected, "url": self.url, "topics": sorted(self._topics_locked()), "prices": dict(self.prices)}
+
+    def _topics_locked(self):
+        return {f"tickers.{symbol}" for symbols, _ in self.tracked.values() for symbol in symbols} | {f"kline.{interval}.{symbol}" for _, klines in self.tracked.values() for symbol, interval in klines}
+    def _publish(self, kind, key, store, value):
+        with self.lock: store[key] = value; subscriptions = list(self.subscriptions)
+        for subscription in subscriptions: subscription.notify(kind, key)
+    def _handle(self, message):
+        topic, data = message.get("topic", ""), message.get("data")
+        if topic.startswith("tickers.") and isinstance(data, dict) and data.get("lastPrice"): # Deltas omit unchanged fields
+            self._publish("ticker", data.get("symbol") or topic.split(".", 1)[1], self.prices, float(data["lastPrice"]))
+        elif topic.startswith("kline.") and isinstance(data, list):
+            _, interval, symbol = topic.split(".", 2)
+            for k in data: self._publish("kline", (symbol, interval), self.candles, {"t": int(k["start"]), "o": float(k["open"]), "h": float(k["high"]), "l": float(k["low"]), "c": float(k["close"]), "v": float(k["volume"]), "confirm": bool(k.get("confirm"))})
+    def _poll_rest(self):
+        with self.lock: symbols = sorted({symbol for symbols, _ in self.tracked.values() for symbol in symbols})
+        for symbol, price in (get_bybit_ticker_data(symbols) if symbols else {}).items(): self._publish("ticker", symbol, self.prices, price)
+
+    def _run(self):
+        backoff = 1
+        while True:
+            if websocket is not None:
+                try: self._stream()
+                except Exception as e: app.logger.warning(f"Market data stream error: {e}")
+                with self.lock: backoff = 1 if self.connected else min(backoff * 2, 60); self.connected = False
+            deadline = time.monotonic() + (backoff if websocket is not None else MARKET_DATA_POLL_SECONDS)
+            while True: # REST keeps prices moving until the next reconnect attempt
+                try: self._poll_rest()
+                except Exception as e: app.logger.warning(f"Market data REST poll error: {e}")
+                if time.monotonic() >= deadline: break
+                time.sleep(MARKET_DATA_POLL_SECONDS)
+
+    def _stream(self):
+        ws = websocket.create_connection(self.url, timeout=10)
+        try:
+            ws.settimeout(1); subscribed, last_ping = set(), time.monotonic() # Short recv timeout so new topics are subscribed promptly
+            with self.lock: self.connected = True
+            while True:
+                with self.lock: topics = self._topics_locked()
+                for op, args in (("unsubscribe", sorted(subscribed - topics)), ("subscribe", sorted(topics - subscribed))):
+                    for k in range(0, len(args), 10): ws.send(json.dumps({"op": op, "args": args[k:k + 10]})) # At most 10 args per request
+                subscribed = topics
+                if time.monotonic() - last_ping >= MARKET_DATA_PING_SECONDS: ws.send(json.dumps({"op": "ping"})); last_ping = time.monotonic()
+                try: message = ws.recv()
+                except websocket.WebSocketTimeoutException: continue
+                if not message: raise ConnectionError("Market data stream closed by the server")
+                self._handle(json.loads(message))
+        finally: ws.close()
+
+market_data = MarketDataBus(BYBIT_WS_URL) # The engine starts it with the "market_data_url" setting, if any
+
+# --- Local Stand-in Feed Server ---
+class LocalFeedServer:
+    # Offline stand-in for Bybit's public WebSocket: a minimal RFC 6455 server (stdlib only, plain ws://) that answers the
+    # subscribe/unsubscribe/ping ops and pushes random-walk tickers.<symbol> and kline.<interval>.<symbol> messages in Bybit's
+    # format. Run it with `python main.py --feed-server [port]` and set "market_data_url" to ws://127.0.0.1:<port>.
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    def __init__(self, host="127.0.0.1", port=FEED_SERVER_PORT, tick_seconds=0.5, start_price=100.0, seed=None):
+        self.host, self.port, self.tick_seconds, self.start_price, self.rng = host, port, tick_seconds, start_price, random.Random(seed)
+        self.lock, self.clients, self.prices, self.candles = threading.Lock(), {}, {}, {} # socket -> [topics, send lock]; symbol -> price; (symbol, interval) -> candle
+    def start(self):
+        server = socket.create_server((self.host, self.port)); self.port = server.getsockname()[1] # port=0 picks a free one
+        threading.Thread(target=self._accept_loop, args=(server,), daemon=True).start(); threading.Thread(target=self._tick_loop, daemon=True).start()
+        return self
+    def serve_forever(self):
+        self.start(); app.logger.info(f"Stand-in feed server on ws://{self.host}:{self.port}")
+        while True: time.sleep(3600)
+
+    def _accept_loop(self, server):
+        while True: conn, _ = server.accept(); threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+    def _recv_exact(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk: raise ConnectionError("Client disconnected")
+            data += chunk
+        return data
+    def _recv_frame(self, conn):
+        first, second = self._recv_exact(conn, 2); length = second & 0x7F
+        if length == 126: length = struct.unpack(">H", self._recv_exact(conn, 2))[0]
+        elif length == 127: length = struct.unpack(">Q", self._recv_exact(conn, 8))[0]
+        mask = self._recv_exact(conn, 4) if second & 0x80 else b"\0\0\0\0"
+        return first & 0x0F, bytes(b ^ mask[k % 4] for k, b in enumerate(self._recv_exact(conn, length)))
+    def _send(self, conn, message, opcode=1):
+        payload = message if isinstance(message, bytes) else json.dumps(message).encode(); size = len(payload)
+        header = bytes([0x80 | opcode]) + (bytes([size]) if size < 126 else struct.pack(">BH", 126, size) if size < 65536 else struct.pack(">BQ", 127, size))
+        with self.lock: client = self.clients.get(conn)
+        if client:
+            with client[1]: conn.sendall(header + payload)
+    def _serve_client(self, conn):
+        try:
+            request_bytes = b""
+            while b"\r\n\r\n" not in request_bytes: request_bytes += self._recv_exact(conn, 1)
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in request_bytes.decode().split("\r\n")[1:]) if v}
+            accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + self.GUID).encode()).digest()).decode()
+            conn.sendall(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+            with self.lock: self.clients[conn] = [set(), threading.Lock()]
+            while True:
+                opcode, payload = self._recv_frame(conn)
+                if opcode == 8: self._send(conn, payload, 8); break # Close
+                if opcode == 9: self._send(conn, payload, 10); continue # Ping -> pong
+                if opcode != 1: continue
+                request_json = json.loads(payload); op = request_json.get("op")
+                if op == "ping": self._send(conn, {"success": True, "ret_msg": "pong", "op": "ping"}); continue
+                with self.lock:
+                    topics = self.clients[conn][0]
+                    if op == "subscribe": topics.update(request_json.get("args", []))
+                    elif op == "unsubscribe": topics.difference_update(request_json.get("args", []))
+                self._send(conn, {"success": op in ("subscribe", "unsubscribe"), "ret_msg": "", "op": op, "req_id": request_json.get("req_id", "")})
+                if op == "subscribe": self._push(conn, request_json.get("args", []), "snapshot")
+        except (OSError, ConnectionError, ValueError, KeyError): pass
+        finally:
+            with self.lock: self.clients.pop(conn, None)
+            conn.close()
+    def _message(self, topic, message_type):
+        now_ms = int(time.time() * 1000)
+        with self.lock:
+            if topic.startswith("tickers."):
+                symbol = topic.split(".", 1)[1]; price = self.prices.setdefault(symbol, self.start_price)
+                return {"topic": topic, "type": message_type, "data": {"symbol": symbol, "lastPrice": f"{price:.6f}"}, "cs": now_ms, "ts": now_ms}
+            if topic.startswith("kline."):
+                _, interval, symbol = topic.split(".", 2); price = self.prices.setdefault(symbol, self.start_price); span = interval_to_ms(interval)
+                start = now_ms - now_ms % span; candle = self.candles.get((symbol, interval)); closed = None
+                if candle is None or candle["start"] != start:
+                    if candle is not None: closed = dict(candle, confirm=True)
+                    candle = self.candles[(symbol, interval)] = {"start": start, "end": start + span - 1, "interval": interval, "open": price, "high": price, "low": price, "close": price, "volume": 0.0, "confirm": False}
+                candle.update(high=max(candle["high"], price), low=min(candle["low"], price), close=price, volume=candle["volume"] + self.rng.random())
+                data = [{k: (f"{v:.6f}" if isinstance(v, float) else v) for k, v in c.items()} | {"timestamp": now_ms} for c in ([closed] if closed else []) + [dict(candle)]]
+                return {"topic": topic, "type": "snapshot", "data": data, "ts": now_ms}
+        return None
+    def _push(self, conn, topics, message_type="delta"):
+        for topic in topics:
+            message = self._message(topic, message_type)
+            if message: self._send(conn, message)
+    def _tick_loop(self):
+        while True:
+            time.sleep(self.tick_seconds)
+            with self.lock:
+                clients = [(conn, sorted(client[0])) for conn, client in self.clients.items()]
+                for symbol in {topic.rsplit(".", 1)[1] for _, topics in clients for topic in topics}: self.prices[symbol] = self.prices.get(symbol, self.start_price) * math.exp(self.rng.gauss(0, 0.001))
+            for conn, topics in clients:
+                try: self._push(conn, topics)
+                except OSError: pass
+
+# --- Persistent Kline Store ---
+def interval_to_ms(interval): return INTERVAL_MS.get(interval) or int(interval) * 60000
+
+def candle_close_ms(interval, ts):
+    # Close time (= next candle's start) of the candle forming at `ts` on Bybit's UTC grid: weeks start on Monday, months on the 1st
+    if interval == "M":
+        day = datetime.fromtimestamp(ts / 1000, timezone.utc)
+        return int(datetime(day.year + day.month // 12, day.month % 12 + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    offset = 4 * 86400000 if interval == "W" else 0 # 1970-01-01 was a Thursday
+    return ((ts - offset) // interval_to_ms(interval) + 1) * interval_to_ms(interval) + offset
+
+class KlineStore:
+    # On-disk columnar kline history keyed by (category, symbol, interval). Each key directory holds fixed-width column files
+    # (ts int64, OHLCV float64) in numbered generations, plus meta.json naming the current generation, its row count and the covered
+    # time ranges. Candles newer than every stored one are appended to the current generation's files before meta.json raises the
+    # count, and readers only look at the first `count` rows; overlaps and backfills build a new generation and atomically swap
+    # meta.json. Either way readers in any process mmap a consistent snapshot.
+    COLUMNS = CandleSeries.COLUMNS
+    def __init__(self, root): self.root, self.lock = root, threading.Lock()
+    def _dir(self, symbol, interval, category): return os.path.join(self.root, category, symbol, str(interval))
+    def _meta(self, path): return load_from_json(os.path.join(path, "meta.json"), {"generation": 0, "count": 0, "coverage": []})
+
+    def read(self, symbol, interval, category, start_ts=None, end_ts=None):
+        path = self._dir(symbol, interval, category); meta = self._meta(path); columns = {}
+        for name, typecode in self.COLUMNS:
+            if meta["count"] == 0: columns[name] = memoryview(array(typecode)); continue
+            with open(os.path.join(path, f"gen-{meta['generation']}", name), "rb") as f: columns[name] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)[:meta["count"]]
+        lo = 0 if start_ts is None else bisect.bisect_left(columns["ts"], start_ts); hi = len(columns["ts"]) if end_ts is None else bisect.bisect_right(columns["ts"], end_ts)
+        return CandleSeries(*(columns[name][lo:hi] for name, _ in self.COLUMNS)) # Zero-copy views over the read-only mmaps
+
+    def missing_ranges(self, symbol, interval, category, start_ts, end_ts):
+        missing, cursor = [], start_ts
+        for covered_start, covered_end in self._meta(self._dir(symbol, interval, category))["coverage"]:
+            if covered_end < cursor: continue
+            if covered_start > end_ts: break
+            if covered_start > cursor: missing.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+        if cursor <= end_ts: missing.append((cursor, end_ts))
+        return missing
+
+    def merge(self, symbol, interval, category, candles, covered_start, covered_end):
+        path = self._dir(symbol, interval, category); os.makedirs(path, exist_ok=True)
+        with self.lock, open(os.path.join(path, ".lock"), "a") as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            meta = self._meta(path); coverage = sorted(meta["coverage"] + [[covered_start, covered_end]]); merged_coverage = [coverage[0]]
+            for start, end in coverage[1:]:
+                if start <= merged_coverage[-1][1] + 1: merged_coverage[-1][1] = max(merged_coverage[-1][1], end)
+                else: merged_coverage.append([start, end])
+            tail = self._new_tail(symbol, interval, category, meta, candles)
+            if tail is not None: # Steady state: only candles after the last stored one, appended in place
+                if len(tail): self._append(path, meta, tail)
+                if len(tail) or merged_coverage != meta["coverage"]: save_to_json(os.path.join(path, "meta.json"), {"generation": meta["generation"], "count": meta["count"] + len(tail), "coverage": merged_coverage})
+                return
+            merged = {}
+            if meta["count"]: merged = {row[0]: row for row in self.read(symbol, interval, category).rows()}
+            for row in candles.rows(): merged[row[0]] = row
+            ordered = [merged[ts] for ts in sorted(merged)]; generation = meta["generation"] + 1; gen_path = os.path.join(path, f"gen-{generation}"); os.makedirs(gen_path, exist_ok=True)
+            for k, (name, typecode) in enumerate(self.COLUMNS):
+                with open(os.path.join(gen_path, name), "wb") as f: array(typecode, (row[k] for row in ordered)).tofile(f)
+            save_to_json(os.path.join(path, "meta.json"), {"generation": generation, "count": len(ordered), "coverage": merged_coverage})
+            shutil.rmtree(os.path.join(path, f"gen-{meta['generation'] - 1}"), ignore_errors=True) # Keep the previous generation for readers mid-swap
+
+    def _new_tail(self, symbol, interval, category, meta, candles):
+        # The candles after the last stored one when those before it are already stored unchanged, else None (overlap or backfill:
+        # a new generation is built)
+        if meta["count"] == 0: return None
+        if not len(candles): return candles
+        stored = self.read(symbol, interval, category, start_ts=candles.ts[0])
+        if len(stored) > len(candles) or stored.rows() != candles[:len(stored)].rows(): return None
+        return candles[len(stored):]
+
+    def _append(self, path, meta, candles):
+        gen_path = os.path.join(path, f"gen-{meta['generation']}")
+        for (name, typecode), column in zip(self.COLUMNS, candles.columns()):
+            with open(os.path.join(gen_path, name), "r+b") as f:
+                f.truncate(meta["count"] * array(typecode).itemsize); f.seek(0, os.SEEK_END); array(typecode, column).tofile(f) # truncate: drops a torn append left by a crash
+
+    def sync(self, symbol, interval, category, start_ts, end_ts, fetch_range):
+        # Fetches only the ranges not yet covered; candles still forming at fetch time are never stored
+        last_closed_ts = int(time.time() * 1000) - interval_to_ms(interval)
+        for gap_start, gap_end in self.missing_ranges(symbol, interval, category, start_ts, min(end_ts, last_closed_ts)):
+            candles = fetch_range(gap_start, gap_end); self.merge(symbol, interval, category, candles[:bisect.bisect_right(candles.ts, min(gap_end, last_closed_ts))], gap_start, gap_end)
+        return self.read(symbol, interval, category, start_ts, end_ts)
+
+kline_store = KlineStore(KLINE_STORE_DIR)
+
+# --- Cross-Symbol Pattern Library ---
+class PatternLibrary:
+    # Approximate nearest-neighbour index over log-return windows from many symbols and intervals (random-projection LSH).
+    # Each table buckets a window by the signs of its dot products with `bits` random Gaussian planes, so windows at a small
+    # angle (high cosine similarity, the predictor's metric) tend to share a bucket; a query reranks its buckets exactly.
+    # On disk the returns, window positions and (window, table) codes are append-only files whose valid lengths live in
+    # meta.json, replaced atomically after every append, so a crash mid-append only leaves bytes the next append truncates.
+    def __init__(self, root, window_size=20, tables=PATTERN_LSH_TABLES, bits=PATTERN_LSH_BITS, seed=0):
+        self.path, self.lock = os.path.join(root, f"w{window_size}"), threading.RLock()
+        self.meta = load_from_json(os.path.join(self.path, "meta.json"), {"window_size": window_size, "tables": tables, "bits": bits, "seed": seed, "returns": 0, "entries": 0, "segments": [], "sources": {}})
+        self.window_size, self.tables, self.bits = self.meta["window_size"], self.meta["tables"], self.meta["bits"]
+        rng = random.Random(self.meta["seed"]); self.planes = [[[rng.gauss(0, 1) for _ in range(self.window_size)] for _ in range(self.bits)] for _ in range(self.tables)] # Regenerated from the seed, never stored
+        self.returns, self._returns_np = self._load("returns", 'd', self.meta["returns"]), None; self.segment_starts, self.segment_ends = [start for start, _ in self.meta["segments"]], [end for _, end in self.meta["segments"]]
+        self.buckets = [{} for _ in range(self.tables)]; self._index(self._load("positions", 'q', self.meta["entries"]), self._load("codes", 'q', self.meta["entries"] * self.tables))
+
+    def _load(self, name, typecode, count):
+        column = array(typecode)
+        if count:
+            with open(os.path.join(self.path, name), "rb") as f: column.fromfile(f, count)
+        return column
+
+    def _append(self, name, column, count_before):
+        with open(os.path.join(self.path, name), "ab") as f: f.truncate(count_before * column.itemsize); column.tofile(f)
+
+    def _index(self, positions, codes):
+        if np is not None and len(positions) >= 4096: # One sort per table instead of a Python append per (window, table)
+            positions, codes = np.frombuffer(positions, dtype=np.int64), np.frombuffer(codes, dtype=np.int64).reshape(-1, self.tables)
+            for t, table in enumerate(self.buckets):
+                order = np.argsort(codes[:, t], kind="stable"); keys, first = np.unique(codes[order, t], return_index=True)
+                for key, group in zip(keys.tolist(), np.split(positions[order], first[1:])): table.setdefault(key, array('q')).frombytes(group.tobytes())
+            return
+        for k, position in enumerate(positions):
+            for table, code in zip(self.buckets, codes[k * self.tables:(k + 1) * self.tables]): table.setdefault(code, array('q')).append(position)
+
+    def _codes(self, series, starts):
+        # Row-major (window, table) codes of the windows series[p:p+window_size] for p in starts
+        w = self.window_size
+        if np is not None and len(starts) >= 64:
+            windows = np.lib.stride_tricks.sliding_window_view(np.asarray(series, dtype=float), w)[np.asarray(starts, dtype=np.int64)]
+            signs = (windows @ np.asarray(self.planes).reshape(-1, w).T >= 0).reshape(len(starts), self.tables, self.bits)
+            return (signs.astype(np.int64) << np.arange(self.bits)).sum(axis=2).ravel().tolist()
+        codes = []
+        for p in starts:
+            window = series[p:p + w]
+            codes.extend(sum(1 << b for b, plane in enumerate(planes) if sum(x * y for x, y in zip(plane, window)) >= 0) for planes in self.planes)
+        return codes
+
+    def append_source(self, key, candles):
+        # Indexes the closed candles of `candles` newer than the last ones indexed for `key`; returns the number of windows added.
+        # A continuation re-appends the source's last window_size returns so windows spanning the two appends are indexed too.
+        w = self.window_size
+        with self.lock:
+            source = self.meta["sources"].get(key); k = 0 if source is None else bisect.bisect_right(candles.ts, source["last_ts"])
+            closes = candles.close[k:].tolist()
+            if not closes: return 0
+            contiguous = source is not None and k > 0 and candles.ts[k - 1] == source["last_ts"]
+            runs, run, prev = [], list(source["tail"]) if contiguous else [], source["last_close"] if contiguous else None
+            for close in closes:
+                if prev is not None and prev > 0 and close > 0: run.append(math.log(close / prev))
+                elif run: runs.append(run); run = [] # Non-positive close: the log-return series restarts
+                prev = close
+            runs.append(run); added = 0; os.makedirs(self.path, exist_ok=True)
+            for run in runs:
+                if len(run) <= w: continue
+                norms = rolling_window_norms(run, w); starts = [j for j in range(len(run) - w) if norms[j] > 0] # Windows with at least one known outcome
+                offset = len(self.returns); positions = array('q', (offset + j for j in starts)); codes = array('q', self._codes(run, starts))
+                self._append("returns", array('d', run), self.meta["returns"]); self._append("positions", positions, self.meta["entries"]); self._append("codes", codes, self.meta["entries"] * self.tables)
+                self.returns.extend(run); self._returns_np = None; self._index(positions, codes); self.segment_starts.append(offset); self.segment_ends.append(offset + len(run))
+                self.meta["returns"] += len(run); self.meta["entries"] += len(starts); self.meta["segments"].append([offset, offset + len(run)]); added += len(starts)
+            self.meta["sources"][key] = {"last_ts": candles.ts[-1], "last_close": closes[-1], "tail": runs[-1][-w:]}
+            save_to_json(os.path.join(self.path, "meta.json"), self.meta)
+            return added
+
+    def nearest(self, query, top_n=5, horizon=1):
+        # Global return positions of the top_n indexed windows most cosine-similar to `query` with `horizon` known outcomes
+        w = self.window_size
+        if len(query) != w or horizon < 1: return []
+        query_norm = math.sqrt(sum(x * x for x in query))
+        if query_norm == 0: return []
+        codes = self._codes(query, [0])
+        with self.lock:
+            candidates = set()
+            for table, code in zip(self.buckets, codes): candidates.update(table.get(code, ()))
+            if len(candidates) < top_n: # Multi-probe: also visit the buckets one bit flip away
+                for table, code in zip(self.buckets, codes): candidates.update(p for b in range(self.bits) for p in table.get(code ^ (1 << b), ()))
+            positions = sorted(candidates)
+            if np is not None and len(positions) >= 64:
+                if self._returns_np is None: self._returns_np = np.array(self.returns) # Copied once per append, not per query
+                starts = np.asarray(positions, dtype=np.int64); starts = starts[starts + w + horizon <= np.asarray(self.segment_ends)[np.searchsorted(self.segment_starts, starts, side="right") - 1]]
+                windows = np.lib.stride_tricks.sliding_window_view(self._returns_np, w)[starts]
+                positions, similarities = starts.tolist(), (windows @ np.asarray(query, dtype=float) / (np.linalg.norm(windows, axis=1) * query_norm)).tolist()
+            else:
+                returns, candidates, positions, similarities = self.returns, positions, [], []
+                for p in candidates:
+                    if p + w + horizon > self.segment_ends[bisect.bisect_right(self.segment_starts, p) - 1]: continue
+                    window = returns[p:p + w]; norm = math.sqrt(sum(x * x for x in window))
+                    positions.append(p); similarities.append(sum(x * y for x, y in zip(window, query)) / (norm * query_norm))
+            return [positions[k] for k in select_top_k(similarities, top_n)]
+
+    def query(self, query, top_n=5, horizon=1):
+        # Mean of the next `horizon` log returns after the nearest windows (None if none qualify)
+        top = self.nearest(query, top_n, horizon); w = self.window_size
+        with self.lock: return [statistics.mean(self.returns[p + w + h] for p in top) for h in range(horizon)] if top else None
+
+    def stats(self):
+        with self.lock: return {"window_size": self.window_size, "windows": self.meta["entries"], "returns": self.meta["returns"], "sources": sorted(self.meta["sources"]), "tables": self.tables, "bits": self.bits}
+
+pattern_library, pattern_library_lock = None, threading.Lock()
+def get_pattern_library():
+    # Loaded on first use, so processes that never query it (e.g. sweep workers) never index it
+    global pattern_library
+    with pattern_library_lock:
+        if pattern_library is None: pattern_library = PatternLibrary(PATTERN_LIBRARY_DIR)
+        return pattern_library
+
+def update_pattern_library(pairs, start_ts, end_ts):
+    # Syncs each (symbol, interval) into the kline store, then appends its candles not yet indexed to the library
+    library, added = get_pattern_library(), {}
+    for symbol, interval in pairs:
+        candles = kline_store.sync(symbol, interval, "linear", start_ts, end_ts, lambda gap_start, gap_end: fetch_kline_range(symbol, interval, gap_start, gap_end))
+        added[f"{symbol}/{interval}"] = library.append_source(f"linear/{symbol}/{interval}", candles)
+    return {"added": added, **library.stats()}
+
+def rolling_window_norms(data_series, window_size):
+    # Rolling sum of squares: O(1) per window instead of re-summing every slice
+    num_windows = len(data_series) - window_size + 1
+    if window_size <= 0 or num_windows <= 0: return []
+    squares = [x * x for x in data_series]; sum_sq = sum(squares[:window_size]); nonzero = sum(1 for sq in squares[:window_size] if sq)
+    norms = [math.sqrt(sum_sq) if nonzero else 0.0]
+    for i in range(window_size, len(squares)):
+        entering, leaving = squares[i], squares[i - window_size]; sum_sq += entering - leaving; nonzero += (entering != 0) - (leaving != 0)
+        norms.append(math.sqrt(max(sum_sq, 0.0)) if nonzero else 0.0) # all-zero windows stay exactly 0.0
+    return norms
+
+def sliding_dot_profile(data_series, query, num_windows):
+    if np is not None and len(data_series) >= FFT_MIN_SERIES_LENGTH:
+        size = 1 << (len(data_series) - 1).bit_length()
+        spectrum = np.fft.rfft(np.asarray(data_series, dtype=float), size) * np.conj(np.fft.rfft(np.asarray(query, dtype=float), size))
+        return np.fft.irfft(spectrum, size)[:num_windows].tolist()
+    profile = [0.0] * num_windows
+    for k, q in enumerate(query):
+        if q: profile = [acc + q * x for acc, x in zip(profile, data_series[k : k + num_windows])]
+    return profile
+
+def select_top_k(scores, k, indices=None):
+    # Bounded-heap top-k over parallel score/index arrays; ties keep the lower index first (same order as a stable sort)
+    if k <= 0: return []
+    return heapq.nlargest(k, range(len(scores)) if indices is None else indices, key=scores.__getitem__)
+
+def top_similar_windows(data_series, window_size, top_n, num_windows, norms, dots=None):
+    # Ranks the first num_windows windows against the most recent one; norms[-1] is the current window's norm.
+    # `dots` may carry a precomputed dot profile against the most recent window (see WalkForwardPredictor).
+    current_norm = norms[-1]
+    if current_norm == 0 or num_windows <= 0: return None
+    if dots is None: dots = sliding_dot_profile(data_series, data_series[-window_size:], num_windows)
+    similarities = [dot / (h_norm * current_norm) if h_norm > 0 else 0.0 for dot, h_norm in zip(dots, norms)]
+    return select_top_k(similarities, top_n, (i for i in range(num_windows) if norms[i] > 0)) or None
+
+def library_path(library, data_series, window_size, top_n, horizon):
+    # With a PatternLibrary of the same window size, its indexed windows are searched instead of the series' own (None: no match)
+    if library is None or library.window_size != window_size or len(data_series) < window_size: return None
+    return library.query(data_series[-window_size:], top_n, horizon)
+
+def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5, norms=None, library=None, dots=None):
+    path = library_path(library, data_series, window_size, top_n, 1)
+    if path is not None: return path[0]
     if len(data_series) < 2 * window_size: return None
-    def dot_product(v1, v2): return sum(x * y for x, y in zip(v1, v2))
-    def norm(v): return math.sqrt(sum(x * x for x in v))
-    current_pattern = data_series[-window_size:]; current_norm = norm(current_pattern)
-    if current_norm == 0: return None
-    similarities = []
-    for i in range(len(data_series) - window_size):
-        historical_pattern = data_series[i : i + window_size]; historical_norm = norm(historical_pattern)
-        if historical_norm > 0: similarities.append({"sim": dot_product(historical_pattern, current_pattern) / (historical_norm * current_norm), "outcome_index": i + window_size})
-    if not similarities: return None
-    similarities.sort(key=lambda x: x["sim"], reverse=True)
-    return statistics.mean(data_series[p["outcome_index"]] for p in similarities[:top_n])
-
-def predict_next_candles(candles_data, num_predictions=20):
-    if len(candles_data) < 50: return []
-    data = [[float(c[i]) for i in range(6)] for c in candles_data]
-    upper_wicks = [d[2] - max(d[1], d[4]) for d in data]; lower_wicks = [min(d[1], d[4]) - d[3] for d in data]
+    norms = norms if norms is not None else rolling_window_norms(data_series, window_size)
+    top_patterns = top_similar_windows(data_series, window_size, top_n, len(data_series) - window_size, norms, dots)
+    return statistics.mean(data_series[i + window_size] for i in top_patterns) if top_patterns else None
+
+def find_similar_pattern_paths(data_series, window_size=20, top_n=5, horizon=1, norms=None, library=None):
+    # Direct mode: one scan over windows followed by `horizon` known values, then average each step of the matches' futures
+    path = library_path(library, data_series, window_size, top_n, horizon)
+    if path is not None: return path
+    if horizon < 1 or len(data_series) < 2 * window_size: return None
+    norms = norms if norms is not None else rolling_window_norms(data_series, window_size)
+    top_patterns = top_similar_windows(data_series, window_size, top_n, len(data_series) - window_size - horizon + 1, norms)
+    return [statistics.mean(data_series[i + window_size + h] for i in top_patterns) for h in range(horizon)] if top_patterns else None
+
+class PatternForecaster:
+    # Keeps log returns, per-window norms and the newest window's dot profile between forecast steps: each appended close only
+    # updates the newest window, and shifts the profile along its diagonals in O(n) (as in WalkForwardPredictor), so a recursive
+    # forecast costs one full scan plus O(n) per step
+    def __init__(self, closes, window_size=20, top_n=5, library=None):
+        self.window_size, self.top_n, self.library, self.last_close = window_size, top_n, library, (closes[-1] if closes else 0.0)
+        self.log_returns = [math.log(closes[j]/closes[j-1]) for j in range(1,len(closes)) if closes[j-1]>0]
+        self.norms = rolling_window_norms(self.log_returns, window_size)
+        newest = self.log_returns[-window_size:] if len(self.log_returns) >= window_size else []
+        self._sum_sq, self._nonzero, self._dots = sum(x * x for x in newest), sum(1 for x in newest if x * x), None # dots: built by the first series search
+    def dot_profile(self):
+        # Dot products of the newest window with every earlier window followed by a known value; None while too short to search
+        num_windows = len(self.log_returns) - self.window_size
+        if num_windows < self.window_size: return None
+        if self._dots is None: self._dots = sliding_dot_profile(self.log_returns, self.log_returns[-self.window_size:], num_windows)
+        return self._dots
+    def append_close(self, close):
+        if self.last_close > 0:
+            log_return = math.log(close / self.last_close); self.log_returns.append(log_return); size = self.window_size
+            if self._dots is not None: # Only window 0 needs a full dot product; the others drop the old query's first term and add the new value
+                series, dropped = self.log_returns, self.log_returns[-size - 1]
+                self._dots = [sum(q * x for q, x in zip(series[-size:], series))] + [dot - dropped * series[j] + log_return * series[j + size] for j, dot in enumerate(self._dots)]
+            if len(self.log_returns) == size: self._sum_sq, self._nonzero = sum(x * x for x in self.log_returns), sum(1 for x in self.log_returns if x * x)
+            elif len(self.log_returns) > size:
+                leaving_value = self.log_returns[-size - 1]; entering, leaving = log_return * log_return, leaving_value * leaving_value
+                self._sum_sq += entering - leaving; self._nonzero += (entering != 0) - (leaving != 0)
+            if len(self.log_returns) >= size: self.norms.append(math.sqrt(max(self._sum_sq, 0.0)) if self._nonzero else 0.0)
+        self.last_close = close
+    def predict_next_close(self):
+        if not self.log_returns: return None
+        path = library_path(self.library, self.log_returns, self.window_size, self.top_n, 1) # Checked first: a library hit needs no profile
+        predicted_log_return = path[0] if path is not None else find_similar_patterns_pure_python(self.log_returns, self.window_size, self.top_n, norms=self.norms, dots=self.dot_profile())
+        return None if predicted_log_return is None else self.last_close * math.exp(predicted_log_return)
+    def predict_close_path(self, horizon):
+        path = find_similar_pattern_paths(self.log_returns, self.window_size, self.top_n, horizon, norms=self.norms, library=self.library)
+        if path is None: return None
+        closes, close = [], self.last_close
+        for log_return in path: close *= math.exp(log_return); closes.append(close)
+        return closes
+
+@stage_timers.timed("predict_next_candles")
+def predict_next_candles(candles, num_predictions=20, mode="recursive", library=None, window_size=20, top_n=5):
+    if mode not in PREDICTION_MODES: raise ValueError(f"Unknown prediction mode: {mode}")
+    if not isinstance(candles, CandleSeries): candles = CandleSeries.from_rows(candles)
+    if len(candles) < 50: return []
+    upper_wicks = [h - max(o, c) for o, h, c in zip(candles.open, candles.high, candles.close)]; lower_wicks = [min(o, c) - l for o, l, c in zip(candles.open, candles.low, candles.close)]
     avg_upper_wick = statistics.mean(upper_wicks) if upper_wicks else 0; avg_lower_wick = statistics.mean(lower_wicks) if lower_wicks else 0
-    predictions, current_candles = [], data[:]
+    predictions, forecaster = [], PatternForecaster(candles.close.tolist(), window_size, top_n, library)
+    last_ts, interval_ms = candles.ts[-1], candles.ts[-1] - candles.ts[-2]
+    direct_path = forecaster.predict_close_path(num_predictions) if mode == "direct" else None
     for i in range(num_predictions):
-        closes = [c[4] for c in current_candles]; log_returns = [math.log(closes[j]/closes[j-1]) for j in range(1,len(closes)) if closes[j-1]>0]
-        if not log_returns: break
-        predicted_log_return = find_similar_patterns_pure_python(log_returns)
-        if predicted_log_return is None: break
-        last_close = current_candles[-1][4]; predicted_close = last_close * math.exp(predicted_log_return)
+        if mode == "direct": predicted_close = direct_path[i] if direct_path else None
+        else: predicted_close = forecaster.predict_next_close()
+        if predicted_close is None: break
+        last_close = forecaster.last_close
         pred_o, pred_h, pred_l = last_close, max(last_close, predicted_close) + avg_upper_wick, min(last_close, predicted_close) - avg_lower_wick
-        interval_ms = int(current_candles[-1][0]) - int(current_candles[-2][0]); new_ts = int(current_candles[-1][0]) + interval_ms
-        current_candles.append([new_ts, pred_o, pred_h, pred_l, predicted_close, 0])
-        predictions.append({"t": new_ts, "o": pred_o, "h": pred_h, "l": pred_l, "c": predicted_close})
+        last_ts += interval_ms; forecaster.append_close(predicted_close)
+        predictions.append({"t": last_ts, "o": pred_o, "h": pred_h, "l": pred_l, "c": predicted_close})
     return predictions
 
+# --- Prediction Cache ---
+prediction_cache = KlineCache(PREDICTION_CACHE_MAX_ENTRIES, float("inf"), 0)
+
+def get_prediction(symbol, interval, candles, num_predictions=20, mode="recursive", library=None):
+    # predict_next_candles() on the closed candles of `candles` (the forming one is left out), shared by the analysis pool and
+    # /api/candles. Keyed by (symbol, interval, last closed candle ts, model version, input length, mode, library size, horizon),
+    # so each forecast is computed once per candle close, then served from memory, or from PREDICTION_CACHE_DIR after a restart.
+    # Without the forming candle one extra step is forecast and its first candle (standing in for the forming one) dropped, so
+    # the forecast still starts one interval after the forming candle and holds `num_predictions` future candles.
+    closed = candles[:-1] if candles and candle_close_ms(interval, candles.ts[-1]) > time.time() * 1000 else candles
+    if len(closed) < 50: return []
+    skipped = len(candles) - len(closed); horizon = num_predictions + skipped
+    name = f"v{PREDICTION_MODEL_VERSION}-{closed.ts[-1]}-{len(closed)}-{mode}-lib{library.meta['entries'] if library else 0}-{horizon}.json"
+    return prediction_cache.get(f"{symbol}-{interval}/{name}", lambda previous: load_or_predict(symbol, interval, name, closed, horizon, mode, library))[skipped:]
+
+def load_or_predict(symbol, interval, name, candles, num_predictions, mode, library):
+    # Reads the forecast from disk, or computes and stores it; storing one removes those computed for older candles of the pair
+    if not symbol.isalnum(): return predict_next_candles(candles, num_predictions, mode, library) # The symbol names a directory
+    path = os.path.join(PREDICTION_CACHE_DIR, symbol, interval)
+    try:
+        with open(os.path.join(path, name)) as f: return json.load(f)
+    except (OSError, ValueError): pass
+    predicted = predict_next_candles(candles, num_predictions, mode, library)
+    if predicted:
+        try:
+            os.makedirs(path, exist_ok=True); current = f"v{PREDICTION_MODEL_VERSION}-{candles.ts[-1]}-"
+            for old in os.listdir(path):
+                if not old.startswith(current): os.remove(os.path.join(path, old))
+            tmp = os.path.join(path, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w") as f: json.dump(predicted, f)
+            os.replace(tmp, os.path.join(path, name))
+        except OSError as e: app.logger.warning(f"Could not store forecast {name} for {symbol}/{interval}: {e}") # Still served from memory
+    return predicted
+
 # --- BingX Client & Bot Workers (FIXED) ---
 class BingXClient:
     def __init__(self, api_key, secret_key, demo_mode=True): self.api_key, self.secret_key, self.demo_mode = api_key, secret_key, demo_mode
     def _sign(self, params_str): return hmac.new(self.secret_key.encode('utf-8'), params_str.encode('utf-8'), hashlib.sha256).hexdigest()
+    @stage_timers.timed("bingx_request")
     def _request(self, method, path, params=None):
         if params is None: params = {}
         params['timestamp'] = int(time.time() * 1000)
         sorted_params = sorted(params.items())
         query_string = urlencode(sorted_params)
         signature = self._sign(query_string)
-        url = f"{BINGX_API_URL}{path}?{query_string}&signature={signature}"; headers = {'X-BX-APIKEY': self.api_key}
+        headers = {'X-BX-APIKEY': self.api_key}
         try:
-            # Use the global session with a timeout. Post requests will not be retried by default.
-            response = session.request(method.upper(), url, headers=headers, timeout=(5, 10))
+            # Shared pooled client; the signed query is sent as is. POST requests are never retried.
+            response = bingx_http.request(method.upper(), path, params=sorted_params + [("signature", signature)], headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -249,33 +1209,181 @@ class BingXClient:
     def set_leverage(self, symbol, side, leverage): return self._request('POST', "/openApi/swap/v2/trade/leverage", {"symbol": symbol, "side": side, "leverage": leverage})
 
 # --- MODIFIED trade_bot_worker WITH BOT-SIDE TP/SL LOGIC ---
+def analyze_trade_item(item, client, risk, leverage, trigger_percentage, prediction_mode, library):
+    # One scheduled analysis of an item: reversal check for an open position, entry signal otherwise. Runs on the analysis pool.
+    # Predicts from closed candles only, once per closed candle; the forming one is left out of the prediction, but orders are
+    # sized and priced from the live price they fill at: the forming candle's close, at most CACHE_TTL_SECONDS old.
+    try:
+        item_id, symbol, interval = item['id'], item['symbol'], item['interval']
+        with trade_item_lock(item_id):
+            position_data = state.position(item_id)
+            last_close_time = (state.status(item_id) or {}).get('last_close_time', 0)
+
+            candles = get_live_candles(symbol, interval)
+            if not candles: return
+            current_price, forming = candles.close[-1], candle_close_ms(interval, candles.ts[-1]) > time.time() * 1000
+            closed = candles[:-1] if forming else candles
+            if len(closed) < 50 or analysis_schedule.is_analyzed(item_id, closed.ts[-1]): return # Nothing new has closed
+            closed_ts, candles = closed.ts[-1], candles[-50 - forming:] # 50 closed candles; get_prediction leaves the forming one out
+
+            if position_data: # --- Position Management (Reversal Signal) ---
+                predicted_candles = get_prediction(symbol, interval, candles, mode=prediction_mode, library=library)
+                if not predicted_candles: return
+                analysis_schedule.mark_analyzed(item_id, closed_ts)
+                final_predicted_price = predicted_candles[-1]['c']
+                price_change_pct = ((final_predicted_price - current_price) / current_price) * 100
+
+                direction = position_data['direction']
+                is_long = direction == 'long'
+                signal_reversed = (is_long and price_change_pct < -0.5) or (not is_long and price_change_pct > 0.5)
+
+                if signal_reversed:
+                    app.logger.info(f"[AUTO-CLOSE] Signal reversed for {symbol}. Closing {direction} position.")
+                    position_side = direction.upper()
+                    order_side = "SELL" if is_long else "BUY"
+                    res = client.place_order(symbol, order_side, position_side, position_data['quantity'], leverage)
+                    if res and res.get('code') == 0:
+                        app.logger.info(f"Successfully auto-closed {symbol} position.")
+                        state.close_position(item_id, {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}, "reversal")
+                    else:
+                        app.logger.error(f"Failed to auto-close {symbol}: {res.get('msg') if res else 'Unknown error'}")
+
+            else: # --- Position Entry Logic ---
+                if time.time() - last_close_time < TRADE_COOLDOWN_SECONDS:
+                    return # The candle stays unanalyzed, so it is evaluated once the cooldown ends
+
+                predicted_candles = get_prediction(symbol, interval, candles, mode=prediction_mode, library=library)
+                if not predicted_candles: return
+                analysis_schedule.mark_analyzed(item_id, closed_ts)
+                final_predicted_price = predicted_candles[-1]['c']
+                price_change_pct = ((final_predicted_price - current_price) / current_price) * 100
+
+                if abs(price_change_pct) > trigger_percentage:
+                    direction = "long" if price_change_pct > 0 else "short"
+                    tp_price = current_price * (1 + (price_change_pct * 0.8 / 100))
+                    sl_price = current_price * (1 - (price_change_pct * 0.4 / 100)) if direction == "long" else current_price * (1 + (abs(price_change_pct) * 0.4 / 100))
+
+                    if abs(current_price - sl_price) > 0:
+                        quantity = risk / abs(current_price - sl_price)
+                        position_side = direction.upper()
+                        order_side = "BUY" if direction == 'long' else "SELL"
+
+                        app.logger.info(f"[AUTO-TRADE] Entry signal for {symbol}. Placing {direction} order.")
+                        res = client.place_order(symbol, order_side, position_side, quantity, leverage)
+
+                        if res and res.get('code') == 0:
+                            app.logger.info(f"Successfully opened {direction} position for {symbol}.")
+                            state.open_position(item_id, {
+                                'symbol': symbol, 'quantity': quantity, 'direction': direction, 
+                                'entry_price': current_price, 'tp_price': tp_price, 'sl_price': sl_price
+                            }, "signal")
+                        else:
+                            app.logger.error(f"Failed to open position for {symbol}: {res.get('msg') if res else 'Unknown error'}")
+
+    except Exception as e:
+        app.logger.error(f"Error in trade_bot_worker analysis for item {item.get('symbol', 'N/A')}: {e}", exc_info=False)
+
+def run_analysis_cycle(pool, items, **context):
+    # Due items are analyzed concurrently on the bounded pool: their kline fetches overlap, paced by the shared Bybit token bucket
+    # instead of a fixed sleep per coin, and the CPU-bound predictions run on the pool threads, off the trade worker's loop.
+    # Each item reschedules itself when done, so a slow item never holds back the others.
+    # Queued and running items are counted as gauges, and the wait for a pool thread is timed apart from the analysis itself.
+    def run(item, submitted):
+        stage_timers.observe("analysis_queue_wait", time.monotonic() - submitted); stage_timers.add("analysis_queued", -1); stage_timers.add("analysis_running", 1)
+        try:
+            with stage_timers.timer("analyze_trade_item"): analyze_trade_item(item, **context)
+        finally: stage_timers.add("analysis_running", -1); analysis_schedule.finished(item)
+    app.logger.info(f"Analyzing {len(items)} items: {', '.join(item['symbol'] + ' ' + item['interval'] for item in items)}")
+    for item in items: stage_timers.add("analysis_queued", 1); pool.submit(run, item, time.monotonic())
+
+class CandleCloseScheduler:
+    # Heap of (deadline, item id) wake-ups: each trade list item runs once just after its candle closes, instead of every item
+    # on a fixed period. Superseded heap entries (removed or rescheduled items) are dropped lazily when popped.
+    def __init__(self):
+        self.lock, self.heap = threading.Lock(), []
+        self.items, self.next_run, self.analyzed = {}, {}, {} # id -> item; id -> deadline (None while running); id -> last analyzed closed candle ts
+    def _schedule_locked(self, item_id, deadline):
+        self.next_run[item_id] = deadline; heapq.heappush(self.heap, (deadline, item_id)); state.set_next_runs({item_id: deadline})
+    def sync(self, items):
+        # New items run right away; removed ones are forgotten, and items whose symbol or timeframe changed start over
+        with self.lock:
+            current = {item['id']: item for item in items}
+            for item_id in set(self.items) - set(current): del self.items[item_id]; self.next_run.pop(item_id, None); self.analyzed.pop(item_id, None)
+            for item_id, item in current.items():
+                known = self.items.get(item_id)
+                if known is None or (known['symbol'], known['interval']) != (item['symbol'], item['interval']):
+                    self.analyzed.pop(item_id, None); self._schedule_locked(item_id, time.time())
+                self.items[item_id] = item
+    def wake(self, symbol, interval):
+        # A confirmed (closed) candle on the stream runs the pair's items now instead of at the clock deadline
+        with self.lock:
+            for item_id, item in self.items.items():
+                if (item['symbol'], item['interval']) == (symbol, interval) and self.next_run.get(item_id) is not None: self._schedule_locked(item_id, time.time())
+    def due(self):
+        # Pops the items whose deadline passed; they show as running until finished()
+        with self.lock:
+            items, now = [], time.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, item_id = heapq.heappop(self.heap)
+                if item_id in self.items and self.next_run.get(item_id) == deadline:
+                    self.next_run[item_id] = None; items.append(self.items[item_id])
+                    stage_timers.observe("analysis_lag", now - deadline) # How late the run starts against its candle-close deadline
+            if items: state.set_next_runs({item['id']: None for item in items})
+            return items
+    def seconds_until_next(self):
+        with self.lock: return max(0.0, min((deadline for deadline in self.next_run.values() if deadline is not None), default=float("inf")) - time.time())
+    def is_analyzed(self, item_id, closed_ts):
+        with self.lock: return self.analyzed.get(item_id) == closed_ts
+    def mark_analyzed(self, item_id, closed_ts):
+        # Records the newest closed candle the item's signal was evaluated on; until then finished() keeps retrying it
+        with self.lock: self.analyzed[item_id] = closed_ts
+    def finished(self, item):
+        # Next run just after the forming candle closes; sooner while the latest closed candle has not been analyzed yet
+        with self.lock:
+            known = self.items.get(item['id'])
+            if known is None or (known['symbol'], known['interval']) != (item['symbol'], item['interval']): return # Removed or changed while running; sync() handled it
+            now_ms, analyzed = time.time() * 1000, self.analyzed.get(item['id'])
+            if analyzed is not None and candle_close_ms(item['interval'], candle_close_ms(item['interval'], analyzed)) > now_ms:
+                self._schedule_locked(item['id'], candle_close_ms(item['interval'], now_ms) / 1000 + ANALYSIS_CLOSE_DELAY_SECONDS)
+            else: self._schedule_locked(item['id'], time.time() + ANALYSIS_RETRY_SECONDS)
+    def lag(self):
+        # Seconds the most overdue scheduled item is past its deadline (0 when the worker keeps up)
+        with self.lock: return max([0.0] + [time.time() - deadline for deadline in self.next_run.values() if deadline is not None])
+
+analysis_schedule = CandleCloseScheduler()
+
 def trade_bot_worker():
     app.logger.info("Trading bot worker thread started.")
     ticker_check_interval = 5  # Seconds to wait before checking prices for TP/SL
-    analysis_interval = 60     # Seconds to wait for a full new candle analysis
-    last_analysis_time = 0
+    # TP/SL is checked on every streamed price instead of a fixed poll; confirmed klines wake the scheduled analysis
+    market_updates = market_data.subscribe(("ticker", "kline"))
+    analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY, thread_name_prefix="analysis") # TP/SL checks continue while items are analyzed
 
     while True:
-        time.sleep(1) # Main loop delay to prevent tight-looping on errors
         try:
-            with trade_list_lock: trade_list_copy = list(TRADE_LIST)
+            cycle_started = time.perf_counter()
+            trade_list_copy = state.trade_list()
+            analysis_schedule.sync(trade_list_copy)
             if not trade_list_copy:
                 time.sleep(5) # If no coins, sleep longer
                 continue
 
-            with settings_lock:
-                client = BingXClient(SETTINGS['bingx_api_key'], SETTINGS['bingx_secret_key'], SETTINGS['mode'] == 'demo')
-                risk = SETTINGS['risk_usdt']
-                leverage = SETTINGS['leverage']
-                trigger_percentage = SETTINGS.get('trigger_percentage', 4.0)
+            settings = state.settings()
+            client = BingXClient(settings['bingx_api_key'], settings['bingx_secret_key'], settings['mode'] == 'demo')
+            risk = settings['risk_usdt']
+            leverage = settings['leverage']
+            trigger_percentage = settings.get('trigger_percentage', 4.0)
+            prediction_mode = settings.get('prediction_mode', 'recursive')
+            use_pattern_library = settings.get('use_pattern_library', False)
+            library = get_pattern_library() if use_pattern_library else None
 
             # --- High-frequency TP/SL and PnL monitoring ---
-            with positions_lock:
-                active_positions_copy = dict(ACTIVE_POSITIONS)
-                symbols_to_fetch = list(set(pos['symbol'] for pos in active_positions_copy.values()))
+            active_positions_copy = state.positions()
+            symbols_to_fetch = list(set(pos['symbol'] for pos in active_positions_copy.values()))
+            market_data.track("trade_bot", symbols_to_fetch, [(item['symbol'], item['interval']) for item in trade_list_copy])
             
             if symbols_to_fetch:
-                current_prices = get_bybit_ticker_data(symbols_to_fetch)
+                current_prices = market_data.prices_for(symbols_to_fetch)
                 if current_prices:
                     for item_id, position in active_positions_copy.items():
                         symbol = position['symbol']
@@ -296,102 +1404,26 @@ def trade_bot_worker():
                                 elif tp and current_price <= tp: close_position, close_reason = True, "TP"
                             
                             if close_position:
-                                app.logger.info(f"[AUTO-CLOSE] {close_reason} hit for {symbol}. Closing {direction} position.")
-                                position_side = direction.upper()
-                                order_side = "SELL" if direction == 'long' else "BUY"
-                                res = client.place_order(symbol, order_side, position_side, position['quantity'], leverage)
-                                if res and res.get('code') == 0:
-                                    app.logger.info(f"Successfully closed {symbol} position due to {close_reason}.")
-                                    with positions_lock, status_lock:
-                                        if item_id in ACTIVE_POSITIONS: del ACTIVE_POSITIONS[item_id]
-                                        BOT_STATUS[item_id] = {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}
-                                else:
-                                    app.logger.error(f"Failed to close {symbol} on {close_reason}: {res.get('msg') if res else 'Unknown error'}")
+                                with trade_item_lock(item_id):
+                                    if state.position(item_id) is not None: # The analysis pool (or a manual close) may have closed it meanwhile
+                                        app.logger.info(f"[AUTO-CLOSE] {close_reason} hit for {symbol}. Closing {direction} position.")
+                                        position_side = direction.upper()
+                                        order_side = "SELL" if direction == 'long' else "BUY"
+                                        res = client.place_order(symbol, order_side, position_side, position['quantity'], leverage)
+                                        if res and res.get('code') == 0:
+                                            app.logger.info(f"Successfully closed {symbol} position due to {close_reason}.")
+                                            state.close_position(item_id, {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}, close_reason)
+                                        else:
+                                            app.logger.error(f"Failed to close {symbol} on {close_reason}: {res.get('msg') if res else 'Unknown error'}")
                                 continue
 
-            # --- Lower-frequency new signal analysis ---
-            if time.time() - last_analysis_time < analysis_interval:
-                time.sleep(ticker_check_interval) # Use the high-frequency interval here
-                continue
-            
-            app.logger.info("Starting new signal analysis cycle...")
-            last_analysis_time = time.time()
-
-            for item in trade_list_copy:
-                try:
-                    item_id, symbol, interval = item['id'], item['symbol'], item['interval']
-                    
-                    with positions_lock:
-                        position_data = ACTIVE_POSITIONS.get(item_id)
-                    with status_lock:
-                        last_close_time = BOT_STATUS.get(item_id, {}).get('last_close_time', 0)
-                    
-                    raw_candles = get_bybit_data(symbol, interval, limit=50)
-                    if len(raw_candles) < 50: continue
-                    
-                    current_price = float(raw_candles[-1][4])
-
-                    if position_data: # --- Position Management (Reversal Signal) ---
-                        predicted_candles = predict_next_candles(raw_candles)
-                        if not predicted_candles: continue
-                        final_predicted_price = predicted_candles[-1]['c']
-                        price_change_pct = ((final_predicted_price - current_price) / current_price) * 100
-
-                        direction = position_data['direction']
-                        is_long = direction == 'long'
-                        signal_reversed = (is_long and price_change_pct < -0.5) or (not is_long and price_change_pct > 0.5)
-                        
-                        if signal_reversed:
-                            app.logger.info(f"[AUTO-CLOSE] Signal reversed for {symbol}. Closing {direction} position.")
-                            position_side = direction.upper()
-                            order_side = "SELL" if is_long else "BUY"
-                            res = client.place_order(symbol, order_side, position_side, position_data['quantity'], leverage)
-                            if res and res.get('code') == 0:
-                                app.logger.info(f"Successfully auto-closed {symbol} position.")
-                                with positions_lock, status_lock:
-                                    if item_id in ACTIVE_POSITIONS: del ACTIVE_POSITIONS[item_id]
-                                    BOT_STATUS[item_id] = {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}
-                            else:
-                                app.logger.error(f"Failed to auto-close {symbol}: {res.get('msg') if res else 'Unknown error'}")
-
-                    else: # --- Position Entry Logic ---
-                        if time.time() - last_close_time < TRADE_COOLDOWN_SECONDS:
-                            continue
-                        
-                        predicted_candles = predict_next_candles(raw_candles)
-                        if not predicted_candles: continue
-                        final_predicted_price = predicted_candles[-1]['c']
-                        price_change_pct = ((final_predicted_price - current_price) / current_price) * 100
-
-                        if abs(price_change_pct) > trigger_percentage:
-                            direction = "long" if price_change_pct > 0 else "short"
-                            tp_price = current_price * (1 + (price_change_pct * 0.8 / 100))
-                            sl_price = current_price * (1 - (price_change_pct * 0.4 / 100)) if direction == "long" else current_price * (1 + (abs(price_change_pct) * 0.4 / 100))
-                            
-                            if abs(current_price - sl_price) > 0:
-                                quantity = risk / abs(current_price - sl_price)
-                                position_side = direction.upper()
-                                order_side = "BUY" if direction == 'long' else "SELL"
-                                
-                                app.logger.info(f"[AUTO-TRADE] Entry signal for {symbol}. Placing {direction} order.")
-                                res = client.place_order(symbol, order_side, position_side, quantity, leverage)
-                                
-                                if res and res.get('code') == 0:
-                                    app.logger.info(f"Successfully opened {direction} position for {symbol}.")
-                                    with positions_lock:
-                                        ACTIVE_POSITIONS[item_id] = {
-                                            'symbol': symbol, 'quantity': quantity, 'direction': direction, 
-                                            'entry_price': current_price, 'tp_price': tp_price, 'sl_price': sl_price
-                                        }
-                                else:
-                                    app.logger.error(f"Failed to open position for {symbol}: {res.get('msg') if res else 'Unknown error'}")
-
-                except Exception as e:
-                    app.logger.error(f"Error in trade_bot_worker analysis for item {item.get('symbol', 'N/A')}: {e}", exc_info=False)
-                
-                # ******** THE CRITICAL FIX IS HERE ********
-                # Add a delay between analyzing each coin to prevent API rate limiting.
-                time.sleep(1)
+            # --- Candle-close-aligned signal analysis ---
+            due_items = analysis_schedule.due()
+            if due_items: run_analysis_cycle(analysis_pool, due_items, client=client, risk=risk, leverage=leverage, trigger_percentage=trigger_percentage, prediction_mode=prediction_mode, library=library)
+            stage_timers.observe("trade_bot_cycle", time.perf_counter() - cycle_started) # TP/SL checks and scheduling; the wait below is idle time
+            # Wakes early on the next streamed price or kline, and never later than the next scheduled analysis
+            for kind, key in market_updates.wait(min(ticker_check_interval, analysis_schedule.seconds_until_next())):
+                if kind == "kline" and (market_data.latest_candle(*key) or {}).get("confirm"): analysis_schedule.wake(*key)
 
         except Exception as e:
             app.logger.error(f"FATAL ERROR in main trade_bot_worker loop: {e}", exc_info=True)
@@ -400,20 +1432,21 @@ def trade_bot_worker():
 
 def pnl_updater_worker():
     app.logger.info("PnL updater thread started.")
+    price_updates, published = market_data.subscribe(("ticker",)), {} # item id -> (monotonic time, position, status) last written
     while True:
-        time.sleep(2) # Increased from 1s to 2s to be safer with API rate limits
+        price_updates.wait(2) # Streamed prices wake this up; the timeout only refreshes the tracked symbols
         try:
-            with positions_lock:
-                if not ACTIVE_POSITIONS: continue
-                active_positions_copy = dict(ACTIVE_POSITIONS)
-                symbols_to_fetch = list(set(pos['symbol'] for pos in active_positions_copy.values()))
+            active_positions_copy = state.positions()
+            for item_id in set(published) - set(active_positions_copy): del published[item_id]
+            symbols_to_fetch = list(set(pos['symbol'] for pos in active_positions_copy.values()))
+            market_data.track("pnl_updater", symbols_to_fetch)
             
             if not symbols_to_fetch: continue
             
-            ticker_prices = get_bybit_ticker_data(symbols_to_fetch)
+            ticker_prices = market_data.prices_for(symbols_to_fetch)
             if not ticker_prices: continue
 
-            with settings_lock: leverage = SETTINGS.get('leverage', 10)
+            leverage = state.settings().get('leverage', 10)
             
             for item_id, position in active_positions_copy.items():
                 symbol = position['symbol']
@@ -425,30 +1458,109 @@ def pnl_updater_worker():
                     pnl = (current_price - entry_price) * quantity if direction == 'long' else (entry_price - current_price) * quantity
                     initial_margin = (entry_price * quantity) / leverage
                     pnl_pct = (pnl / initial_margin) * 100 if initial_margin > 0 else 0
-                    with status_lock:
-                        BOT_STATUS[item_id] = { "message": f"In {direction.upper()}", "color": "#28a745" if pnl >= 0 else "#dc3545", "pnl": pnl, "pnl_pct": pnl_pct }
+                    status = { "message": f"In {direction.upper()}", "color": "#28a745" if pnl >= 0 else "#dc3545", "pnl": pnl, "pnl_pct": pnl_pct }
+                    # Throttled: a new position is written at once, PnL ticks (and the color going with them) only as configured above
+                    last = published.get(item_id)
+                    if (last is None or last[1] != position or last[2]['message'] != status['message']
+                            or (time.monotonic() - last[0] >= PNL_STATUS_MIN_SECONDS and abs(pnl_pct - last[2]['pnl_pct']) >= PNL_STATUS_MIN_CHANGE_PCT)):
+                        state.set_status(item_id, status); published[item_id] = (time.monotonic(), position, status)
         except Exception as e: 
             app.logger.error(f"Error in PnL updater worker: {e}", exc_info=False)
 
 
+# --- Walk-forward prediction engine for backtests ---
+class WalkForwardPredictor:
+    # Parses the history once and precomputes the forecast for every bar from the `lookback` candles before it
+    # (the same input as predict_next_candles(candles[i-lookback:i])). Like a left matrix profile, each bar's dot profile
+    # is derived from the previous bar's along the diagonals in O(lookback), and each recursive forecast step from the
+    # previous step's, instead of rescanning every window in O(lookback * window_size).
+    # Means use math.fsum rather than statistics.mean (exact Fractions, the bulk of the per-bar cost); results agree to ~1 ulp.
+    REANCHOR_BARS = 256 # Recompute the bar profile exactly this often to bound floating-point drift
+    def __init__(self, candles, lookback=50, num_predictions=20, mode="recursive", window_size=20, top_n=5):
+        if mode not in PREDICTION_MODES: raise ValueError(f"Unknown prediction mode: {mode}")
+        self.lookback, self.num_predictions, self.mode, self.window_size, self.top_n = lookback, num_predictions, mode, window_size, top_n
+        self.ts, self.opens, self.highs, self.lows, self.closes = candles.ts, candles.open, candles.high, candles.low, candles.close # Read in place: arrays, or the sweep's shared memory views
+        self.upper_wicks = [h - max(o, c) for o, h, c in zip(self.opens, self.highs, self.closes)]; self.lower_wicks = [min(o, c) - l for o, l, c in zip(self.opens, self.lows, self.closes)]
+        self.predictions = [[] for _ in self.ts]
+        if lookback < 50: return # predict_next_candles never predicts from fewer than 50 candles
+        if any(c <= 0 for c in self.closes): # Gapped log-return series: fall back to the per-bar predictor
+            for i in range(lookback, len(candles)): self.predictions[i] = predict_next_candles(candles[i-lookback:i], num_predictions, mode, window_size=window_size, top_n=top_n)
+            return
+        self._sweep()
+
+    def predictions_at(self, i): return self.predictions[i]
+
+    def _sweep(self):
+        w, size = self.window_size, self.lookback - 1 # size = log returns available to each bar
+        if size < 2 * w: return
+        closes = self.closes; returns = [math.log(closes[j+1] / closes[j]) for j in range(len(closes) - 1)]
+        norms, num_windows, profile = rolling_window_norms(returns, w), size - w, None
+        for i in range(self.lookback, len(closes)):
+            base = i - self.lookback; query = base + num_windows # global start of the bar's first log return / of its query window
+            if profile is None or base % self.REANCHOR_BARS == 0: profile = sliding_dot_profile(returns[base:base + size], returns[query:query + w], num_windows)
+            else:
+                prev_query_first, prev_query_next = returns[query - 1], returns[query + w - 1]
+                profile = [dot - returns[base + j - 1] * prev_query_first + returns[base + j + w - 1] * prev_query_next for j, dot in enumerate(profile)]
+            self.predictions[i] = self._forecast(i, returns[base:base + size], norms[base:query + 1], profile)
+
+    def _forecast(self, i, series, norms, profile):
+        w, top_n, horizon = self.window_size, self.top_n, self.num_predictions
+        avg_upper_wick = math.fsum(self.upper_wicks[i - self.lookback:i]) / self.lookback; avg_lower_wick = math.fsum(self.lower_wicks[i - self.lookback:i]) / self.lookback
+        last_close, last_ts, interval_ms = self.closes[i-1], self.ts[i-1], self.ts[i-1] - self.ts[i-2]
+        if self.mode == "direct":
+            top_patterns = top_similar_windows(series, w, top_n, len(series) - w - horizon + 1, norms, dots=profile)
+            if not top_patterns: return []
+            predicted_closes, close = [], last_close
+            for h in range(horizon): close *= math.exp(math.fsum(series[j + w + h] for j in top_patterns) / len(top_patterns)); predicted_closes.append(close)
+        else:
+            series, norms, predicted_closes = list(series), list(norms), []
+            for step in range(horizon):
+                top_patterns = top_similar_windows(series, w, top_n, len(series) - w, norms, dots=profile)
+                if not top_patterns: break
+                predicted_close = (predicted_closes[-1] if predicted_closes else last_close) * math.exp(math.fsum(series[j + w] for j in top_patterns) / len(top_patterns))
+                series.append(math.log(predicted_close / (predicted_closes[-1] if predicted_closes else last_close))); predicted_closes.append(predicted_close)
+                norms.append(math.sqrt(sum(x * x for x in series[-w:])))
+                # Shift the profile to the new query along the diagonals; only window 0 needs a full dot product
+                query = len(series) - w; first, nxt = series[query - 1], series[query + w - 1]
+                profile = [sum(x * y for x, y in zip(series[:w], series[query:]))] + [dot - series[j] * first + series[j + w] * nxt for j, dot in enumerate(profile)]
+        predictions, pred_o = [], last_close
+        for predicted_close in predicted_closes:
+            last_ts += interval_ms
+            predictions.append({"t": last_ts, "o": pred_o, "h": max(pred_o, predicted_close) + avg_upper_wick, "l": min(pred_o, predicted_close) - avg_lower_wick, "c": predicted_close}); pred_o = predicted_close
+        return predictions
+
 # --- Backtesting Engine (MODIFIED) ---
+def fetch_kline_range(symbol, interval, start_ts, end_ts, concurrency=HISTORY_DOWNLOAD_CONCURRENCY):
+    # Splits [start_ts, end_ts] into interval-aligned pages of at most KLINE_PAGE_SIZE candles, fetches them concurrently
+    # (bounded by `concurrency` and the shared rate limiter), then stitches them and de-duplicates by timestamp
+    page_span = KLINE_PAGE_SIZE * interval_to_ms(interval); aligned_start = start_ts - start_ts % interval_to_ms(interval)
+    pages = [(page_start, min(page_start + page_span - 1, end_ts)) for page_start in range(aligned_start, end_ts + 1, page_span)]
+    def fetch_page(page):
+        return get_bybit_data(symbol, interval, start_ts=page[0], end_ts=page[1], limit=KLINE_PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pages)))) as pool: chunks = list(pool.map(fetch_page, pages))
+    rows_by_ts = {row[0]: row for chunk in chunks for row in chunk.rows() if start_ts <= row[0] <= end_ts}
+    return CandleSeries.from_rows([rows_by_ts[ts] for ts in sorted(rows_by_ts)])
+
+def fetch_backtest_history(symbol, interval, start_ts, end_ts):
+    # Served from the local kline store; only ranges never fetched before go to the exchange
+    candles = kline_store.sync(symbol, interval, "linear", start_ts, end_ts, lambda gap_start, gap_end: fetch_kline_range(symbol, interval, gap_start, gap_end))
+    if len(candles) < 50: raise ValueError("Not enough historical data.")
+    return candles
+
 def run_backtest_simulation(symbol, interval, start_ts, end_ts):
-    all_candles_raw, current_start_ts = [], start_ts
-    while current_start_ts <= end_ts:
-        chunk = get_bybit_data(symbol, interval, start_ts=current_start_ts);
-        if not chunk: break
-        all_candles_raw.extend(chunk); last_ts = int(chunk[-1][0])
-        if len(chunk) < 1000 or last_ts >= end_ts: break
-        current_start_ts = last_ts + 1
-    if len(all_candles_raw) < 50: raise ValueError("Not enough historical data.")
-    with settings_lock:
-        risk_usdt = SETTINGS['risk_usdt']
-        leverage = SETTINGS['leverage']
-        trigger_percentage = SETTINGS.get('trigger_percentage', 4.0)
+    candles = fetch_backtest_history(symbol, interval, start_ts, end_ts)
+    settings = state.settings()
+    risk_usdt = settings['risk_usdt']
+    leverage = settings['leverage']
+    trigger_percentage = settings.get('trigger_percentage', 4.0)
+    prediction_mode = settings.get('prediction_mode', 'recursive')
+    return simulate_backtest(WalkForwardPredictor(candles, 50, 20, prediction_mode), start_ts, risk_usdt, leverage, trigger_percentage)
 
+def simulate_backtest(predictor, start_ts, risk_usdt, leverage, trigger_percentage):
+    closes = predictor.closes
     equity, equity_curve, trades, open_position = 10000.0, [{'time': start_ts, 'equity': 10000.0}], [], None
-    for i in range(50, len(all_candles_raw)):
-        candle = {'t': int(all_candles_raw[i][0]), 'c': float(all_candles_raw[i][4]), 'h': float(all_candles_raw[i][2]), 'l': float(all_candles_raw[i][3])}
+    for i in range(predictor.lookback, len(closes)):
+        candle = {'t': predictor.ts[i], 'c': closes[i], 'h': predictor.highs[i], 'l': predictor.lows[i]}
         if open_position:
             exit_price, exit_reason = None, None
             if open_position['direction'] == 'long':
@@ -458,72 +1570,245 @@ def run_backtest_simulation(symbol, interval, start_ts, end_ts):
                 if candle['h'] >= open_position['sl']: exit_price, exit_reason = open_position['sl'], 'SL'
                 elif candle['l'] <= open_position['tp']: exit_price, exit_reason = open_position['tp'], 'TP'
             if not exit_price:
-                predicted = predict_next_candles(all_candles_raw[i-50:i], 20)
+                predicted = predictor.predictions_at(i)
                 if predicted:
-                    last_price = float(all_candles_raw[i-1][4]); change_pct = ((predicted[-1]['c'] - last_price) / last_price) * 100
+                    last_price = closes[i-1]; change_pct = ((predicted[-1]['c'] - last_price) / last_price) * 100
                     if (open_position['direction']=='long' and change_pct<-0.5) or (open_position['direction']=='short' and change_pct>0.5): exit_price, exit_reason = candle['c'], 'Reversal'
             if exit_price:
                 pnl = (exit_price - open_position['entry_price']) * open_position['quantity'] if open_position['direction'] == 'long' else (open_position['entry_price'] - exit_price) * open_position['quantity']
                 equity += pnl; trades.append({'exit_time': candle['t'], 'direction': open_position['direction'], 'pnl': pnl, 'return_pct': (pnl / ((open_position['entry_price'] * open_position['quantity']) / leverage)) * 100, 'exit_reason': exit_reason}); open_position = None
         if not open_position:
-            predicted = predict_next_candles(all_candles_raw[i-50:i], 20)
+            predicted = predictor.predictions_at(i)
             if predicted:
-                price = float(all_candles_raw[i-1][4]); change = ((predicted[-1]['c'] - price) / price) * 100
+                price = closes[i-1]; change = ((predicted[-1]['c'] - price) / price) * 100
                 if abs(change) > trigger_percentage:
                     direction = "long" if change > 0 else "short"
                     tp = price * (1 + (change*0.8/100)); sl = price * (1-(change*0.4/100)) if direction == "long" else price * (1+(abs(change)*0.4/100))
                     if not (any(p['l'] < sl for p in predicted) if direction == "long" else any(p['h'] > sl for p in predicted)) and abs(price-sl)>0:
                         open_position = {'entry_price': price, 'quantity': risk_usdt / abs(price - sl), 'direction': direction, 'tp': tp, 'sl': sl}
         equity_curve.append({'time': candle['t'], 'equity': equity})
-    net_profit = equity - 10000; total_trades = len(trades); win_rate = (len([t for t in trades if t['pnl'] > 0]) / total_trades * 100) if total_trades > 0 else 0; total_profit = sum(t['pnl'] for t in trades if t['pnl']>0); total_loss = abs(sum(t['pnl'] for t in trades if t['pnl']<=0)); profit_factor = total_profit / total_loss if total_loss > 0 else float('inf'); max_dd, peak = 0, -1
+    net_profit = equity - 10000; total_trades = len(trades); win_rate = (len([t for t in trades if t['pnl'] > 0]) / total_trades * 100) if total_trades > 0 else 0; total_profit = sum(t['pnl'] for t in trades if t['pnl']>0); total_loss = abs(sum(t['pnl'] for t in trades if t['pnl']<=0)); profit_factor = total_profit / total_loss if total_loss > 0 else None; max_dd, peak = 0, -1
     for item in equity_curve:
         if item['equity'] > peak: peak = item['equity']
         dd = (peak - item['equity']) / peak if peak != 0 else 0; max_dd = max(max_dd, dd)
+    # profit_factor is None (JSON null) without losing trades: infinite, and JSON has no Infinity
     return {"metrics": {"net_profit": net_profit, "total_trades": total_trades, "win_rate": win_rate, "profit_factor": profit_factor, "max_drawdown": max_dd * 100, "avg_trade_pnl": (net_profit / total_trades) if total_trades > 0 else 0}, "trades": trades, "equity_curve": equity_curve}
 
+# --- Parallel Parameter Sweep ---
+# Trade parameters only change the simulation; model parameters change the predictions, so jobs are grouped by the
+# model parameters and each worker builds one WalkForwardPredictor per group and replays it for every trade combination.
+SWEEP_TRADE_PARAMS = ["trigger_percentage", "risk_usdt", "leverage"]
+SWEEP_MODEL_PARAMS = ["prediction_mode", "lookback", "window_size", "top_n"]
+SWEEP_SORT_KEYS = {"net_profit": True, "profit_factor": True, "win_rate": True, "max_drawdown": False} # True = higher is better
+MAX_SWEEP_COMBINATIONS = 500
+SWEEP_SHARED_CANDLES = None # Worker-side handle on the shared candle block (the CandleSeries columns back to back)
+
+def init_sweep_worker(shm_name):
+    global SWEEP_SHARED_CANDLES
+    SWEEP_SHARED_CANDLES = shared_memory.SharedMemory(name=shm_name)
+
+def run_sweep_job(job):
+    model_params, trade_combos, start_ts, count = job
+    # Zero-copy column views: the predictor and the simulations read the candles in the shared block, no worker copies them
+    columns = [SWEEP_SHARED_CANDLES.buf[k * count * 8:(k + 1) * count * 8].cast(typecode) for k, (_, typecode) in enumerate(CandleSeries.COLUMNS)]
+    try:
+        predictor = WalkForwardPredictor(CandleSeries(*columns), model_params['lookback'], 20, model_params['prediction_mode'], model_params['window_size'], model_params['top_n'])
+        return [{**model_params, **trade_params, **simulate_backtest(predictor, start_ts, trade_params['risk_usdt'], trade_params['leverage'], trade_params['trigger_percentage'])['metrics']} for trade_params in trade_combos]
+    finally:
+        predictor = None # Drops its references to the views before they are released
+        for column in columns: column.release()
+
+def run_parameter_sweep(symbol, interval, start_ts, end_ts, grid, sort_by="net_profit", max_workers=None):
+    if sort_by not in SWEEP_SORT_KEYS: raise ValueError(f"Invalid sort key: {sort_by}")
+    settings = state.settings(); defaults = {"trigger_percentage": settings.get('trigger_percentage', 4.0), "risk_usdt": settings['risk_usdt'], "leverage": settings['leverage'], "prediction_mode": settings.get('prediction_mode', 'recursive'), "lookback": 50, "window_size": 20, "top_n": 5}
+    casts = {"trigger_percentage": float, "risk_usdt": float, "leverage": int, "prediction_mode": str, "lookback": int, "window_size": int, "top_n": int}
+    axes = {name: [casts[name](v) for v in (grid.get(name) or [defaults[name]])] for name in SWEEP_TRADE_PARAMS + SWEEP_MODEL_PARAMS}
+    if any(mode not in PREDICTION_MODES for mode in axes['prediction_mode']): raise ValueError("Invalid prediction_mode in grid")
+    if math.prod(len(values) for values in axes.values()) > MAX_SWEEP_COMBINATIONS: raise ValueError(f"Grid exceeds {MAX_SWEEP_COMBINATIONS} combinations")
+    trade_combos = [dict(zip(SWEEP_TRADE_PARAMS, values)) for values in itertools.product(*(axes[name] for name in SWEEP_TRADE_PARAMS))]
+    candles = fetch_backtest_history(symbol, interval, start_ts, end_ts); count = len(candles)
+    jobs = [(dict(zip(SWEEP_MODEL_PARAMS, values)), trade_combos, start_ts, count) for values in itertools.product(*(axes[name] for name in SWEEP_MODEL_PARAMS))]
+    shm = shared_memory.SharedMemory(create=True, size=count * 8 * len(CandleSeries.COLUMNS)) # Every column is 8 bytes wide (int64 / float64)
+    try:
+        for k, column in enumerate(candles.columns()): shm.buf[k * count * 8:(k + 1) * count * 8] = memoryview(column).cast('B')
+        # "spawn" keeps workers from inheriting locks held by the bot's threads at fork time
+        with ProcessPoolExecutor(max_workers=max(1, min(max_workers or os.cpu_count() or 1, len(jobs))), mp_context=multiprocessing.get_context("spawn"), initializer=init_sweep_worker, initargs=(shm.name,)) as pool:
+            results = [row for rows in pool.map(run_sweep_job, jobs) for row in rows]
+    finally: shm.close(); shm.unlink()
+    results.sort(key=lambda row: math.inf if row[sort_by] is None else row[sort_by], reverse=SWEEP_SORT_KEYS[sort_by]) # None: profit factor without losses
+    for rank, row in enumerate(results, 1): row['rank'] = rank
+    return {"symbol": symbol, "interval": interval, "candles": count, "combinations": len(results), "sort_by": sort_by, "results": results}
+
+# --- Response Cache ---
+response_cache = KlineCache(RESPONSE_CACHE_MAX_ENTRIES, float("inf"))
+
+def candles_etag(candles, *params):
+    # Strong ETag: the parameters, the model version, the last candle ts and a checksum of the forming candle (the only one that changes between closes)
+    return "-".join(map(str, params + (PREDICTION_MODEL_VERSION, len(candles), candles.ts[-1], f"{zlib.crc32(repr(candles[-1]).encode()):08x}")))
+
+def cached_json_response(etag, render):
+    # If-None-Match is answered with a 304 before anything is computed; otherwise render() is serialized once per ETag and kept, as JSON and gzip, in response_cache
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match: return Response(status=304, headers=headers)
+    body, compressed = response_cache.get(etag, lambda previous: encode_json_body(render()))
+    if request.accept_encodings.quality("gzip") > 0: return Response(compressed, mimetype="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(body, mimetype="application/json", headers=headers)
+
+def encode_json_body(data):
+    body = json.dumps(data, separators=(",", ":")).encode(); return body, gzip.compress(body, 6) # Compact JSON and its gzip encoding
+
+# --- Prometheus Metrics ---
+def prometheus_labels(**labels):
+    # {name="value",...}; json.dumps escapes backslashes, quotes and newlines the way the text format expects. Every sample carries
+    # the process's role and pid: under --serve each process answers /metrics with its own counters, so without them a scrape
+    # landing on another worker would look like a counter reset.
+    labels = {"role": process_role, "pid": os.getpid(), **labels}
+    return "{" + ",".join(f"{name}={json.dumps(str(value))}" for name, value in labels.items()) + "}"
+
+def prometheus_family(name, kind, help_text, samples):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+
+def prometheus_histogram(name, stats, **labels):
+    # Sample lines of one stats() histogram (count, sum_ms, requests per bucket keyed by upper bound in ms): cumulative, in seconds
+    lines, total = [], 0
+    for bound, count in stats["buckets"].items():
+        total += count; lines.append(f"{name}_bucket{prometheus_labels(**labels, le=bound if bound == '+Inf' else f'{int(bound) / 1000:g}')} {total}")
+    return lines + [f"{name}_sum{prometheus_labels(**labels)} {stats['sum_ms'] / 1000:g}", f"{name}_count{prometheus_labels(**labels)} {stats['count']}"]
+
+def prometheus_metrics():
+    # Body of /metrics in the Prometheus text exposition format (0.0.4): stage timers, exchange request latencies, cache
+    # effectiveness, analysis lag and queue depths. Everything is read from the in-process counters; nothing is computed here.
+    # The engine's own families (analysis, market data, status feed) are left out in HTTP-only processes, where they would read 0.
+    timers, caches = stage_timers.stats(), {"klines": live_kline_cache.stats(), "predictions": prediction_cache.stats(), "responses": response_cache.stats()}
+    exchanges = {"bybit": bybit_http.stats(), "bingx": bingx_http.stats()}
+    lines = prometheus_family("stage_duration_seconds", "histogram", "Time spent per hot-path stage.", [line for stage, stats in sorted(timers["stages"].items()) for line in prometheus_histogram("stage_duration_seconds", stats, stage=stage)])
+    lines += prometheus_family("exchange_request_duration_seconds", "histogram", "Exchange HTTP request latency per endpoint.", [line for exchange, endpoints in exchanges.items() for path, stats in sorted(endpoints.items()) for line in prometheus_histogram("exchange_request_duration_seconds", stats, exchange=exchange, endpoint=path)])
+    lines += prometheus_family("exchange_requests_total", "counter", "Exchange HTTP requests per endpoint and outcome (status code or error).", [f"exchange_requests_total{prometheus_labels(exchange=exchange, endpoint=path, outcome=outcome)} {count}" for exchange, endpoints in exchanges.items() for path, stats in sorted(endpoints.items()) for outcome, count in sorted(stats["outcomes"].items())])
+    lines += prometheus_family("cache_events_total", "counter", "Cache lookups and loads per outcome.", [f"cache_events_total{prometheus_labels(cache=name, event=event)} {stats[event]}" for name, stats in caches.items() for event in ("hits", "stale_hits", "misses", "waits", "evictions", "loads", "load_errors")])
+    lines += prometheus_family("cache_hit_ratio", "gauge", "Share of cache lookups served without a load, since start.", [f"cache_hit_ratio{prometheus_labels(cache=name)} {(stats['hits'] + stats['stale_hits']) / max(1, stats['hits'] + stats['stale_hits'] + stats['misses']):g}" for name, stats in caches.items()])
+    lines += prometheus_family("cache_entries", "gauge", "Entries held per cache.", [f"cache_entries{prometheus_labels(cache=name)} {stats['size']}" for name, stats in caches.items()])
+    lines += prometheus_family("cache_inflight_loads", "gauge", "Loads in progress per cache.", [f"cache_inflight_loads{prometheus_labels(cache=name)} {stats['inflight']}" for name, stats in caches.items()])
+    lines += prometheus_family("sse_streams", "gauge", "Open trade list streams (dashboards).", [f"sse_streams{prometheus_labels()} {timers['gauges'].get('sse_streams', 0)}"])
+    if process_role == "http": return "\n".join(lines) + "\n"
+    lines += prometheus_family("analysis_lag_seconds", "gauge", "How far the most overdue trade list item is past its scheduled analysis.", [f"analysis_lag_seconds{prometheus_labels()} {analysis_schedule.lag():g}"])
+    lines += prometheus_family("analysis_queue_depth", "gauge", "Trade list items waiting for or running on the analysis pool.", [f"analysis_queue_depth{prometheus_labels(state=phase)} {timers['gauges'].get('analysis_' + phase, 0)}" for phase in ("queued", "running")])
+    lines += prometheus_family("status_feed_changes_total", "counter", "Trade list changes published to the dashboards.", [f"status_feed_changes_total{prometheus_labels()} {state.feed_version()}"])
+    lines += prometheus_family("market_data_connected", "gauge", "1 while the market data stream is connected.", [f"market_data_connected{prometheus_labels()} {int(market_data.status()['connected'])}"])
+    return "\n".join(lines) + "\n"
+
+# --- Sampling Profiler ---
+profiler_lock = threading.Lock() # One profile at a time
+
+def is_loopback(address):
+    try: return ipaddress.ip_address(address).is_loopback
+    except ValueError: return False # None, or not an IP address (e.g. a Unix socket peer)
+
+def thread_cpu_seconds(native_id):
+    # CPU time used by a thread, read from its Linux per-thread CPU clock (the clock id glibc derives from the tid: CPUCLOCK_SCHED
+    # | CPUCLOCK_PERTHREAD_MASK). An exited tid fails cleanly with EINVAL. None on other platforms.
+    try: return time.clock_gettime((~native_id << 3) | 6) if sys.platform.startswith("linux") else None
+    except OSError: return None
+
+def sample_thread_stacks(seconds, hz, mode="cpu", thread_filter=""):
+    # Samples the Python stack of every thread (whose name contains thread_filter) `hz` times a second for `seconds`, and returns
+    # {collapsed stack: weight}, stacks rooted at the thread name with pool numbers folded ("analysis_N", "Thread-N (_load)").
+    # mode="wall" counts every sample, blocked threads included; mode="cpu" weighs a sample by the CPU microseconds the thread used
+    # since the previous one, so idle and waiting threads drop out. Runs on the calling thread, which leaves itself out.
+    stacks, labels, last_cpu, me, interval = Counter(), {}, {}, threading.get_ident(), 1 / hz
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started, threads = time.monotonic(), {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            if ident == me or thread is None or thread_filter not in thread.name: continue
+            weight = 1
+            if mode == "cpu":
+                cpu, previous = thread_cpu_seconds(thread.native_id), last_cpu.get(ident); last_cpu[ident] = cpu
+                if cpu is None or previous is None: continue
+                weight = round((cpu - previous) * 1e6)
+                if weight <= 0: continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in labels: labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                names.append(labels[code]); frame = frame.f_back
+            stacks[";".join([re.sub(r"\d+", "N", thread.name).replace(";", ":")] + names[::-1])] += weight
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return stacks
+
 # --- Flask Routes (Unchanged)---
 @app.route('/')
 def index(): return render_template_string(HTML_TEMPLATE)
 @app.route('/api/candles')
 def api_candles():
     symbol, interval, num_predictions = request.args.get('symbol', 'BTCUSDT').upper(), request.args.get('interval', '60'), max(1, min(request.args.get('predictions', 20, type=int), 50))
+    since = request.args.get('since', type=int) # ts of the last candle the chart already has
+    settings = state.settings(); mode = request.args.get('mode', settings.get('prediction_mode', 'recursive')); use_pattern_library = settings.get('use_pattern_library', False)
     if interval not in ALLOWED_INTERVALS: return jsonify({"error": "Invalid interval"}), 400
+    if mode not in PREDICTION_MODES: return jsonify({"error": "Invalid mode"}), 400
     try:
-        raw_candles = get_bybit_data(symbol, interval)[-500:]
-        historical = [{"t": int(c[0]), "o": float(c[1]), "h": float(c[2]), "l": float(c[3]), "c": float(c[4])} for c in raw_candles]
-        predicted = predict_next_candles(raw_candles); return jsonify({"candles": historical, "predicted": predicted})
+        candles, library = get_live_candles(symbol, interval)[-500:], get_pattern_library() if use_pattern_library else None
+        if not candles: return jsonify({"error": "No data from Bybit API (check symbol)"}), 404
+        # With `since` inside the window only the candles from that one on are sent (it may have changed); "full" tells the chart to replace or patch
+        delta = since is not None and candles.ts[0] <= since; shown = candles[bisect.bisect_left(candles.ts, since):] if delta else candles
+        etag = candles_etag(candles, symbol, interval, mode, num_predictions, library.meta['entries'] if library else 0, since if delta else "full")
+        return cached_json_response(etag, lambda: {"full": not delta, "candles": shown.to_dicts(), "predicted": get_prediction(symbol, interval, candles, num_predictions, mode, library)})
     except Exception as e: return jsonify({"error": str(e)}), 500
+@app.route('/api/market_data')
+def api_market_data(): return jsonify(market_data.status())
+@app.route('/api/cache_stats')
+def api_cache_stats(): return jsonify({**live_kline_cache.stats(), "predictions": prediction_cache.stats()})
+@app.route('/api/http_stats')
+def api_http_stats(): return jsonify({"bybit": bybit_http.stats(), "bingx": bingx_http.stats()})
+@app.route('/api/stage_stats')
+def api_stage_stats(): return jsonify(stage_timers.stats())
+@app.route('/metrics')
+def metrics(): return Response(prometheus_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 @app.route('/api/settings', methods=['GET', 'POST'])
 def handle_settings():
-    with settings_lock:
-        if request.method == 'POST': SETTINGS.update(request.json); save_to_json(SETTINGS_FILE, SETTINGS); return jsonify({"status": "success"})
-        return jsonify(SETTINGS)
+    if request.method == 'POST': state.update_settings(request.json); return jsonify({"status": "success"})
+    return jsonify(state.settings())
+def trade_list_snapshot():
+    # One consistent read of the store; next_runs are epoch seconds, null while running
+    return state.snapshot()[0]
+@app.route('/api/journal')
+def get_journal():
+    # ?after=<seq>&limit=<n>&id=<item id>: position, trade list, settings and status events, oldest first
+    return jsonify(state.journal(request.args.get("after", 0, type=int), min(request.args.get("limit", 100, type=int), 1000), request.args.get("id")))
 @app.route('/api/trade_list', methods=['GET'])
-def get_trade_list():
-    with trade_list_lock, status_lock: return jsonify({"trade_list": TRADE_LIST, "bot_status": BOT_STATUS})
+def get_trade_list(): return jsonify(trade_list_snapshot())
+@app.route('/api/trade_list/stream')
+def stream_trade_list():
+    # Server-Sent Events: a snapshot (skipped when the browser resumes with a Last-Event-ID still in the feed's history), then the
+    # coalesced changes at most every SSE_MIN_INTERVAL_SECONDS. Each open dashboard holds one server thread while it is connected.
+    def events(version):
+        stage_timers.add("sse_streams", 1)
+        try: yield from stream(version)
+        finally: stage_timers.add("sse_streams", -1) # Runs when the client disconnects and the generator is closed
+    def stream(version):
+        while True:
+            if version is None:
+                snapshot, version = state.snapshot() # The feed version the snapshot includes, read in the same transaction
+                yield sse_event("snapshot", snapshot, version)
+            started = time.monotonic(); version, text = status_feed.wait(version, SSE_KEEPALIVE_SECONDS)
+            if text is None: version = None; continue
+            yield text or ": keep-alive\n\n"
+            time.sleep(max(0.0, SSE_MIN_INTERVAL_SECONDS - (time.monotonic() - started)))
+    return Response(events(request.headers.get("Last-Event-ID", type=int)), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 @app.route('/api/trade_list/add', methods=['POST'])
 def add_to_trade_list():
     item = request.json; item['id'] = str(int(time.time() * 1000))
-    with trade_list_lock:
-        if not any(i['symbol'] == item['symbol'] and i['interval'] == item['interval'] for i in TRADE_LIST):
-            TRADE_LIST.append(item)
-            with status_lock: BOT_STATUS[item['id']] = {"message": "Waiting...", "color": "#fff"}
-            save_to_json(TRADELIST_FILE, TRADE_LIST)
+    state.add_trade_item(item, {"message": "Waiting...", "color": "#fff"}) # Ignored when the symbol and interval are already listed
     return jsonify({"status": "success"})
 @app.route('/api/trade_list/remove', methods=['POST'])
 def remove_from_trade_list():
-    item_id = request.json.get('id');
-    with trade_list_lock: global TRADE_LIST; TRADE_LIST = [i for i in TRADE_LIST if i['id'] != item_id]; save_to_json(TRADELIST_FILE, TRADE_LIST)
-    with status_lock:
-        if item_id in BOT_STATUS: del BOT_STATUS[item_id]
-    with positions_lock:
-        if item_id in ACTIVE_POSITIONS: del ACTIVE_POSITIONS[item_id]
+    state.remove_trade_item(request.json.get('id')) # Its status and position go with it
     return jsonify({"status": "success"})
 @app.route('/api/manual_trade', methods=['POST'])
 def manual_trade():
     try:
         data = request.json; symbol, side, item_id = data['symbol'], data['side'], data['id']
-        with settings_lock: client = BingXClient(SETTINGS['bingx_api_key'], SETTINGS['secret_key'], SETTINGS['mode'] == 'demo'); risk, lev = SETTINGS['risk_usdt'], SETTINGS['leverage']
+        settings = state.settings(); client = BingXClient(settings['bingx_api_key'], settings['secret_key'], settings['mode'] == 'demo'); risk, lev = settings['risk_usdt'], settings['leverage']
         price_data = get_bybit_ticker_data(symbol)
         if not price_data or symbol not in price_data: return jsonify({"error": "Could not fetch current price"}), 400
         current_price = price_data[symbol]; quantity = risk / (current_price * 0.02)
@@ -531,9 +1816,7 @@ def manual_trade():
         app.logger.info(f"[MANUAL] Placing {side} order for {symbol}. Qty: {quantity:.4f}")
         res = client.place_order(symbol, order_side, position_side, quantity, lev)
         if res and res.get('code') == 0:
-            with positions_lock, status_lock:
-                ACTIVE_POSITIONS[item_id] = {'symbol': symbol, 'quantity': quantity, 'direction': side, 'entry_price': current_price}
-                BOT_STATUS.pop(item_id, None)
+            state.open_position(item_id, {'symbol': symbol, 'quantity': quantity, 'direction': side, 'entry_price': current_price}, "manual", clear_status=True)
             return jsonify({"message": f"Manual {side} order placed for {symbol}."})
         return jsonify({"error": f"Failed: {res.get('msg') if res else 'Unknown error'}"}), 400
     except Exception as e: app.logger.error(f"Manual trade error: {e}", exc_info=True); return jsonify({"error": str(e)}), 500
@@ -541,17 +1824,14 @@ def manual_trade():
 def manual_close():
     try:
         data = request.json; symbol, item_id = data['symbol'], data['id']
-        with positions_lock:
-            if item_id not in ACTIVE_POSITIONS: return jsonify({"message": "No active position found by the bot to close."}), 404
-            pos = ACTIVE_POSITIONS[item_id]
-        with settings_lock: client = BingXClient(SETTINGS['bingx_api_key'], SETTINGS['secret_key'], SETTINGS['mode'] == 'demo'); lev = SETTINGS['leverage']
+        pos = state.position(item_id)
+        if pos is None: return jsonify({"message": "No active position found by the bot to close."}), 404
+        settings = state.settings(); client = BingXClient(settings['bingx_api_key'], settings['secret_key'], settings['mode'] == 'demo'); lev = settings['leverage']
         position_side = pos['direction'].upper(); order_side = "SELL" if pos['direction'] == 'long' else "BUY"
         app.logger.info(f"[MANUAL-CLOSE] Closing {pos['direction']} for {symbol}. Qty: {pos['quantity']:.4f}")
         res = client.place_order(symbol, order_side, position_side, pos['quantity'], lev)
         if res and res.get('code') == 0:
-            with positions_lock, status_lock:
-                if item_id in ACTIVE_POSITIONS: del ACTIVE_POSITIONS[item_id]
-                BOT_STATUS[item_id] = {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}
+            state.close_position(item_id, {"message": "Waiting...", "color": "#fff", "last_close_time": time.time()}, "manual")
             return jsonify({"message": f"Close order for {symbol} placed."})
         return jsonify({"error": f"Failed to close: {res.get('msg') if res else 'Unknown error'}"}), 400
     except Exception as e: app.logger.error(f"Manual close error: {e}", exc_info=True); return jsonify({"error": str(e)}), 500
@@ -562,10 +1842,120 @@ def handle_backtest():
         start_ts = int(datetime.strptime(data['start_date'], '%Y-%m-%d').timestamp() * 1000); end_ts = int(datetime.strptime(data['end_date'], '%Y-%m-%d').timestamp() * 1000)
         results = run_backtest_simulation(data['symbol'], data['interval'], start_ts, end_ts); return jsonify(results)
     except Exception as e: app.logger.error(f"Backtest error: {e}", exc_info=True); return jsonify({"error": str(e)}), 400
+@app.route('/api/backtest/sweep', methods=['POST'])
+def handle_backtest_sweep():
+    data = request.json
+    try:
+        start_ts = int(datetime.strptime(data['start_date'], '%Y-%m-%d').timestamp() * 1000); end_ts = int(datetime.strptime(data['end_date'], '%Y-%m-%d').timestamp() * 1000)
+        results = run_parameter_sweep(data['symbol'], data['interval'], start_ts, end_ts, data.get('grid', {}), data.get('sort_by', 'net_profit'), data.get('max_workers')); return jsonify(results)
+    except Exception as e: app.logger.error(f"Backtest sweep error: {e}", exc_info=True); return jsonify({"error": str(e)}), 400
+@app.route('/api/pattern_library', methods=['GET', 'POST'])
+def handle_pattern_library():
+    if request.method == 'GET': return jsonify(get_pattern_library().stats())
+    data = request.json or {}
+    try:
+        if data.get('symbols'): pairs = [(symbol.upper(), interval) for symbol in data['symbols'] for interval in (data.get('intervals') or ["60"])]
+        else:
+            pairs = sorted({(i['symbol'], i['interval']) for i in state.trade_list()})
+        if any(interval not in ALLOWED_INTERVALS for _, interval in pairs): return jsonify({"error": "Invalid interval"}), 400
+        end_ts = int(time.time() * 1000); start_ts = end_ts - int(data.get('days', PATTERN_LIBRARY_DAYS)) * 86400000
+        return jsonify(update_pattern_library(pairs, start_ts, end_ts))
+    except Exception as e: app.logger.error(f"Pattern library error: {e}", exc_info=True); return jsonify({"error": str(e)}), 400
+@app.route('/api/admin/profile')
+def profile_threads():
+    # Samples all threads for ?seconds= (default PROFILER_DEFAULT_SECONDS) and returns collapsed stacks ("frame;frame weight" per
+    # line), ready for flamegraph.pl, inferno or speedscope. ?mode=cpu (default) or wall, ?hz= sampling rate, ?thread= name filter.
+    # Costs nothing until called; the request blocks for the duration, and a second profile while one runs gets a 409.
+    # Localhost only, since one request holds a server thread for up to PROFILER_MAX_SECONDS; under --serve only the engine process
+    # profiles (on 127.0.0.1:ENGINE_ADMIN_PORT), as an HTTP worker cannot see the engine's threads.
+    if not is_loopback(request.remote_addr): return jsonify({"error": "The profiler is only served to localhost"}), 403
+    if process_role == "http": return jsonify({"error": f"Profile the engine on 127.0.0.1:{ENGINE_ADMIN_PORT}/api/admin/profile"}), 404
+    seconds = max(0.1, min(request.args.get('seconds', PROFILER_DEFAULT_SECONDS, type=float), PROFILER_MAX_SECONDS))
+    hz, mode = max(1, min(request.args.get('hz', PROFILER_DEFAULT_HZ, type=int), PROFILER_MAX_HZ)), request.args.get('mode', 'cpu')
+    if mode not in ("cpu", "wall"): return jsonify({"error": "Invalid mode"}), 400
+    if mode == "cpu" and thread_cpu_seconds(threading.get_native_id()) is None: return jsonify({"error": "Per-thread CPU clocks are not available here; use mode=wall"}), 400
+    if not profiler_lock.acquire(blocking=False): return jsonify({"error": "A profile is already running"}), 409
+    try: stacks = sample_thread_stacks(seconds, hz, mode, request.args.get('thread', ''))
+    finally: profiler_lock.release()
+    body = "".join(f"{stack} {weight}\n" for stack, weight in stacks.most_common())
+    return Response(body, content_type="text/plain; charset=utf-8", headers={"Content-Disposition": f"attachment; filename=profile-{mode}-{int(time.time())}.folded"})
+
+# --- Serving ---
+engine_lock = None
+process_role = "http" # "engine" for --engine and the --serve engine child, "all" for the development server running both
+
+def start_engine():
+    # The trading engine: market data, the candle-close analysis and TP/SL loop, and the PnL updater. Exactly one per state store,
+    # held with a lock file, since a second engine would place every order twice.
+    global engine_lock
+    if fcntl is not None:
+        engine_lock = open(STATE_DB_FILE + ".engine.lock", "w")
+        try: fcntl.flock(engine_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError: engine_lock.close(); engine_lock = None; raise RuntimeError(f"Another trading engine is already running on {STATE_DB_FILE}")
+    positions = state.recover()
+    if positions: app.logger.info(f"Recovered {len(positions)} open position(s), TP/SL checks resume: " + ", ".join(f"{p['symbol']} {p['direction']} @ {p['entry_price']}" for p in positions.values()))
+    state.clear_next_runs() # Left by the previous engine; this one schedules every item afresh
+    market_data.start(state.settings().get("market_data_url"))
+    threading.Thread(target=trade_bot_worker, name="trade_bot_worker", daemon=True).start()
+    threading.Thread(target=pnl_updater_worker, name="pnl_updater_worker", daemon=True).start()
+    threading.Thread(target=state_compactor_worker, name="state_compactor", daemon=True).start()
+
+def state_compactor_worker():
+    # Compacts the store once at engine start (after a crash the WAL may be long), then every STATE_COMPACT_SECONDS
+    while True:
+        try:
+            with stage_timers.timer("state_compaction"): dropped, wal_frames = state.compact(STATE_JOURNAL_RETENTION_DAYS * 86400)
+            if dropped or wal_frames: app.logger.info(f"State store compacted: {dropped} journal entries dropped, {wal_frames} WAL frames left for the next run")
+        except sqlite3.Error as e: app.logger.warning(f"State store compaction failed: {e}")
+        time.sleep(STATE_COMPACT_SECONDS)
+
+def run_engine_process():
+    # The engine, with the app on localhost:ENGINE_ADMIN_PORT for the engine's own /metrics and /api/admin/profile
+    global process_role
+    process_role = "engine"; start_engine(); make_server("127.0.0.1", ENGINE_ADMIN_PORT, app, threaded=True).serve_forever()
+
+def serve_prefork(host, port, workers):
+    # Production serving (POSIX): `workers` forked HTTP processes share one listening socket, so the kernel spreads connections
+    # over them and predictions use every core; each runs Werkzeug's threaded WSGI server. One more child runs the engine. The
+    # processes share state only through the store. The parent just supervises: a child that exits is restarted, and SIGTERM or
+    # SIGINT stops them all. Any WSGI server works the same way, e.g. `gunicorn -w 8 -b 0.0.0.0:5000 main:app` next to `--engine`.
+    # /metrics on the shared port is answered by whichever HTTP process takes the connection, with that process's figures (labelled
+    # role="http" and its pid); the engine's figures, analysis lag and queue depth among them, are only on 127.0.0.1:ENGINE_ADMIN_PORT.
+    state.initialize(); state.close() # Schema and JSON import once, before forking; every child opens its own connections
+    listener, children, stopping = socket.create_server((host, port), backlog=1024), {}, []
+    def spawn(role):
+        pid = os.fork()
+        if pid: children[pid] = role; return
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL); signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the whole group; the parent stops us
+            if role == "engine": listener.close(); run_engine_process()
+            else: make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+        except Exception as e: app.logger.error(f"{role} process {os.getpid()} failed: {e}", exc_info=True)
+        finally: os._exit(1)
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+    signal.signal(signal.SIGTERM, stop); signal.signal(signal.SIGINT, stop)
+    spawn("engine")
+    for _ in range(workers): spawn("http")
+    app.logger.info(f"Serving on {host}:{port} with {workers} HTTP processes and one engine process (admin on 127.0.0.1:{ENGINE_ADMIN_PORT})")
+    while children:
+        try: pid, status = os.wait()
+        except ChildProcessError: break
+        role = children.pop(pid, None)
+        if role is None or stopping: continue
+        app.logger.warning(f"{role} process {pid} exited with status {status}; restarting it")
+        time.sleep(5 if role == "engine" else 1) # An engine that cannot take the lock retries slowly
+        if not stopping: spawn(role)
 
 # --- Main Execution ---
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    threading.Thread(target=trade_bot_worker, daemon=True).start()
-    threading.Thread(target=pnl_updater_worker, daemon=True).start()
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    if sys.argv[1:2] == ["--feed-server"]: LocalFeedServer(port=int(sys.argv[2]) if len(sys.argv) > 2 else FEED_SERVER_PORT).serve_forever()
+    if sys.argv[1:2] == ["--serve"]: # Production: `python main.py --serve [workers]`
+        if not hasattr(os, "fork"): sys.exit("--serve needs fork(); run a WSGI server on main:app next to `python main.py --engine` instead")
+        serve_prefork('0.0.0.0', 5000, int(sys.argv[2]) if len(sys.argv) > 2 else SERVE_WORKERS)
+    elif sys.argv[1:2] == ["--engine"]: run_engine_process() # The HTTP API is served by another process
+    else: process_role = "all"; start_engine(); app.run(host='0.0.0.0', port=5000, debug=False) # Development: engine and dev server in one process
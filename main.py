@@ -8,6 +8,7 @@
 # - Flask: Web server framework.
 # - requests: To fetch data from the Bybit API.
 # - math, statistics: Standard libraries for numerical operations.
+# - mmap, array: Standard libraries backing the on-disk kline store.
 #
 # Prohibited Libraries (as per requirements):
 # - numpy: NOT USED. All numerical/statistical code is pure Python.
@@ -20,6 +21,8 @@
 #
 # 2. Run the Flask development server:
 #    python app.py
+#    or, in production, one HTTP process per core (POSIX):
+#    python app.py --serve [workers]
 #
 # 3. Access the application in your browser:
 #    http://127.0.0.1:5000
@@ -28,18 +31,61 @@
 import time
 import requests
 import math
+import heapq
 import statistics
-from flask import Flask, jsonify, render_template_string, request
+import os
+import json
+import bisect
+import gzip
+import zlib
+import mmap
+import shutil
+import threading
+import functools
+import signal
+import socket
+import sys
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import Flask, Response, jsonify, render_template_string, request
+from werkzeug.serving import make_server
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl  # POSIX only: cross-process writer lock for the kline store
+except ImportError:
+    fcntl = None
 
 # --- Configuration ---
 # MODIFIED: Removed smaller timeframes like 1, 3, 5 minutes. 3H (180) is not supported by the API.
 ALLOWED_INTERVALS = ["15", "30", "60", "120", "240", "360", "720", "D", "W", "M"]
-BYBIT_API_URL = "https://api.bybit.com/v5/market/kline"
-CACHE_TTL_SECONDS = 15
+BYBIT_API_URL = "https://api.bybit.com/v5/market"
+BYBIT_REQUESTS_PER_SECOND = 10  # Client-side cap per Bybit endpoint
+HTTP_POOL_SIZE = 8  # Kept-alive connections: request handlers plus background cache reloads
+HTTP_MAX_RETRIES = 3  # Retries of idempotent (GET) requests on 429/5xx
+HTTP_MAX_BACKOFF_SECONDS = 30  # A longer server-requested wait fails the request instead of holding a thread
+HTTP_LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Upper bounds of the latency histograms
+STAGE_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)  # Upper bounds of the stage timing histograms
+CACHE_TTL_SECONDS = 15  # Refresh period of the forming candle; closed candles never expire
+CACHE_STALE_SECONDS = 45  # How long past its TTL an entry may still be served while it reloads
+CACHE_MAX_ENTRIES = 256  # symbol/interval pairs kept in memory
+CANDLE_LIMIT = 500
+KLINE_STORE_DIR = "kline_store"
+PREDICTION_CACHE_DIR = "prediction_cache"
+PREDICTION_CACHE_MAX_ENTRIES = 1024  # forecasts kept in memory
+PREDICTION_MODEL_VERSION = 1  # Bump when the forecaster changes, so forecasts cached on disk by older code are ignored
+RESPONSE_CACHE_MAX_ENTRIES = 256  # serialized /api/candles bodies kept in memory
+SERVE_WORKERS = max(2, os.cpu_count() or 1)  # HTTP worker processes in --serve mode
+# "M" uses the longest month, so a monthly candle is never stored before it has closed.
+INTERVAL_MS = {"D": 86400000, "W": 604800000, "M": 31 * 86400000}
+# "recursive": one search per predicted candle. "direct": one search for all candles.
+PREDICTION_MODES = ["recursive", "direct"]
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
-cache = {}
 
 
 # --- HTML & JavaScript Template ---
@@ -156,6 +202,11 @@ HTML_TEMPLATE = """
             </select>
             <label for="num_predictions">Predictions:</label>
             <input type="number" id="num_predictions" value="5" min="1" max="20">
+            <label for="mode">Mode:</label>
+            <select id="mode">
+                <option value="recursive">Recursive</option>
+                <option value="direct">Direct</option>
+            </select>
             <button id="fetchButton">Fetch & Predict</button>
             <div id="status"></div>
         </div>
@@ -183,6 +234,7 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
+        const CHART_REFRESH_MS = 5000;
         document.addEventListener('DOMContentLoaded', function () {
             const statusEl = document.getElementById('status');
             const fetchButton = document.getElementById('fetchButton');
@@ -272,11 +324,12 @@ HTML_TEMPLATE = """
                 const symbol = symbolInput.value.toUpperCase().trim();
                 const interval = document.getElementById('interval').value;
                 const numPredictions = document.getElementById('num_predictions').value;
+                const mode = document.getElementById('mode').value;
                 if (!symbol) { statusEl.innerText = 'Error: Symbol cannot be empty.'; return; }
                 statusEl.innerText = 'Fetching data from Bybit...';
                 fetchButton.disabled = true;
                 try {
-                    const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}`);
+                    const response = await fetch(`/api/candles?symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${mode}`);
                     if (!response.ok) throw new Error((await response.json()).error || `HTTP error! status: ${response.status}`);
                     statusEl.innerText = 'Data received. Predicting...';
                     const data = await response.json();
@@ -284,10 +337,12 @@ HTML_TEMPLATE = """
                     xAxis.set("baseInterval", intervalConfig);
                     series.data.setAll(data.candles);
                     predictedSeries.data.setAll(data.predicted);
+                    chartQuery = `symbol=${symbol}&interval=${interval}&predictions=${numPredictions}&mode=${mode}`;
                     statusEl.innerText = 'Prediction complete.';
                 } catch (error) {
                     console.error('Error:', error);
                     statusEl.innerText = `Error: ${error.message}`;
+                    chartQuery = null;
                     if (series) series.data.setAll([]);
                     if (predictedSeries) predictedSeries.data.setAll([]);
                 } finally {
@@ -316,6 +371,28 @@ HTML_TEMPLATE = """
                 positionModal.classList.remove('visible');
             });
             createChart();
+            // Auto-refresh: only the candles from the last one shown onwards are requested; the last one is patched, newer ones appended
+            let chartQuery = null;
+            async function refreshChart() {
+                if (!chartQuery || !series || series.data.length === 0) return;
+                const query = chartQuery;
+                try {
+                    const response = await fetch(`/api/candles?${query}&since=${series.data.getIndex(series.data.length - 1).t}`);
+                    if (!response.ok || query !== chartQuery) return;
+                    const data = await response.json();
+                    if (data.full) series.data.setAll(data.candles);
+                    else data.candles.forEach(candle => {
+                        const last = series.data.length - 1;
+                        if (candle.t === series.data.getIndex(last).t) series.data.setIndex(last, candle);
+                        else if (candle.t > series.data.getIndex(last).t) { series.data.push(candle); series.data.removeIndex(0); }
+                    });
+                    predictedSeries.data.setAll(data.predicted);
+                } catch (error) {
+                    console.error('Chart refresh failed:', error);
+                }
+            }
+            setInterval(refreshChart, CHART_REFRESH_MS);
+
             fetchButton.addEventListener('click', fetchDataAndPredict);
             symbolInput.addEventListener('keydown', (event) => { if (event.key === 'Enter') fetchDataAndPredict(); });
             fetchDataAndPredict();
@@ -325,135 +402,933 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# --- Typed Candle Series ---
+class CandleSeries:
+    """
+    Columnar candles, parsed once when they are fetched: ts as int64, OHLCV as float64.
+    The columns are arrays, or read-only memoryviews when the series is a zero-copy view
+    of the kline store. Slicing returns another CandleSeries; indexing returns a row tuple.
+    """
+    __slots__ = ("ts", "open", "high", "low", "close", "volume")
+    COLUMNS = [("ts", "q"), ("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"), ("volume", "d")]
+
+    def __init__(self, ts=None, open=None, high=None, low=None, close=None, volume=None):
+        for (name, typecode), column in zip(self.COLUMNS, (ts, open, high, low, close, volume)):
+            setattr(self, name, array(typecode) if column is None else column)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Parses exchange rows ([ts, open, high, low, close, volume, ...] as strings)."""
+        rows = rows if isinstance(rows, list) else list(rows)
+        return cls(*(array(typecode, (int(row[k]) if typecode == "q" else float(row[k]) for row in rows))
+                     for k, (_, typecode) in enumerate(cls.COLUMNS)))
+
+    @classmethod
+    def concat(cls, *parts):
+        """Copies the given series, in order, into one array-backed series."""
+        columns = [array(typecode) for _, typecode in cls.COLUMNS]
+        for part in parts:
+            for column, source in zip(columns, part.columns()):
+                column.extend(source)
+        return cls(*columns)
+
+    def columns(self):
+        return [getattr(self, name) for name, _ in self.COLUMNS]
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CandleSeries(*(column[index] for column in self.columns()))
+        return tuple(column[index] for column in self.columns())
+
+    def rows(self):
+        """Returns (ts, o, h, l, c, v) tuples, in the same column order as the exchange rows."""
+        return list(zip(*self.columns()))
+
+    def to_dicts(self):
+        """Returns the candles in the JSON shape used by /api/candles."""
+        return [{"t": t, "o": o, "h": h, "l": l, "c": c, "v": v} for t, o, h, l, c, v in zip(*self.columns())]
+
+# --- Persistent Kline Store ---
+def interval_to_ms(interval):
+    return INTERVAL_MS.get(interval) or int(interval) * 60000
+
+def candle_close_ms(interval, ts):
+    """
+    Returns the close time (the next candle's start) of the candle forming at `ts` on
+    Bybit's UTC grid: weeks start on Monday and months on the 1st, so a monthly candle
+    closes at the end of its own month rather than after INTERVAL_MS["M"].
+    """
+    if interval == "M":
+        day = datetime.fromtimestamp(ts / 1000, timezone.utc)
+        return int(datetime(day.year + day.month // 12, day.month % 12 + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    offset = 4 * 86400000 if interval == "W" else 0  # 1970-01-01 was a Thursday
+    return ((ts - offset) // interval_to_ms(interval) + 1) * interval_to_ms(interval) + offset
+
+class KlineStore:
+    """
+    On-disk columnar kline history keyed by (category, symbol, interval).
+    Each key directory holds fixed-width column files (ts as int64, OHLCV as float64) in numbered
+    generations, plus a meta.json naming the current generation, its row count and the time
+    ranges it covers. Candles newer than every stored one (each newly closed candle) are appended
+    to the current generation's files before meta.json raises the count; readers only look at
+    the first `count` rows, so they never see a partial append. Overlaps and backfills build a
+    new generation and atomically replace meta.json. Readers in any process always mmap a
+    consistent snapshot.
+    """
+    COLUMNS = CandleSeries.COLUMNS
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _dir(self, symbol, interval, category):
+        return os.path.join(self.root, category, symbol, str(interval))
+
+    def _meta(self, path):
+        try:
+            with open(os.path.join(path, "meta.json")) as f: return json.load(f)
+        except (OSError, ValueError):
+            return {"generation": 0, "count": 0, "coverage": []}
+
+    def read(self, symbol, interval, category, start_ts=None, end_ts=None):
+        """Returns the stored candles with start_ts <= ts <= end_ts as a zero-copy CandleSeries over the mmaps."""
+        path = self._dir(symbol, interval, category)
+        meta = self._meta(path)
+        columns = {}
+        for name, typecode in self.COLUMNS:
+            if meta["count"] == 0:
+                columns[name] = memoryview(array(typecode))
+                continue
+            with open(os.path.join(path, f"gen-{meta['generation']}", name), "rb") as f:
+                columns[name] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)[:meta["count"]]
+        lo = 0 if start_ts is None else bisect.bisect_left(columns["ts"], start_ts)
+        hi = len(columns["ts"]) if end_ts is None else bisect.bisect_right(columns["ts"], end_ts)
+        return CandleSeries(*(columns[name][lo:hi] for name, _ in self.COLUMNS))
+
+    def merge(self, symbol, interval, category, candles, covered_start, covered_end):
+        """Merges closed candles into the store (new rows win on equal ts) and records the covered range."""
+        path = self._dir(symbol, interval, category)
+        os.makedirs(path, exist_ok=True)
+        with self.lock, open(os.path.join(path, ".lock"), "a") as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            meta = self._meta(path)
+            coverage = sorted(meta["coverage"] + [[covered_start, covered_end]])
+            merged_coverage = [coverage[0]]
+            for start, end in coverage[1:]:
+                if start <= merged_coverage[-1][1] + 1: merged_coverage[-1][1] = max(merged_coverage[-1][1], end)
+                else: merged_coverage.append([start, end])
+
+            tail = self._new_tail(symbol, interval, category, meta, candles)
+            if tail is not None:
+                if len(tail): self._append(path, meta, tail)
+                if len(tail) or merged_coverage != meta["coverage"]:
+                    self._write_meta(path, {"generation": meta["generation"], "count": meta["count"] + len(tail), "coverage": merged_coverage})
+                return
+
+            merged = {row[0]: row for row in self.read(symbol, interval, category).rows()} if meta["count"] else {}
+            for row in candles.rows():
+                merged[row[0]] = row
+            ordered = [merged[ts] for ts in sorted(merged)]
+
+            generation = meta["generation"] + 1
+            gen_path = os.path.join(path, f"gen-{generation}")
+            os.makedirs(gen_path, exist_ok=True)
+            for k, (name, typecode) in enumerate(self.COLUMNS):
+                with open(os.path.join(gen_path, name), "wb") as f:
+                    array(typecode, (row[k] for row in ordered)).tofile(f)
+            self._write_meta(path, {"generation": generation, "count": len(ordered), "coverage": merged_coverage})
+            # The previous generation is kept for readers that are mid-swap.
+            shutil.rmtree(os.path.join(path, f"gen-{meta['generation'] - 1}"), ignore_errors=True)
+
+    def _new_tail(self, symbol, interval, category, meta, candles):
+        """
+        Returns the candles newer than every stored one when the older ones are already stored
+        unchanged (the steady state: a refresh adds the newly closed candles after the last
+        stored one), or None when the merge overlaps or backfills the history and needs a new
+        generation.
+        """
+        if meta["count"] == 0: return None
+        if not len(candles): return candles
+        stored = self.read(symbol, interval, category, start_ts=candles.ts[0])
+        if len(stored) > len(candles) or stored.rows() != candles[:len(stored)].rows(): return None
+        return candles[len(stored):]
+
+    def _append(self, path, meta, candles):
+        """Appends candles to the current generation's column files, past its first meta["count"] rows."""
+        gen_path = os.path.join(path, f"gen-{meta['generation']}")
+        for (name, typecode), column in zip(self.COLUMNS, candles.columns()):
+            with open(os.path.join(gen_path, name), "r+b") as f:
+                f.truncate(meta["count"] * array(typecode).itemsize)  # Drops rows of an append interrupted by a crash
+                f.seek(0, os.SEEK_END)
+                array(typecode, column).tofile(f)
+
+    def _write_meta(self, path, meta):
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+kline_store = KlineStore(KLINE_STORE_DIR)
+
+# --- Hot-path Instrumentation ---
+class StageTimers:
+    """
+    A latency histogram per hot-path stage (kline fetches, predictions, requests), so slow
+    responses show where their time goes. Stages are timed with the timer() context manager
+    or the timed() decorator; /metrics serves them in Prometheus' text format.
+    """
+    def __init__(self, buckets_ms=STAGE_LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        milliseconds = seconds * 1000
+        with self.lock:
+            stats = self.stages.setdefault(stage, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(self.buckets_ms) + 1)})
+            stats["count"] += 1
+            stats["sum_ms"] += milliseconds
+            stats["buckets"][bisect.bisect_left(self.buckets_ms, milliseconds)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def timed(self, stage):
+        """Decorator: every call of the function is timed as `stage`, whether it returns or raises."""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def stats(self):
+        """Per stage, in the same layout as ExchangeClient.stats() (without outcomes)."""
+        bounds = [str(bound) for bound in self.buckets_ms] + ["+Inf"]
+        with self.lock:
+            return {stage: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3), "buckets": dict(zip(bounds, stats["buckets"]))}
+                    for stage, stats in self.stages.items()}
+
+stage_timers = StageTimers()
+
+# --- Exchange HTTP Client ---
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available, refilling at
+    `rate` tokens per second. pause() holds every caller back for a server-requested time.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens, self.updated = 0.0, self.paused_until
+
+class ExchangeClient:
+    """
+    Pooled HTTP client for one exchange.
+    - One keep-alive Session; its blocking connection pool holds `pool_size` connections,
+      so extra threads wait for a warm connection instead of opening throwaway ones.
+    - A token bucket per endpoint, since exchange limits are per endpoint.
+    - Backoff driven by the rate limit headers (Retry-After, Bybit's reset timestamp): a
+      429 pauses the endpoint for every thread. Only idempotent GETs are retried.
+    - A latency histogram per endpoint (see stats()).
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, pool_size, rate_limits, default_rate):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # urllib3 only retries connection failures; statuses are handled in request()
+        retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.buckets = {path: TokenBucket(rate) for path, rate in rate_limits.items()}
+        self.default_rate = default_rate
+        self.latency = {}  # path -> count, sum_ms, per-bucket counts and per-outcome counts
+        self.lock = threading.Lock()
+
+    def bucket(self, path):
+        with self.lock:
+            return self.buckets.setdefault(path, TokenBucket(self.default_rate))
+
+    def request(self, method, path, params=None, headers=None, timeout=(5, 10)):
+        """
+        Sends one request (5s connect, 10s read timeout) and returns the final response;
+        callers raise_for_status() as with requests. Connection failures raise.
+        """
+        bucket = self.bucket(path)
+        retries = HTTP_MAX_RETRIES if method.upper() == "GET" else 0
+        attempt = 0
+        while True:
+            bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, self.base_url + path, params=params, headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException:
+                self._observe(path, time.monotonic() - started, "error")
+                raise
+            self._observe(path, time.monotonic() - started, str(response.status_code))
+            wait = self._limit_wait(response)
+            if wait is not None:
+                bucket.pause(min(wait, HTTP_MAX_BACKOFF_SECONDS))
+            if response.status_code not in self.RETRY_STATUSES or attempt >= retries:
+                return response
+            wait = 2 ** attempt if wait is None else wait
+            if wait > HTTP_MAX_BACKOFF_SECONDS:
+                return response
+            if response.status_code != 429:  # A 429 already waits in bucket.acquire()
+                time.sleep(wait)
+            attempt += 1
+
+    def _limit_wait(self, response):
+        """Seconds until the exchange accepts requests again, or None if it set no limit."""
+        headers = response.headers
+        try:
+            if headers.get("Retry-After"):
+                return max(0.0, float(headers["Retry-After"]))
+            if headers.get("X-Bapi-Limit-Reset-Timestamp") and (response.status_code == 429 or headers.get("X-Bapi-Limit-Status") == "0"):
+                return max(0.0, int(headers["X-Bapi-Limit-Reset-Timestamp"]) / 1000 - time.time())
+        except ValueError:
+            pass
+        return 1.0 if response.status_code == 429 else None
+
+    def _observe(self, path, seconds, outcome):
+        milliseconds = seconds * 1000
+        with self.lock:
+            stats = self.latency.setdefault(path, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1), "outcomes": {}})
+            stats["count"] += 1
+            stats["sum_ms"] += milliseconds
+            stats["buckets"][bisect.bisect_left(HTTP_LATENCY_BUCKETS_MS, milliseconds)] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+
+    def stats(self):
+        """
+        Per endpoint: request count, total latency, the number of requests per latency
+        bucket (keyed by its upper bound in ms) and per outcome (HTTP status or "error").
+        """
+        bounds = [str(bound) for bound in HTTP_LATENCY_BUCKETS_MS] + ["+Inf"]
+        with self.lock:
+            return {path: {"count": stats["count"], "sum_ms": round(stats["sum_ms"], 3),
+                           "buckets": dict(zip(bounds, stats["buckets"])), "outcomes": dict(stats["outcomes"])}
+                    for path, stats in self.latency.items()}
+
+bybit_http = ExchangeClient(BYBIT_API_URL, HTTP_POOL_SIZE, {}, BYBIT_REQUESTS_PER_SECOND)
+
 # --- Data Fetching & Caching ---
+class KlineCache:
+    """
+    Bounded in-memory cache for kline responses: LRU eviction above `max_entries`,
+    a TTL for freshness, and single-flight loading.
+    - Fresh (within its TTL): returned directly.
+    - Stale (less than stale_ttl past its TTL): returned directly while one background
+      thread reloads it (stale-while-revalidate), so expiry never blocks a request.
+    - Missing or expired: the first caller loads it; concurrent callers for the same
+      key wait for that load instead of fetching the same klines again.
+    `loader(previous)` receives the value currently held for the key (expired or not,
+    None if there is none), so it can refresh incrementally. `ttl(value)` may set the
+    TTL per value; it defaults to the cache's ttl. Empty results are not stored. Load
+    errors are raised to the loading caller and to every caller waiting on it.
+    """
+    class _Flight:
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self, max_entries, ttl, stale_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (fresh_until, value), least recently used first
+        self.inflight = {}  # key -> _Flight
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "waits": 0, "evictions": 0, "loads": 0, "load_errors": 0}
+
+    def get(self, key, loader, ttl=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.monotonic()
+            if entry and now < entry[0] + self.stale_ttl:
+                self.entries.move_to_end(key)
+                if now < entry[0]:
+                    self.counters["hits"] += 1
+                else:
+                    self.counters["stale_hits"] += 1
+                    if key not in self.inflight:
+                        flight = self.inflight[key] = self._Flight()
+                        threading.Thread(target=self._load, args=(key, loader, ttl, flight, entry[1]), daemon=True).start()
+                return entry[1]
+            self.counters["misses"] += 1
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = self._Flight()
+            else:
+                self.counters["waits"] += 1
+        if leader:
+            self._load(key, loader, ttl, flight, entry[1] if entry else None)
+        else:
+            flight.done.wait()
+        if flight.error is not None: raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, ttl, flight, previous):
+        try:
+            flight.value = loader(previous)
+        except Exception as e:
+            flight.error = e
+        with self.lock:
+            self.counters["loads"] += 1
+            if flight.error is not None:
+                self.counters["load_errors"] += 1
+            elif flight.value:
+                lifetime = self.ttl if ttl is None else ttl(flight.value)
+                self.entries[key] = (time.monotonic() + lifetime, flight.value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+            del self.inflight[key]
+        flight.done.set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "size": len(self.entries), "max_entries": self.max_entries, "inflight": len(self.inflight)}
+
+cache = KlineCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_STALE_SECONDS)
+
+@stage_timers.timed("get_bybit_data")
 def get_bybit_data(symbol, interval):
-    """Fetches candlestick data from the Bybit v5 API with in-memory caching."""
-    cache_key = f"{symbol}-{interval}"
-    current_time = time.time()
-    if cache_key in cache:
-        last_fetch_time, cached_data = cache[cache_key]
-        if current_time - last_fetch_time < CACHE_TTL_SECONDS:
-            return cached_data
-    params = {"category": "spot", "symbol": symbol, "interval": interval, "limit": 500}
+    """Returns the candles for symbol/interval through the shared KlineCache."""
+    return cache.get(f"{symbol}-{interval}", lambda previous: fetch_bybit_data(symbol, interval, previous),
+                     ttl=lambda candles: forming_candle_ttl(interval, candles))
+
+def forming_candle_ttl(interval, candles):
+    """
+    Seconds until cached candles must be refreshed: CACHE_TTL_SECONDS for the forming
+    candle, but never past its close, so a newly closed candle is picked up at once.
+    """
+    seconds_to_close = candle_close_ms(interval, candles.ts[-1]) / 1000 - time.time()
+    return max(0.0, min(CACHE_TTL_SECONDS, seconds_to_close))
+
+@stage_timers.timed("fetch_bybit_data")
+def fetch_bybit_data(symbol, interval, previous=None):
+    """
+    Fetches candlestick data from the Bybit v5 API.
+    Only candles from the last known one onwards are requested: the last candle of
+    `previous` (the cached series, whose closed candles never change) or, after a
+    restart, the last one in the kline store. The fresh candles replace that tail.
+    """
+    params = {"category": "spot", "symbol": symbol, "interval": interval, "limit": CANDLE_LIMIT}
+    interval_ms = interval_to_ms(interval)
+    now_ms = int(time.time() * 1000)
+    known = previous if previous else kline_store.read(symbol, interval, "spot", start_ts=now_ms - CANDLE_LIMIT * interval_ms)
+    if len(known):
+        params["start"] = known.ts[-1]
     try:
-        response = requests.get(BYBIT_API_URL, params=params)
+        response = bybit_http.request("GET", "/kline", params=params)
         response.raise_for_status()
         data = response.json()
         if data.get("retCode") != 0: raise ValueError(data.get("retMsg", "Unknown Bybit API error"))
-        candles = list(reversed(data["result"]["list"]))
-        if not candles: return []
-        cache[cache_key] = (current_time, candles)
-        return candles
+        fresh = CandleSeries.from_rows(reversed(data["result"]["list"]))
+        if not fresh: return fresh
+        closed = fresh[:bisect.bisect_right(fresh.ts, now_ms - interval_ms)]
+        if closed: kline_store.merge(symbol, interval, "spot", closed, closed.ts[0], closed.ts[-1])
+        if len(known) and fresh.ts[0] > known.ts[-1]: known = known[:0]  # More than a page behind: the fresh page is the whole window
+        # concat builds a new series: the cached one may still be read by other requests, and
+        # copying out of the store's mmaps keeps the cache from pinning an old generation
+        return CandleSeries.concat(known[:bisect.bisect_left(known.ts, fresh.ts[0])], fresh)[-CANDLE_LIMIT:]
     except requests.exceptions.RequestException as e: raise ConnectionError(f"Failed to connect to Bybit API: {e}")
     except (ValueError, KeyError) as e: raise ValueError(f"Error processing Bybit response: {e}")
 
 # --- Prediction Model (Pure Python) ---
-def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5):
+def rolling_window_norms(data_series, window_size):
+    """
+    Returns the Euclidean norm of every window of `window_size` values, in order.
+    A rolling sum of squares is kept so each window costs O(1) instead of O(window_size).
+    """
+    num_windows = len(data_series) - window_size + 1
+    if window_size <= 0 or num_windows <= 0: return []
+
+    squares = [x * x for x in data_series]
+    sum_sq = sum(squares[:window_size])
+    # Tracks how many non-zero squares are inside the window, so an all-zero window
+    # is reported as exactly 0.0 instead of a tiny rounding residue.
+    nonzero = sum(1 for sq in squares[:window_size] if sq)
+    norms = [math.sqrt(sum_sq) if nonzero else 0.0]
+    for i in range(window_size, len(squares)):
+        entering, leaving = squares[i], squares[i - window_size]
+        sum_sq += entering - leaving
+        nonzero += (entering != 0) - (leaving != 0)
+        norms.append(math.sqrt(max(sum_sq, 0.0)) if nonzero else 0.0)
+    return norms
+
+def sliding_dot_profile(data_series, query, num_windows):
+    """
+    Returns the dot product of `query` with each of the first `num_windows` windows of
+    `data_series`. Instead of slicing every window, the profile is built column by column,
+    one pass over the series per query element. This file stays numpy-free, so there is no
+    FFT path here; multi-step forecasts build the profile once and update it instead (see
+    PatternForecaster).
+    """
+    profile = [0.0] * num_windows
+    for k, q in enumerate(query):
+        if q: profile = [acc + q * x for acc, x in zip(profile, data_series[k : k + num_windows])]
+    return profile
+
+def select_top_k(scores, k, indices=None):
+    """
+    Returns the indices of the `k` highest `scores`, best first, using a bounded heap
+    instead of sorting every candidate. Ties keep the lower index first, like a stable
+    descending sort. `indices` may be any iterable of candidate positions in `scores`.
+    """
+    if k <= 0: return []
+    if indices is None: indices = range(len(scores))
+    return heapq.nlargest(k, indices, key=scores.__getitem__)
+
+def top_similar_windows(data_series, window_size, top_n, num_windows, norms, dots=None):
+    """
+    Ranks the first `num_windows` windows by cosine similarity to the most recent window
+    and returns the start indices of the `top_n` best matches, or None if there are none.
+    `norms` must hold the norm of every window, the most recent one last. `dots` may carry
+    the dot profile against the most recent window when the caller maintains it.
+    """
+    current_norm = norms[-1]
+    if current_norm == 0 or num_windows <= 0: return None
+
+    if dots is None: dots = sliding_dot_profile(data_series, data_series[-window_size:], num_windows)
+    similarities = [dot / (h_norm * current_norm) if h_norm > 0 else 0.0 for dot, h_norm in zip(dots, norms)]
+
+    # Zero-norm windows have no direction and are never candidates.
+    top_patterns = select_top_k(similarities, top_n, (i for i in range(num_windows) if norms[i] > 0))
+    return top_patterns or None
+
+def find_similar_patterns_pure_python(data_series, window_size=20, top_n=5, norms=None, dots=None):
     """
     Finds historical patterns similar to the most recent one using cosine similarity.
     This is a pure Python implementation without numpy.
+    `norms` and `dots` may be passed in when the caller already maintains the window norms
+    and the dot profile (see PatternForecaster).
     """
     if len(data_series) < 2 * window_size: return None
 
-    def dot_product(v1, v2):
-        return sum(x * y for x, y in zip(v1, v2))
+    if norms is None: norms = rolling_window_norms(data_series, window_size)
+    top_patterns = top_similar_windows(data_series, window_size, top_n, len(data_series) - window_size, norms, dots)
+    if not top_patterns: return None
 
-    def norm(v):
-        return math.sqrt(sum(x * x for x in v))
+    avg_outcome = statistics.mean(data_series[i + window_size] for i in top_patterns)
+    return avg_outcome
 
-    current_pattern = data_series[-window_size:]
-    current_norm = norm(current_pattern)
-    if current_norm == 0: return None
+def find_similar_pattern_paths(data_series, window_size=20, top_n=5, horizon=1, norms=None):
+    """
+    Direct multi-horizon variant of find_similar_patterns_pure_python.
+    A single scan ranks the windows that are followed by at least `horizon` known values,
+    and the next `horizon` outcomes of the top matches are averaged step by step.
+    Returns a list of `horizon` averaged outcomes, or None.
+    """
+    if horizon < 1 or len(data_series) < 2 * window_size: return None
 
-    similarities = []
-    for i in range(len(data_series) - window_size):
-        historical_pattern = data_series[i : i + window_size]
-        historical_norm = norm(historical_pattern)
-        if historical_norm > 0:
-            similarity = dot_product(historical_pattern, current_pattern) / (historical_norm * current_norm)
-            similarities.append({"sim": similarity, "outcome_index": i + window_size})
+    if norms is None: norms = rolling_window_norms(data_series, window_size)
+    num_windows = len(data_series) - window_size - horizon + 1
+    top_patterns = top_similar_windows(data_series, window_size, top_n, num_windows, norms)
+    if not top_patterns: return None
 
-    if not similarities: return None
-    
-    similarities.sort(key=lambda x: x["sim"], reverse=True)
-    top_patterns = similarities[:top_n]
+    return [statistics.mean(data_series[i + window_size + h] for i in top_patterns) for h in range(horizon)]
 
-    if not top_patterns: return None
+class PatternForecaster:
+    """
+    Stateful multi-step forecaster over a series of closes.
+    It keeps the log-return series, the per-window norms and the dot profile of the newest
+    window against every earlier one between steps. Appending a predicted close adds one
+    log return and one window norm, and shifts the profile to the new query along its
+    diagonals in O(n), so only the first window's dot product is computed in full. A
+    multi-step recursive forecast thus costs one O(n * window_size) scan plus O(n) per step.
+    """
+    def __init__(self, closes, window_size=20, top_n=5):
+        self.window_size = window_size
+        self.top_n = top_n
+        self.log_returns = []
+        for j in range(1, len(closes)):
+            if closes[j-1] > 0:
+                self.log_returns.append(math.log(closes[j] / closes[j-1]))
+        self.last_close = closes[-1] if closes else 0.0
+        self.norms = rolling_window_norms(self.log_returns, window_size)
 
-    avg_outcome = statistics.mean(data_series[p["outcome_index"]] for p in top_patterns)
-    return avg_outcome
+        # Rolling state of the newest window, continued on every append.
+        newest = self.log_returns[-window_size:] if len(self.log_returns) >= window_size else []
+        self._sum_sq = sum(x * x for x in newest)
+        self._nonzero = sum(1 for x in newest if x * x)
+        self._dots = None  # Built by the first recursive search, then updated on every append
+
+    def dot_profile(self):
+        """
+        Returns the dot products of the newest window with every earlier window that is
+        followed by a known value, or None while the series is too short to search.
+        """
+        num_windows = len(self.log_returns) - self.window_size
+        if num_windows < self.window_size: return None
+        if self._dots is None:
+            self._dots = sliding_dot_profile(self.log_returns, self.log_returns[-self.window_size:], num_windows)
+        return self._dots
+
+    def append_close(self, close):
+        """Appends a (predicted) close and updates only the state of the new window."""
+        if self.last_close > 0:
+            log_return = math.log(close / self.last_close)
+            self.log_returns.append(log_return)
+            size = self.window_size
+            if self._dots is not None:
+                # Window j against the new query equals window j - 1 against the old one, minus
+                # the old query's first term and plus the new value, so the profile shifts by one
+                # along its diagonals. Window 0 has no predecessor and is computed in full.
+                series, dropped = self.log_returns, self.log_returns[-size - 1]
+                first = sum(q * x for q, x in zip(series[-size:], series))
+                self._dots = [first] + [dot - dropped * series[j] + log_return * series[j + size] for j, dot in enumerate(self._dots)]
+            if len(self.log_returns) == size:
+                self._sum_sq = sum(x * x for x in self.log_returns)
+                self._nonzero = sum(1 for x in self.log_returns if x * x)
+            elif len(self.log_returns) > size:
+                leaving_value = self.log_returns[-size - 1]
+                entering, leaving = log_return * log_return, leaving_value * leaving_value
+                self._sum_sq += entering - leaving
+                self._nonzero += (entering != 0) - (leaving != 0)
+            if len(self.log_returns) >= size:
+                self.norms.append(math.sqrt(max(self._sum_sq, 0.0)) if self._nonzero else 0.0)
+        self.last_close = close
+
+    def predict_next_close(self):
+        """Predicts the next close from the current series, or returns None if it cannot."""
+        if not self.log_returns: return None
+        predicted_log_return = find_similar_patterns_pure_python(self.log_returns, self.window_size, self.top_n, norms=self.norms, dots=self.dot_profile())
+        if predicted_log_return is None: return None
+        return self.last_close * math.exp(predicted_log_return)
 
-def predict_next_candles(candles_data, num_predictions=5):
+    def predict_close_path(self, horizon):
+        """Predicts the next `horizon` closes from a single neighbour search (direct mode)."""
+        path = find_similar_pattern_paths(self.log_returns, self.window_size, self.top_n, horizon, norms=self.norms)
+        if path is None: return None
+        closes, close = [], self.last_close
+        for log_return in path:
+            close *= math.exp(log_return)
+            closes.append(close)
+        return closes
+
+@stage_timers.timed("predict_next_candles")
+def predict_next_candles(candles, num_predictions=5, mode="recursive"):
     """
     Trains a simplified model and predicts the next N candles using pure Python.
+    mode="recursive" searches again after every predicted candle; mode="direct" predicts
+    the whole path from one search over the next N outcomes of the best matches.
+    `candles` is a CandleSeries; raw exchange rows are parsed into one first.
     """
-    if len(candles_data) < 50: return []
-
-    data = [[float(c[i]) for i in range(6)] for c in candles_data]
+    if mode not in PREDICTION_MODES: raise ValueError(f"Unknown prediction mode: {mode}")
+    if not isinstance(candles, CandleSeries): candles = CandleSeries.from_rows(candles)
+    if len(candles) < 50: return []
     
-    upper_wicks = [d[2] - max(d[1], d[4]) for d in data]
-    lower_wicks = [min(d[1], d[4]) - d[3] for d in data]
+    upper_wicks = [h - max(o, c) for o, h, c in zip(candles.open, candles.high, candles.close)]
+    lower_wicks = [min(o, c) - l for o, l, c in zip(candles.open, candles.low, candles.close)]
     avg_upper_wick = statistics.mean(upper_wicks) if upper_wicks else 0
     avg_lower_wick = statistics.mean(lower_wicks) if lower_wicks else 0
 
     predictions = []
-    current_candles = data[:]
+    forecaster = PatternForecaster(candles.close.tolist())
+    last_ts = candles.ts[-1]
+    interval_ms = candles.ts[-1] - candles.ts[-2]
+    direct_path = forecaster.predict_close_path(num_predictions) if mode == "direct" else None
     
     for i in range(num_predictions):
-        closes = [c[4] for c in current_candles]
-        
-        log_returns_close = []
-        for j in range(1, len(closes)):
-            if closes[j-1] > 0:
-                log_returns_close.append(math.log(closes[j] / closes[j-1]))
-        
-        if not log_returns_close: break
-
-        predicted_log_return = find_similar_patterns_pure_python(log_returns_close)
+        if mode == "direct":
+            predicted_close = direct_path[i] if direct_path else None
+        else:
+            predicted_close = forecaster.predict_next_close()
         
-        if predicted_log_return is None: break
+        if predicted_close is None: break
 
-        last_close = current_candles[-1][4]
-        predicted_close = last_close * math.exp(predicted_log_return)
+        last_close = forecaster.last_close
         
         pred_open = last_close
         pred_high = max(pred_open, predicted_close) + avg_upper_wick
         pred_low = min(pred_open, predicted_close) - avg_lower_wick
         
-        last_ts = int(current_candles[-1][0])
-        interval_ms = int(current_candles[-1][0]) - int(current_candles[-2][0])
         new_ts = last_ts + interval_ms
+        last_ts = new_ts
         
-        new_candle = [new_ts, pred_open, pred_high, pred_low, predicted_close, 0]
-        current_candles.append(new_candle)
+        forecaster.append_close(predicted_close)
 
         predictions.append({"t": new_ts, "o": pred_open, "h": pred_high, "l": pred_low, "c": predicted_close})
 
     return predictions
 
+# --- Prediction Cache ---
+prediction_cache = KlineCache(PREDICTION_CACHE_MAX_ENTRIES, float("inf"), 0)
+
+def get_prediction(symbol, interval, candles, num_predictions=5, mode="recursive"):
+    """
+    Returns predict_next_candles() for the closed candles of `candles` through the shared
+    prediction cache. The forming candle is left out, so a forecast only changes when a
+    candle closes: it is keyed by (symbol, interval, last closed candle ts, model version,
+    input length, mode, horizon), computed once per candle close and then served from
+    memory, or from PREDICTION_CACHE_DIR after a restart.
+    When the forming candle was left out, one extra step is forecast and its first candle,
+    the one standing in for the forming candle, is dropped: the forecast still starts one
+    interval after the forming candle, with `num_predictions` future candles.
+    """
+    closed = candles
+    if closed and candle_close_ms(interval, closed.ts[-1]) > time.time() * 1000:
+        closed = closed[:-1]
+    if len(closed) < 50: return []
+    skipped = len(candles) - len(closed)
+    horizon = num_predictions + skipped
+    name = f"v{PREDICTION_MODEL_VERSION}-{closed.ts[-1]}-{len(closed)}-{mode}-{horizon}.json"
+    predicted = prediction_cache.get(f"{symbol}-{interval}/{name}",
+                                     lambda previous: load_or_predict(symbol, interval, name, closed, horizon, mode))
+    return predicted[skipped:]
+
+def load_or_predict(symbol, interval, name, closed, num_predictions, mode):
+    """
+    Reads a forecast from the disk cache, or computes and stores it. Storing a forecast
+    removes the ones computed for older candles of the same symbol/interval.
+    """
+    if not symbol.isalnum(): return predict_next_candles(closed, num_predictions, mode)  # The symbol names a directory
+    path = os.path.join(PREDICTION_CACHE_DIR, symbol, interval)
+    try:
+        with open(os.path.join(path, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    predicted = predict_next_candles(closed, num_predictions, mode)
+    if predicted:
+        try:
+            os.makedirs(path, exist_ok=True)
+            current = f"v{PREDICTION_MODEL_VERSION}-{closed.ts[-1]}-"
+            for old in os.listdir(path):
+                if not old.startswith(current):
+                    os.remove(os.path.join(path, old))
+            tmp = os.path.join(path, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(predicted, f)
+            os.replace(tmp, os.path.join(path, name))
+        except OSError as e:  # e.g. a concurrent writer pruned the same files; the forecast is still served from memory
+            app.logger.warning(f"Could not store forecast {name} for {symbol}/{interval}: {e}")
+    return predicted
+
+# --- Response Cache ---
+response_cache = KlineCache(RESPONSE_CACHE_MAX_ENTRIES, float("inf"), 0)
+
+def candles_etag(candles, *params):
+    """
+    Strong ETag for a response built from `candles`: the parameters, the model version, the
+    last candle ts and a checksum of the forming candle, the only one that changes between closes.
+    """
+    return "-".join(map(str, params + (PREDICTION_MODEL_VERSION, len(candles), candles.ts[-1], f"{zlib.crc32(repr(candles[-1]).encode()):08x}")))
+
+def cached_json_response(etag, render):
+    """
+    Answers If-None-Match with a 304 before anything is computed. Otherwise the body from
+    render() is serialized once per ETag and kept, as JSON and gzip-compressed, in response_cache.
+    """
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    body, compressed = response_cache.get(etag, lambda previous: encode_json_body(render()))
+    if request.accept_encodings.quality("gzip") > 0:
+        return Response(compressed, mimetype="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(body, mimetype="application/json", headers=headers)
+
+def encode_json_body(data):
+    """Compact JSON bytes and their gzip encoding."""
+    body = json.dumps(data, separators=(",", ":")).encode()
+    return body, gzip.compress(body, 6)
+
+# --- Prometheus Metrics ---
+def prometheus_labels(**labels):
+    """{name="value",...}; json.dumps escapes backslashes, quotes and newlines as the text format expects."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{name}={json.dumps(str(value))}" for name, value in labels.items()) + "}"
+
+def prometheus_family(name, kind, help_text, samples):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+
+def prometheus_histogram(name, stats, **labels):
+    """
+    Sample lines of one stats() histogram (count, sum_ms and the count per bucket, keyed by
+    its upper bound in ms) with Prometheus' cumulative buckets, in seconds.
+    """
+    lines, total = [], 0
+    for bound, count in stats["buckets"].items():
+        total += count
+        le = bound if bound == "+Inf" else f"{int(bound) / 1000:g}"
+        lines.append(f"{name}_bucket{prometheus_labels(**labels, le=le)} {total}")
+    lines.append(f"{name}_sum{prometheus_labels(**labels)} {stats['sum_ms'] / 1000:g}")
+    lines.append(f"{name}_count{prometheus_labels(**labels)} {stats['count']}")
+    return lines
+
+def prometheus_metrics():
+    """
+    Body of /metrics in the Prometheus text exposition format (0.0.4): stage timers, Bybit
+    request latencies and cache effectiveness, read from the in-process counters.
+    """
+    stages, endpoints = stage_timers.stats(), bybit_http.stats()
+    caches = {"klines": cache.stats(), "predictions": prediction_cache.stats(), "responses": response_cache.stats()}
+    lines = prometheus_family("stage_duration_seconds", "histogram", "Time spent per hot-path stage.", [
+        line for stage, stats in sorted(stages.items()) for line in prometheus_histogram("stage_duration_seconds", stats, stage=stage)])
+    lines += prometheus_family("exchange_request_duration_seconds", "histogram", "Exchange HTTP request latency per endpoint.", [
+        line for path, stats in sorted(endpoints.items()) for line in prometheus_histogram("exchange_request_duration_seconds", stats, exchange="bybit", endpoint=path)])
+    lines += prometheus_family("exchange_requests_total", "counter", "Exchange HTTP requests per endpoint and outcome (status code or error).", [
+        f"exchange_requests_total{prometheus_labels(exchange='bybit', endpoint=path, outcome=outcome)} {count}"
+        for path, stats in sorted(endpoints.items()) for outcome, count in sorted(stats["outcomes"].items())])
+    lines += prometheus_family("cache_events_total", "counter", "Cache lookups and loads per outcome.", [
+        f"cache_events_total{prometheus_labels(cache=name, event=event)} {stats[event]}"
+        for name, stats in caches.items() for event in ("hits", "stale_hits", "misses", "waits", "evictions", "loads", "load_errors")])
+    lines += prometheus_family("cache_hit_ratio", "gauge", "Share of cache lookups served without a load, since start.", [
+        f"cache_hit_ratio{prometheus_labels(cache=name)} {(stats['hits'] + stats['stale_hits']) / max(1, stats['hits'] + stats['stale_hits'] + stats['misses']):g}"
+        for name, stats in caches.items()])
+    lines += prometheus_family("cache_entries", "gauge", "Entries held per cache.", [
+        f"cache_entries{prometheus_labels(cache=name)} {stats['size']}" for name, stats in caches.items()])
+    lines += prometheus_family("cache_inflight_loads", "gauge", "Loads in progress per cache (requests queued behind a fetch or prediction).", [
+        f"cache_inflight_loads{prometheus_labels(cache=name)} {stats['inflight']}" for name, stats in caches.items()])
+    return "\n".join(lines) + "\n"
+
 # --- Flask Routes ---
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/api/candles')
+@stage_timers.timed("api_candles")
 def api_candles():
     symbol = request.args.get('symbol', 'BTCUSDT').upper()
     interval = request.args.get('interval', '15')
     num_predictions = request.args.get('predictions', 5, type=int)
     num_predictions = max(1, min(num_predictions, 20)) 
+    mode = request.args.get('mode', 'recursive')
+    since = request.args.get('since', type=int)  # ts of the last candle the chart already has
     if interval not in ALLOWED_INTERVALS: return jsonify({"error": "Invalid interval"}), 400
+    if mode not in PREDICTION_MODES: return jsonify({"error": "Invalid mode"}), 400
     try:
-        raw_candles = get_bybit_data(symbol, interval)
-        if not raw_candles: return jsonify({"error": "No data from Bybit API (check symbol)"}), 404
-        historical = [{"t": int(c[0]), "o": float(c[1]), "h": float(c[2]), "l": float(c[3]), "c": float(c[4]), "v": float(c[5])} for c in raw_candles]
-        predicted = predict_next_candles(raw_candles, num_predictions)
-        return jsonify({"symbol": symbol, "interval": interval, "candles": historical, "predicted": predicted})
+        candles = get_bybit_data(symbol, interval)
+        if not candles: return jsonify({"error": "No data from Bybit API (check symbol)"}), 404
+        # With `since` inside the window only the candles from that one on are sent (it may have changed since);
+        # "full" tells the chart whether to replace its data or patch it
+        delta = since is not None and candles.ts[0] <= since
+        shown = candles[bisect.bisect_left(candles.ts, since):] if delta else candles
+        return cached_json_response(candles_etag(candles, symbol, interval, mode, num_predictions, since if delta else "full"), lambda: {
+            "symbol": symbol, "interval": interval, "mode": mode, "full": not delta, "candles": shown.to_dicts(),
+            "predicted": get_prediction(symbol, interval, candles, num_predictions, mode)})
     except (ConnectionError, ValueError) as e: return jsonify({"error": str(e)}), 500
     except Exception as e:
         app.logger.error(f"An unexpected error occurred: {e}")
         return jsonify({"error": "An internal server error occurred."}), 500
 
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    return jsonify({**cache.stats(), "predictions": prediction_cache.stats()})
+
+@app.route('/api/http_stats')
+def api_http_stats():
+    return jsonify({"bybit": bybit_http.stats()})
+
+@app.route('/api/stage_stats')
+def api_stage_stats():
+    return jsonify(stage_timers.stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(prometheus_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Serving ---
+def serve_prefork(host, port, workers):
+    """
+    Production serving (POSIX): `workers` forked processes share one listening socket, so the
+    kernel spreads connections over them and predictions run on every core instead of queueing
+    behind one interpreter; each runs Werkzeug's threaded WSGI server. The processes share the
+    kline store and the forecasts on disk (both safe across processes); the in-memory caches are
+    per process. The parent only supervises: a worker that exits is restarted, and SIGTERM or
+    SIGINT stops them all. Any WSGI server works the same way, e.g. `gunicorn -w 8 main:app`.
+    """
+    listener = socket.create_server((host, port), backlog=1024)
+    children, stopping = set(), []
+
+    def spawn():
+        pid = os.fork()
+        if pid:
+            children.add(pid)
+            return
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the whole group; the parent stops the workers
+            make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+        except Exception as e:
+            app.logger.error(f"HTTP worker {os.getpid()} failed: {e}")
+        finally:
+            os._exit(1)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on {host}:{port} with {workers} worker processes")
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            app.logger.warning(f"HTTP worker {pid} exited with status {status}; restarting it")
+            time.sleep(1)
+            if not stopping:
+                spawn()
+
 # --- Main Execution ---
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if sys.argv[1:2] == ["--serve"]:
+        if not hasattr(os, "fork"):
+            sys.exit("--serve needs fork(); run a WSGI server on main:app instead")
+        serve_prefork('0.0.0.0', 5000, int(sys.argv[2]) if len(sys.argv) > 2 else SERVE_WORKERS)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,47 @@
+"""
+Shared fixtures: the three app scripts loaded as modules (the way benchmark.py loads them,
+so no server starts) and seeded synthetic candles from benchmark.py's generators.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benchmark  # noqa: E402
+
+APP_PATHS = {
+    "main": "main.py",
+    "quant_watch": "Quant_Watch.py",
+    "bot": os.path.join("fully-automatic-project", "main.py"),
+}
+
+@pytest.fixture(scope="session")
+def load_app():
+    modules = {}
+    def load(name):
+        if name not in modules:
+            modules[name] = benchmark.load_target(os.path.join(ROOT, APP_PATHS[name]))
+        return modules[name]
+    return load
+
+@pytest.fixture(scope="session", params=sorted(APP_PATHS))
+def app_module(request, load_app):
+    return load_app(request.param)
+
+@pytest.fixture(scope="session")
+def bot(load_app):
+    return load_app("bot")
+
+def synthetic_candles(app, count, seed, generator="random_walk"):
+    return app.CandleSeries.from_rows(benchmark.GENERATOR_FUNCTIONS[generator](count, seed))
+
+@pytest.fixture
+def bot_state(bot, monkeypatch, tmp_path):
+    # The bot's module-level store, swapped for one in tmp_path so tests never touch bot_state.db
+    store = bot.StateStore(str(tmp_path / "bot_state.db"))
+    monkeypatch.setattr(bot, "state", store)
+    yield store
+    store.close()
@@ -0,0 +1,37 @@
+"""
+WalkForwardPredictor (bot) against the per-bar predictor it replaces: every bar's forecast
+must equal predict_next_candles on the `lookback` candles before it, across the profile
+re-anchoring and for the model parameters a sweep varies.
+"""
+import pytest
+
+from conftest import synthetic_candles
+
+def closes(predictions):
+    return [p["c"] for p in predictions]
+
+@pytest.mark.parametrize("mode", ["recursive", "direct"])
+@pytest.mark.parametrize("window_size, top_n", [(20, 5), (10, 3)])
+def test_walk_forward_matches_per_bar_prediction(bot, mode, window_size, top_n):
+    candles = synthetic_candles(bot, 400, 7, "regime")  # > REANCHOR_BARS bars, so the exact re-anchoring is crossed
+    predictor = bot.WalkForwardPredictor(candles, 50, 10, mode, window_size, top_n)
+    for i in range(50, len(candles)):
+        expected = bot.predict_next_candles(candles[i - 50:i], 10, mode, window_size=window_size, top_n=top_n)
+        actual = predictor.predictions_at(i)
+        assert [p["t"] for p in actual] == [p["t"] for p in expected]
+        assert closes(actual) == pytest.approx(closes(expected), rel=1e-9)
+
+def test_gapped_history_fallback_keeps_model_parameters(bot):
+    candles = synthetic_candles(bot, 120, 8)
+    candles.close[0] = 0.0  # A non-positive close sends every bar through predict_next_candles
+    predictor = bot.WalkForwardPredictor(candles, 50, 5, "recursive", 10, 3)
+    for i in range(50, len(candles)):
+        assert predictor.predictions_at(i) == bot.predict_next_candles(candles[i - 50:i], 5, "recursive", window_size=10, top_n=3)
+    assert any(predictor.predictions_at(i) != bot.predict_next_candles(candles[i - 50:i], 5) for i in range(51, len(candles)))
+
+def test_profit_factor_without_losses_is_json_safe(bot):
+    class OneWinningTrade:
+        lookback, ts, closes, highs, lows = 1, [0, 1, 2], [100.0, 100.0, 120.0], [100.0, 100.0, 121.0], [100.0, 100.0, 119.0]
+        def predictions_at(self, i): return [{"c": 110.0, "h": 111.0, "l": 105.0}] if i == 1 else []
+    metrics = bot.simulate_backtest(OneWinningTrade(), 0, 10, 10, 1.0)["metrics"]
+    assert metrics["total_trades"] == 1 and metrics["profit_factor"] is None
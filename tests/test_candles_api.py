@@ -0,0 +1,81 @@
+"""
+/api/candles (all three scripts) through Flask's test client: ETags with If-None-Match answered
+by a 304 before anything is computed, bodies serialized once per ETag, plain and gzipped, and
+`since=` deltas for the chart's incremental refresh.
+"""
+import gzip
+import itertools
+import json
+
+import pytest
+
+from conftest import synthetic_candles
+
+symbols = (f"T{n}USDT" for n in itertools.count())  # Fresh cache keys for every test
+
+class CandlesApi:
+    """The app's /api/candles, fed from `candles` instead of Bybit, counting the forecasts it computes."""
+    def __init__(self, app, monkeypatch, candles):
+        self.app, self.candles, self.symbol, self.predictions = app, candles, next(symbols), 0
+        source = "get_live_candles" if hasattr(app, "get_live_candles") else "get_bybit_data"
+        monkeypatch.setattr(app, source, lambda symbol, interval: self.candles)
+        get_prediction = app.get_prediction
+        def counting_get_prediction(*args, **kwargs):
+            self.predictions += 1
+            return get_prediction(*args, **kwargs)
+        monkeypatch.setattr(app, "get_prediction", counting_get_prediction)
+        self.client = app.app.test_client()
+    def get(self, headers=None, **params):
+        query = {"symbol": self.symbol, "interval": "60", "predictions": 5, "mode": "recursive", **params}
+        return self.client.get("/api/candles", query_string=query, headers=headers or {})
+
+@pytest.fixture
+def api(request, app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "PREDICTION_CACHE_DIR", str(tmp_path))
+    if hasattr(app_module, "StateStore"): request.getfixturevalue("bot_state")  # The bot reads its settings from the store
+    return CandlesApi(app_module, monkeypatch, synthetic_candles(app_module, 300, 21))
+
+def test_matching_etag_gets_a_304_without_a_forecast(api):
+    response = api.get()
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and response.headers["Cache-Control"] == "no-cache" and api.predictions == 1
+    assert len(response.get_json()["predicted"]) == 5
+    cached = api.get(headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.data == b"" and cached.headers["ETag"] == etag
+    assert api.predictions == 1
+
+def test_body_is_serialized_once_per_etag(api):
+    plain = api.get()
+    compressed = api.get(headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip" and "Content-Encoding" not in plain.headers
+    assert gzip.decompress(compressed.data) == plain.data
+    assert json.loads(plain.data) == plain.get_json() and api.predictions == 1
+    assert compressed.headers["ETag"] == plain.headers["ETag"] and "Accept-Encoding" in plain.headers["Vary"]
+
+def test_a_changed_forming_candle_changes_the_etag(api):
+    etag = api.get().headers["ETag"]
+    candles = api.candles
+    api.candles = api.app.CandleSeries(*(type(column)(column.typecode, column) for column in candles.columns()))
+    api.candles.close[-1] *= 1.01
+    response = api.get(headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert response.get_json()["candles"][-1]["c"] == api.candles.close[-1]
+    assert api.get(headers={"If-None-Match": etag}, predictions=6).status_code == 200  # Other parameters, other ETag
+
+def test_since_inside_the_window_sends_the_candles_from_it_on(api):
+    full = api.get().get_json()
+    delta = api.get(since=api.candles.ts[-3]).get_json()
+    assert full["full"] is True and full["candles"] == api.candles.to_dicts()
+    assert delta["full"] is False and delta["candles"] == api.candles[-3:].to_dicts()
+    assert delta["predicted"] == full["predicted"]
+    assert api.get(since=api.candles.ts[-1]).get_json()["candles"] == api.candles[-1:].to_dicts()  # The forming candle, patched in place
+
+def test_since_outside_the_window_sends_everything(api):
+    interval_ms = api.candles.ts[1] - api.candles.ts[0]
+    stale = api.get(since=api.candles.ts[0] - 5 * interval_ms).get_json()
+    assert stale["full"] is True and stale["candles"] == api.candles.to_dicts()
+
+def test_deltas_have_their_own_etags(api):
+    etags = {api.get(**params).headers["ETag"] for params in ({}, {"since": api.candles.ts[-2]}, {"since": api.candles.ts[-1]})}
+    assert len(etags) == 3
+    assert api.get(since=api.candles.ts[0] - 1).headers["ETag"] == api.get().headers["ETag"]  # A full answer is the same one
@@ -0,0 +1,102 @@
+"""
+ExchangeClient and TokenBucket (all three scripts): GETs retried on 429/5xx with exponential or
+server-requested backoff, orders never resent, a rate limit pausing the endpoint for every thread,
+and the bucket's burst and refill.
+"""
+import threading
+import time
+
+import pytest
+import requests
+
+class ScriptedSession:
+    """Stands in for the client's requests.Session: answers with `results` in order (an exception is raised)."""
+    def __init__(self, *results):
+        self.results, self.calls = list(results), []
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, time.monotonic()))
+        result = self.results.pop(0)
+        if isinstance(result, Exception): raise result
+        return result
+
+def response(status, **headers):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update({name.replace("_", "-"): value for name, value in headers.items()})
+    return result
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Sleeps of the test's own thread from 0.5 s up are recorded instead of slept; shorter ones are real."""
+    recorded, real_sleep, me = [], time.sleep, threading.get_ident()
+    def sleep(seconds):
+        if threading.get_ident() != me or seconds < 0.5: return real_sleep(seconds)
+        recorded.append(seconds)
+    monkeypatch.setattr(time, "sleep", sleep)
+    return recorded
+
+def client(app, *results):
+    exchange = app.ExchangeClient("https://exchange.test", 2, {"/order": 1000}, 1000)
+    exchange.session = ScriptedSession(*results)
+    return exchange
+
+def test_gets_are_retried_with_exponential_backoff(app_module, sleeps):
+    exchange = client(app_module, response(503), response(502), response(200))
+    assert exchange.request("GET", "/kline").status_code == 200
+    assert sleeps == [1, 2] and len(exchange.session.calls) == 3
+    assert exchange.stats()["/kline"]["outcomes"] == {"503": 1, "502": 1, "200": 1}
+
+def test_retries_stop_after_the_limit(app_module, sleeps):
+    exchange = client(app_module, *[response(500)] * (app_module.HTTP_MAX_RETRIES + 1))
+    assert exchange.request("GET", "/kline").status_code == 500
+    assert sleeps == [2 ** k for k in range(app_module.HTTP_MAX_RETRIES)]
+
+def test_orders_are_never_resent(app_module, sleeps):
+    exchange = client(app_module, response(503))
+    assert exchange.request("POST", "/order").status_code == 503
+    assert len(exchange.session.calls) == 1 and sleeps == []
+
+def test_retry_after_pauses_the_endpoint_for_every_thread(app_module, sleeps):
+    exchange = client(app_module, response(429, Retry_After="0.3"), response(200))
+    assert exchange.request("GET", "/kline").status_code == 200
+    (_, _, first), (_, _, retried) = exchange.session.calls
+    assert retried - first >= 0.29 and sleeps == []  # Waited in the bucket, not on the backoff schedule
+    exchange.session.results += [response(429, Retry_After="0.3"), response(200)]
+    assert exchange.request("POST", "/kline").status_code == 429  # Not resent, but the endpoint is paused...
+    other = threading.Thread(target=lambda: exchange.request("GET", "/kline"))
+    other.start(); other.join()
+    assert exchange.session.calls[-1][2] - exchange.session.calls[-2][2] >= 0.29  # ...for the other thread too
+
+def test_a_longer_server_wait_fails_the_request(app_module, sleeps):
+    exchange = client(app_module, response(429, Retry_After=str(app_module.HTTP_MAX_BACKOFF_SECONDS + 1)))
+    assert exchange.request("GET", "/kline").status_code == 429 and len(exchange.session.calls) == 1
+    assert exchange.bucket("/kline").paused_until > time.monotonic() + app_module.HTTP_MAX_BACKOFF_SECONDS - 1
+
+def test_an_exhausted_bybit_quota_pauses_until_its_reset(app_module, sleeps):
+    reset_ms = int((time.time() + 5) * 1000)
+    exchange = client(app_module, response(200, X_Bapi_Limit_Status="0", X_Bapi_Limit_Reset_Timestamp=str(reset_ms)))
+    assert exchange.request("GET", "/kline").status_code == 200
+    assert 3 < exchange.bucket("/kline").paused_until - time.monotonic() <= 5
+
+def test_connection_errors_raise_and_are_counted(app_module, sleeps):
+    exchange = client(app_module, requests.exceptions.ConnectionError("refused"))
+    with pytest.raises(requests.exceptions.ConnectionError): exchange.request("GET", "/kline")
+    assert exchange.stats()["/kline"]["outcomes"] == {"error": 1}
+
+def test_token_bucket_allows_a_burst_then_its_rate(app_module):
+    bucket = app_module.TokenBucket(50)
+    started = time.monotonic()
+    for _ in range(50): bucket.acquire()
+    burst = time.monotonic() - started
+    for _ in range(10): bucket.acquire()
+    assert burst < 0.1 and 0.15 < time.monotonic() - started < 1.0
+
+def test_token_bucket_pause_holds_every_caller(app_module):
+    bucket, waited = app_module.TokenBucket(1000), []
+    bucket.pause(0.2)
+    def acquire():
+        started = time.monotonic(); bucket.acquire(); waited.append(time.monotonic() - started)
+    threads = [threading.Thread(target=acquire) for _ in range(3)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert len(waited) == 3 and min(waited) >= 0.15
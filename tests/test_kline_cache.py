@@ -0,0 +1,82 @@
+"""
+KlineCache (all three scripts): one load per key however many callers miss at once, stale
+values served while a single background reload runs, LRU bounds and load errors.
+"""
+import threading
+import time
+
+import pytest
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+class CountingLoader:
+    """Returns value-1, value-2, ... and records the previous value it was given; can be held on `gate`."""
+    def __init__(self, gate=None, error=None):
+        self.calls, self.previous, self.gate, self.error = 0, [], gate, error
+    def __call__(self, previous):
+        self.calls += 1
+        self.previous.append(previous)
+        if self.gate is not None: self.gate.wait(5)
+        if self.error is not None: raise self.error
+        return f"value-{self.calls}"
+
+def test_concurrent_misses_share_one_load(app_module):
+    cache, gate = app_module.KlineCache(8, 60, 0), threading.Event()
+    loader, results = CountingLoader(gate), []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("k", loader))) for _ in range(8)]
+    for thread in threads: thread.start()
+    wait_until(lambda: cache.stats()["waits"] == 7)
+    gate.set()
+    for thread in threads: thread.join()
+    assert loader.calls == 1 and results == ["value-1"] * 8
+    assert cache.stats()["misses"] == 8 and cache.stats()["loads"] == 1
+
+def test_stale_values_are_served_while_one_reload_runs(app_module):
+    cache, gate = app_module.KlineCache(8, 60, 60), threading.Event()
+    loader = CountingLoader()
+    assert cache.get("k", loader, ttl=lambda value: 0) == "value-1"  # Stale at once, within stale_ttl
+    loader.gate = gate
+    started = time.monotonic()
+    assert [cache.get("k", loader, ttl=lambda value: 0) for _ in range(5)] == ["value-1"] * 5
+    assert time.monotonic() - started < 1  # Nobody waited for the reload
+    assert loader.calls == 2 and cache.stats()["inflight"] == 1  # One background reload for all five
+    gate.set()
+    wait_until(lambda: cache.stats()["inflight"] == 0)
+    assert loader.previous == [None, "value-1"]
+    assert cache.get("k", loader, ttl=lambda value: 60) == "value-2"
+    assert cache.stats()["stale_hits"] == 6
+
+def test_expired_values_reload_with_the_previous_value(app_module):
+    cache, loader = app_module.KlineCache(8, 0, 0), CountingLoader()
+    cache.get("k", loader)
+    assert cache.get("k", loader) == "value-2" and loader.previous == [None, "value-1"]
+
+def test_least_recently_used_key_is_evicted(app_module):
+    cache, loader = app_module.KlineCache(2, 60, 0), CountingLoader()
+    cache.get("a", loader); cache.get("b", loader); cache.get("a", loader); cache.get("c", loader)
+    assert cache.get("a", loader) == "value-1" and cache.get("b", loader) == "value-4"
+    assert cache.stats()["evictions"] == 2 and cache.stats()["size"] == 2
+
+def test_load_errors_reach_every_waiter_and_are_not_cached(app_module):
+    cache, gate = app_module.KlineCache(8, 60, 0), threading.Event()
+    loader, errors = CountingLoader(gate, ConnectionError("down")), []
+    def get():
+        try: cache.get("k", loader)
+        except ConnectionError as e: errors.append(e)
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads: thread.start()
+    wait_until(lambda: cache.stats()["waits"] == 3)
+    gate.set()
+    for thread in threads: thread.join()
+    assert len(errors) == 4 and loader.calls == 1 and cache.stats()["load_errors"] == 1
+    loader.error = None
+    assert cache.get("k", loader) == "value-2"
+
+def test_empty_results_are_not_stored(app_module):
+    cache, calls = app_module.KlineCache(8, 60, 0), []
+    for _ in range(3): cache.get("k", lambda previous: calls.append(previous) or [])
+    assert calls == [None] * 3 and cache.stats()["size"] == 0
@@ -0,0 +1,47 @@
+"""
+KlineStore (main.py and the bot): newly closed candles are appended in place, overlaps and
+backfills build a new generation, and readers always see whole, ordered rows.
+"""
+import os
+
+import pytest
+
+from conftest import synthetic_candles
+
+@pytest.fixture(params=["main", "bot"])
+def app(request, load_app):
+    return load_app(request.param)
+
+def meta(store):
+    return store._meta(store._dir("X", "60", "spot"))
+
+def test_closed_candles_are_appended_in_place(app, tmp_path):
+    store, candles = app.KlineStore(str(tmp_path)), synthetic_candles(app, 300, 1)
+    store.merge("X", "60", "spot", candles[:200], candles.ts[0], candles.ts[199])
+    reader = store.read("X", "60", "spot")
+    for i in range(200, 300):  # Each refresh repeats the last stored candle and adds the one that closed
+        store.merge("X", "60", "spot", candles[i - 1:i + 1], candles.ts[i - 1], candles.ts[i])
+    assert meta(store)["generation"] == 1 and meta(store)["count"] == 300
+    assert store.read("X", "60", "spot").rows() == candles.rows()
+    assert len(reader) == 200  # A snapshot taken earlier still ends where it did
+
+def test_interrupted_append_is_invisible_and_overwritten(app, tmp_path):
+    store, candles = app.KlineStore(str(tmp_path)), synthetic_candles(app, 100, 2)
+    store.merge("X", "60", "spot", candles[:50], candles.ts[0], candles.ts[49])
+    with open(os.path.join(store._dir("X", "60", "spot"), "gen-1", "ts"), "ab") as f: f.write(b"\0" * 16)
+    assert len(store.read("X", "60", "spot")) == 50
+    store.merge("X", "60", "spot", candles[50:], candles.ts[50], candles.ts[99])
+    assert store.read("X", "60", "spot").rows() == candles.rows()
+
+def test_overlaps_and_backfills_build_a_new_generation(app, tmp_path):
+    store, candles = app.KlineStore(str(tmp_path)), synthetic_candles(app, 300, 3)
+    store.merge("X", "60", "spot", candles[100:200], candles.ts[100], candles.ts[199])
+    store.merge("X", "60", "spot", candles[:100], candles.ts[0], candles.ts[99])
+    assert meta(store)["generation"] == 2
+    changed = candles[150:151]
+    changed = app.CandleSeries(*(type(column)(column.typecode, column) for column in changed.columns()))
+    changed.close[0] += 1.0
+    store.merge("X", "60", "spot", changed, changed.ts[0], changed.ts[0])
+    stored = store.read("X", "60", "spot")
+    assert meta(store)["generation"] == 3 and list(stored.ts) == list(candles.ts[:200])
+    assert stored.close[150] == candles.close[150] + 1.0
@@ -0,0 +1,46 @@
+"""
+The bot's market data bus: Bybit stream messages become prices and candles for the in-process
+subscribers, and against the local stand-in feed server the bus subscribes the socket to what its
+owners track, and nothing more.
+"""
+import time
+
+import pytest
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_messages_update_prices_and_candles(bot):
+    bus = bot.MarketDataBus("ws://unused")
+    tickers, everything = bus.subscribe(("ticker",)), bus.subscribe()
+    bus._handle({"topic": "tickers.ETHUSDT", "data": {"symbol": "ETHUSDT", "lastPrice": "2500.5"}})
+    bus._handle({"topic": "tickers.ETHUSDT", "type": "delta", "data": {"symbol": "ETHUSDT", "volume24h": "1"}})  # No price: ignored
+    bus._handle({"topic": "kline.60.ETHUSDT", "data": [{"start": 3600000, "open": "1", "high": "3", "low": "0.5", "close": "2", "volume": "7", "confirm": True}]})
+    assert bus.prices_for(["ETHUSDT", "BTCUSDT"]) == {"ETHUSDT": 2500.5}
+    assert bus.latest_candle("ETHUSDT", "60") == {"t": 3600000, "o": 1.0, "h": 3.0, "l": 0.5, "c": 2.0, "v": 7.0, "confirm": True}
+    assert tickers.wait(0) == {("ticker", "ETHUSDT")}
+    assert everything.wait(0) == {("ticker", "ETHUSDT"), ("kline", ("ETHUSDT", "60"))}
+    assert everything.wait(0.01) == set()
+
+def test_stream_from_the_stand_in_feed_server(bot, monkeypatch):
+    if bot.websocket is None: pytest.skip("websocket-client is not installed")
+    monkeypatch.setattr(bot, "get_bybit_ticker_data", lambda symbols: {})  # Only the stream may move prices
+    server = bot.LocalFeedServer(port=0, tick_seconds=0.05, seed=1).start()
+    bus = bot.MarketDataBus(f"ws://127.0.0.1:{server.port}")
+    bus.track("prices", symbols=["ETHUSDT"])
+    bus.track("candles", symbols=["ETHUSDT"], klines=[("BTCUSDT", "1")])
+    subscription = bus.subscribe()
+    bus.start()
+    updates = set()
+    wait_until(lambda: updates.update(subscription.wait(0.1)) or {("ticker", "ETHUSDT"), ("kline", ("BTCUSDT", "1"))} <= updates)
+    status = bus.status()
+    assert status["connected"] and status["transport"] == "websocket" and status["topics"] == ["kline.1.BTCUSDT", "tickers.ETHUSDT"]
+    assert bus.prices_for(["ETHUSDT"])["ETHUSDT"] > 0 and bus.latest_candle("BTCUSDT", "1")["confirm"] is False
+
+    bus.track("candles")  # The kline is no longer tracked by anyone; the ticker still is
+    def server_topics():
+        with server.lock: return [sorted(client[0]) for client in server.clients.values()]
+    wait_until(lambda: server_topics() == [["tickers.ETHUSDT"]])
@@ -0,0 +1,29 @@
+"""
+The bot's /metrics under multi-process serving: every sample names its process, and HTTP-only
+processes leave out the engine's families instead of reporting zeros.
+"""
+import os
+
+import pytest
+
+ENGINE_FAMILIES = ("analysis_lag_seconds", "analysis_queue_depth", "status_feed_changes_total", "market_data_connected")
+
+def samples(body):
+    return [line for line in body.splitlines() if line and not line.startswith("#")]
+
+@pytest.mark.parametrize("role", ["http", "engine", "all"])
+def test_samples_carry_role_and_pid(bot, bot_state, monkeypatch, role):
+    monkeypatch.setattr(bot, "process_role", role)
+    bot.prediction_cache.get("metrics-test", lambda previous: [])
+    lines = samples(bot.prometheus_metrics())
+    assert lines and all(f'role="{role}",pid="{os.getpid()}"' in line for line in lines)
+    families = {line.split("{")[0] for line in lines}
+    assert {"cache_events_total", "sse_streams"} <= families
+    assert all((family in families) == (role != "http") for family in ENGINE_FAMILIES)
+
+def test_route_serves_the_text_format(bot, bot_state, monkeypatch):
+    monkeypatch.setattr(bot, "process_role", "engine")
+    bot_state.set_status("1", {"message": "Waiting..."})
+    response = bot.app.test_client().get("/metrics")
+    assert response.status_code == 200 and response.content_type.startswith("text/plain; version=0.0.4")
+    assert f'status_feed_changes_total{{role="engine",pid="{os.getpid()}"}} {bot_state.feed_version()}' in response.get_data(as_text=True)
@@ -0,0 +1,83 @@
+"""
+The bot's cross-symbol PatternLibrary (random-projection LSH): indexed windows are found again,
+candidates are reranked by exact cosine similarity within their own source, and the index
+survives reopening and incremental appends unchanged.
+"""
+import math
+import os
+import random
+import statistics
+
+import pytest
+
+from conftest import synthetic_candles
+
+W = 20
+
+def log_returns(candles):
+    return [math.log(b / a) for a, b in zip(candles.close, candles.close[1:])]
+
+def similarity(library, query, p):
+    window = library.returns[p:p + W]
+    return sum(x * y for x, y in zip(window, query)) / math.sqrt(sum(x * x for x in window) * sum(x * x for x in query))
+
+def exact_nearest(library, query, top_n, horizon=1):
+    scored = [(similarity(library, query, p), p) for start, end in zip(library.segment_starts, library.segment_ends)
+              for p in range(start, end - W - horizon + 1) if any(library.returns[p:p + W])]
+    return [p for _, p in sorted(scored, reverse=True)[:top_n]]
+
+def sources(bot):
+    gapped = synthetic_candles(bot, 2000, 32)
+    gapped.close[700] = 0.0  # A non-positive close splits the source's returns into two segments
+    return {"S0": synthetic_candles(bot, 2000, 30), "S1": synthetic_candles(bot, 2000, 31, "regime"), "S2": gapped}
+
+@pytest.fixture(scope="module")
+def library(bot, tmp_path_factory):
+    library = bot.PatternLibrary(str(tmp_path_factory.mktemp("library")))
+    for key, candles in sources(bot).items(): library.append_source(key, candles)
+    return library
+
+@pytest.fixture(scope="module")
+def queries(bot):
+    returns = log_returns(synthetic_candles(bot, 600, 99))
+    return [returns[k:k + W] for k in range(0, 500, 20)]
+
+def test_indexed_windows_find_themselves(library):
+    rng = random.Random(1)
+    positions = [rng.randrange(len(library.returns) - 2 * W) for _ in range(20)]
+    positions = [p for p in positions if p in exact_nearest(library, library.returns[p:p + W], 1)]
+    assert positions and all(library.nearest(library.returns[p:p + W], 1) == [p] for p in positions)
+    noisy = sum(library.nearest([x + rng.gauss(0, 0.1 * abs(x) + 1e-5) for x in library.returns[p:p + W]], 1) == [p] for p in positions)
+    assert noisy >= 0.9 * len(positions)
+
+def test_candidates_are_reranked_exactly_within_their_segment(library, queries):
+    for query in queries:
+        top = library.nearest(query, 5, horizon=5)
+        assert len(top) == 5
+        similarities = [similarity(library, query, p) for p in top]
+        assert similarities == sorted(similarities, reverse=True)
+        assert all(p + W + 5 <= end for p in top for start, end in zip(library.segment_starts, library.segment_ends) if start <= p < end)
+
+def test_approximate_matches_are_close_to_exact(library, queries):
+    ratios = [statistics.mean(similarity(library, query, p) for p in library.nearest(query, 5)) /
+              statistics.mean(similarity(library, query, p) for p in exact_nearest(library, query, 5)) for query in queries]
+    assert statistics.mean(ratios) > 0.85
+
+def test_reopening_and_incremental_appends_give_the_same_index(bot, library, queries, tmp_path):
+    reopened = bot.PatternLibrary(os.path.dirname(library.path))
+    assert reopened.stats() == library.stats() and list(reopened.returns) == list(library.returns)
+    incremental = bot.PatternLibrary(str(tmp_path))
+    for key, candles in sources(bot).items():
+        incremental.append_source(key, candles[:1200])
+        assert incremental.append_source(key, candles[:1200]) == 0  # Nothing new
+    with open(os.path.join(incremental.path, "codes"), "ab") as f: f.write(b"\1" * 64)  # A torn append, never committed to meta.json
+    incremental = bot.PatternLibrary(str(tmp_path))
+    for key, candles in sources(bot).items(): incremental.append_source(key, candles)
+    assert incremental.stats()["windows"] == library.stats()["windows"]
+    for query in queries:
+        assert incremental.query(query, 5, 3) == pytest.approx(library.query(query, 5, 3), rel=1e-12)
+
+def test_the_forecaster_uses_a_library_of_its_window_size(bot, library, queries):
+    series = [x for query in queries[:5] for x in query]
+    assert bot.find_similar_patterns_pure_python(series, W, 5, library=library) == library.query(series[-W:], 5)[0]
+    assert bot.library_path(library, series, 10, 5, 1) is None  # Other window sizes search the series itself
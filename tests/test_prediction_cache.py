@@ -0,0 +1,37 @@
+"""
+get_prediction (all three scripts): forecasts come from closed candles only, keyed by the
+last closed candle, yet still start one interval after the forming candle.
+"""
+import time
+
+import pytest
+
+import benchmark
+
+HOUR_MS = 3600000
+
+@pytest.fixture(autouse=True)
+def prediction_dir(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "PREDICTION_CACHE_DIR", str(tmp_path))
+
+def hourly_candles(app, last_ts, count=200, seed=11):
+    rows = benchmark.GENERATOR_FUNCTIONS["random_walk"](count, seed)
+    for k, row in enumerate(rows): row[0] = str(last_ts - (count - 1 - k) * HOUR_MS)
+    return app.CandleSeries.from_rows(rows)
+
+def test_forecast_starts_after_the_forming_candle(app_module):
+    forming_ts = app_module.candle_close_ms("60", int(time.time() * 1000)) - HOUR_MS
+    candles = hourly_candles(app_module, forming_ts)
+    predicted = app_module.get_prediction("FORMINGUSDT", "60", candles, 5)
+    assert [p["t"] for p in predicted] == [forming_ts + k * HOUR_MS for k in range(1, 6)]
+    assert predicted == app_module.predict_next_candles(candles[:-1], 6)[1:]  # The forming candle's price is not used
+    changed = app_module.CandleSeries(*(type(column)(column.typecode, column) for column in candles.columns()))
+    changed.close[-1] *= 1.05
+    assert app_module.get_prediction("FORMINGUSDT", "60", changed, 5) == predicted
+
+def test_closed_candles_are_forecast_as_they_are(app_module):
+    last_ts = app_module.candle_close_ms("60", int(time.time() * 1000)) - 2 * HOUR_MS
+    candles = hourly_candles(app_module, last_ts)
+    predicted = app_module.get_prediction("CLOSEDUSDT", "60", candles, 5)
+    assert predicted == app_module.predict_next_candles(candles, 5)
+    assert predicted[0]["t"] == last_ts + HOUR_MS
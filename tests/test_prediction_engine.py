@@ -0,0 +1,78 @@
+"""
+predict_next_candles against a reference: the original slice-and-sort scan, rerun from
+scratch for every predicted candle. The rolling norms, the dot profiles (column-wise, FFT
+or diagonally updated across steps) and the bounded top-k must not change the forecast.
+"""
+import math
+import statistics
+from array import array
+
+import pytest
+
+from conftest import synthetic_candles
+
+def reference_search(series, window_size, top_n, num_windows):
+    """Start indices of the top_n windows most cosine-similar to the last one."""
+    current = series[-window_size:]
+    current_norm = math.sqrt(sum(x * x for x in current))
+    if current_norm == 0: return []
+    scored = []
+    for i in range(num_windows):
+        window = series[i:i + window_size]
+        norm = math.sqrt(sum(x * x for x in window))
+        if norm > 0: scored.append((sum(x * y for x, y in zip(window, current)) / (norm * current_norm), i))
+    scored.sort(key=lambda score: score[0], reverse=True)
+    return [i for _, i in scored[:top_n]]
+
+def log_returns(closes):
+    return [math.log(b / a) for a, b in zip(closes, closes[1:]) if a > 0]
+
+def reference_closes(closes, num_predictions, mode, window_size=20, top_n=5):
+    closes, predicted = list(closes), []
+    if mode == "direct":
+        returns = log_returns(closes)
+        if len(returns) < 2 * window_size: return []
+        top = reference_search(returns, window_size, top_n, len(returns) - window_size - num_predictions + 1)
+        close = closes[-1]
+        for h in range(num_predictions if top else 0):
+            close *= math.exp(statistics.mean(returns[i + window_size + h] for i in top))
+            predicted.append(close)
+        return predicted
+    for _ in range(num_predictions):
+        returns = log_returns(closes)
+        if len(returns) < 2 * window_size: break
+        top = reference_search(returns, window_size, top_n, len(returns) - window_size)
+        if not top: break
+        closes.append(closes[-1] * math.exp(statistics.mean(returns[i + window_size] for i in top)))
+        predicted.append(closes[-1])
+    return predicted
+
+# 2100 candles take the NumPy FFT profile in Quant_Watch.py and the bot when NumPy is installed
+CASES = [(120, 0, 20), (1000, 1, 20), (2100, 2, 5)]
+
+@pytest.mark.parametrize("mode", ["recursive", "direct"])
+@pytest.mark.parametrize("length, seed, num_predictions", CASES)
+def test_forecast_matches_reference(app_module, mode, length, seed, num_predictions):
+    candles = synthetic_candles(app_module, length, seed, "regime" if seed % 2 else "random_walk")
+    predicted = app_module.predict_next_candles(candles, num_predictions, mode)
+    expected = reference_closes(candles.close.tolist(), num_predictions, mode)
+    assert len(expected) == num_predictions
+    assert [p["c"] for p in predicted] == pytest.approx(expected, rel=1e-9)
+
+def test_forecast_candles_continue_the_series(app_module):
+    candles = synthetic_candles(app_module, 300, 3)
+    predicted = app_module.predict_next_candles(candles, 10)
+    interval_ms = candles.ts[-1] - candles.ts[-2]
+    assert [p["t"] for p in predicted] == [candles.ts[-1] + k * interval_ms for k in range(1, 11)]
+    assert [p["o"] for p in predicted] == [candles.close[-1]] + [p["c"] for p in predicted[:-1]]
+    assert all(p["l"] <= min(p["o"], p["c"]) and p["h"] >= max(p["o"], p["c"]) for p in predicted)
+
+def test_flat_stretches_are_never_matched(app_module):
+    # Windows of zero log returns have no direction; they must be skipped, not divide by zero
+    candles = synthetic_candles(app_module, 400, 4)
+    candles.close[100:160] = array("d", [candles.close[100]] * 60)
+    predicted = app_module.predict_next_candles(candles, 20)
+    assert [p["c"] for p in predicted] == pytest.approx(reference_closes(candles.close.tolist(), 20, "recursive"), rel=1e-9)
+
+def test_short_history_predicts_nothing(app_module):
+    assert app_module.predict_next_candles(synthetic_candles(app_module, 49, 5), 5) == []
@@ -0,0 +1,27 @@
+"""
+/api/admin/profile (Quant_Watch.py and the bot): served to localhost only, and under the bot's
+--serve only by the engine process, whose threads it is meant to sample.
+"""
+import pytest
+
+@pytest.fixture(params=["quant_watch", "bot"])
+def app(request, load_app):
+    return load_app(request.param)
+
+def profile(app, remote_addr):
+    return app.app.test_client().get("/api/admin/profile?seconds=0.1&mode=wall", environ_base={"REMOTE_ADDR": remote_addr})
+
+@pytest.mark.parametrize("remote_addr", ["203.0.113.5", "10.0.0.2", "::ffff:203.0.113.5"])
+def test_remote_clients_are_refused(app, remote_addr):
+    assert profile(app, remote_addr).status_code == 403
+
+@pytest.mark.parametrize("remote_addr", ["127.0.0.1", "::1"])
+def test_localhost_gets_collapsed_stacks(app, monkeypatch, remote_addr):
+    if hasattr(app, "process_role"): monkeypatch.setattr(app, "process_role", "engine")
+    response = profile(app, remote_addr)
+    assert response.status_code == 200 and response.headers["Content-Disposition"].endswith(".folded")
+
+def test_http_workers_point_to_the_engine(bot, monkeypatch):
+    monkeypatch.setattr(bot, "process_role", "http")
+    response = profile(bot, "127.0.0.1")
+    assert response.status_code == 404 and str(bot.ENGINE_ADMIN_PORT) in response.get_json()["error"]
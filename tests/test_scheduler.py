@@ -0,0 +1,34 @@
+"""
+candle_close_ms (all three scripts): the close of the candle forming at a timestamp on
+Bybit's UTC grid, which the bot's candle-close scheduler and every prediction cache rely on.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+def utc_ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+@pytest.mark.parametrize("interval, ts, close", [
+    ("15", utc_ms(2026, 10, 17, 13, 5), utc_ms(2026, 10, 17, 13, 15)),
+    ("60", utc_ms(2026, 10, 17, 13, 0), utc_ms(2026, 10, 17, 14)),  # A candle's own start
+    ("240", utc_ms(2026, 10, 17, 13, 5), utc_ms(2026, 10, 17, 16)),
+    ("720", utc_ms(2026, 12, 31, 23, 59), utc_ms(2027, 1, 1)),
+    ("D", utc_ms(2026, 10, 17, 13, 5), utc_ms(2026, 10, 18)),
+    ("D", utc_ms(2026, 12, 31, 23, 59, 59), utc_ms(2027, 1, 1)),
+    ("D", utc_ms(2028, 2, 28, 12), utc_ms(2028, 2, 29)),
+    ("W", utc_ms(2026, 10, 17, 13, 5), utc_ms(2026, 10, 19)),  # Saturday -> Monday
+    ("W", utc_ms(2026, 10, 19), utc_ms(2026, 10, 26)),  # Monday 00:00 starts a new week
+    ("W", utc_ms(2026, 12, 30), utc_ms(2027, 1, 4)),
+    ("M", utc_ms(2026, 12, 17), utc_ms(2027, 1, 1)),
+    ("M", utc_ms(2027, 1, 31, 23, 59), utc_ms(2027, 2, 1)),
+    ("M", utc_ms(2028, 2, 1), utc_ms(2028, 3, 1)),
+])
+def test_candle_close(app_module, interval, ts, close):
+    assert app_module.candle_close_ms(interval, ts) == close
+
+@pytest.mark.parametrize("interval", ["15", "60", "D", "W", "M"])
+def test_close_is_the_next_candles_start(app_module, interval):
+    ts = utc_ms(2026, 10, 17, 13, 5)
+    close = app_module.candle_close_ms(interval, ts)
+    assert close > ts and app_module.candle_close_ms(interval, close - 1) == close and app_module.candle_close_ms(interval, close) > close
@@ -0,0 +1,74 @@
+"""
+The bot's StateStore: one journal entry per event, open positions that survive a killed
+process, and compaction of the journal and the WAL file.
+"""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import APP_PATHS, ROOT
+
+POSITION = {"symbol": "ETHUSDT", "quantity": 1.0, "direction": "long", "entry_price": 10.0, "tp_price": 12.0, "sl_price": 9.0}
+
+@pytest.fixture
+def store(bot, tmp_path):
+    store = bot.StateStore(str(tmp_path / "bot_state.db"))
+    yield store
+    store.close()
+
+def test_journal_records_each_event(store):
+    store.update_settings({"leverage": 7, "bingx_api_key": "secret"})
+    store.add_trade_item({"id": "1", "symbol": "ETHUSDT", "interval": "60"}, {"message": "Waiting..."})
+    store.open_position("1", POSITION, "signal")
+    for pnl in range(5):
+        store.set_status("1", {"message": "In LONG", "pnl": pnl})
+    store.close_position("1", {"message": "Waiting..."}, "TP")
+    store.close_position("1", {"message": "Waiting..."}, "TP")  # Already closed: no second entry
+    store.remove_trade_item("1")
+
+    journal = store.journal()
+    assert [(entry["kind"], entry["item_id"]) for entry in journal] == [
+        ("settings", None), ("trade_add", "1"), ("status", "1"), ("position_open", "1"), ("status", "1"),
+        ("position_close", "1"), ("status", "1"), ("trade_remove", "1"), ("status", "1")]
+    assert journal[0]["data"] == {"leverage": 7, "bingx_api_key": "***"}
+    assert journal[3]["data"] == {"position": POSITION, "reason": "signal"}
+    assert journal[5]["data"] == {"position": POSITION, "reason": "TP"}
+    assert [entry["seq"] for entry in store.journal(after=journal[2]["seq"], limit=2)] == [journal[3]["seq"], journal[4]["seq"]]
+    assert len(store.journal(item_id="1")) == 8
+
+def test_open_positions_survive_a_killed_process(bot, tmp_path):
+    path = str(tmp_path / "bot_state.db")
+    script = textwrap.dedent(f"""
+        import os, signal, sys
+        sys.path.insert(0, {ROOT!r})
+        import benchmark
+        bot = benchmark.load_target({os.path.join(ROOT, APP_PATHS["bot"])!r})
+        store = bot.StateStore({path!r})
+        store.add_trade_item({{"id": "1", "symbol": "ETHUSDT", "interval": "60"}}, {{"message": "Waiting..."}})
+        store.open_position("1", {POSITION!r}, "signal")
+        os.kill(os.getpid(), signal.SIGKILL)
+    """)
+    result = subprocess.run([sys.executable, "-c", script], cwd=str(tmp_path))
+    assert result.returncode == -9
+
+    store = bot.StateStore(path)
+    try:
+        assert store.recover() == {"1": POSITION}
+        assert [entry["kind"] for entry in store.journal()][-1] == "position_open"
+    finally:
+        store.close()
+
+def test_compaction_prunes_the_journal_and_truncates_the_wal(store):
+    for k in range(50):
+        store.open_position(str(k), POSITION, "signal")
+    assert store.compact(3600) == (0, 0)
+    assert len(store.journal(limit=1000)) == 50
+    assert os.path.getsize(store.path + "-wal") == 0
+
+    store.close_position("0", None, "manual")
+    dropped, wal_frames = store.compact(-1)  # Everything is older than a negative retention
+    assert (dropped, wal_frames) == (51, 0) and store.journal() == []
+    assert len(store.positions()) == 49  # The positions themselves are state, not journal
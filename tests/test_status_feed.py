@@ -0,0 +1,74 @@
+"""
+The bot's trade list push (SSE): StatusFeed coalesces the store's feed changes per kind, wakes
+waiting dashboards when another thread or process writes, and sends a dashboard that fell out
+of the history back to a snapshot.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def feed(bot, bot_state, monkeypatch):
+    feed = bot.StatusFeed(bot_state)
+    monkeypatch.setattr(bot, "status_feed", feed)
+    return feed
+
+def parse(text):
+    """[(event, id, data)] of an SSE text."""
+    events = []
+    for block in filter(None, text.split("\n\n")):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+def test_changes_are_coalesced_per_kind(bot_state, feed):
+    version = feed.current()
+    bot_state.set_status("1", {"message": "Waiting..."})
+    bot_state.set_status("1", {"message": "In LONG"})
+    bot_state.set_status("2", {"message": "Waiting..."})
+    bot_state.set_next_runs({"1": 100.0})
+    bot_state.set_next_runs({"1": None})
+    latest, text = feed.wait(version, 5)
+    assert latest == bot_state.feed_version() == version + 5
+    assert parse(text) == [("status", latest, {"1": {"message": "In LONG"}, "2": {"message": "Waiting..."}}), ("next_runs", latest, {"1": None})]
+    assert feed.wait(version, 5) == (latest, text)  # Rendered once per version, for every dashboard
+
+def test_unchanged_statuses_are_not_pushed(bot_state, feed):
+    bot_state.set_status("1", {"message": "Waiting..."})
+    version = feed.current()
+    bot_state.set_status("1", {"message": "Waiting..."})
+    assert feed.wait(version, 0.05) == (version, "")
+
+def test_a_waiting_dashboard_is_woken_by_another_writer(bot, bot_state, feed):
+    version, result = feed.current(), []
+    waiter = threading.Thread(target=lambda: result.append(feed.wait(version, 10)))
+    waiter.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    other = bot.StateStore(bot_state.path)  # As another process would: only the feed table links them
+    try: other.set_status("1", {"message": "In SHORT"})
+    finally: other.close()
+    waiter.join(10)
+    assert time.monotonic() - started < 2 * bot.STATE_POLL_SECONDS + 1
+    assert parse(result[0][1]) == [("status", version + 1, {"1": {"message": "In SHORT"}})]
+
+def test_versions_outside_the_history_need_a_snapshot(bot, bot_state, feed, monkeypatch):
+    monkeypatch.setattr(bot, "STATUS_FEED_HISTORY", 3)
+    version = feed.current()
+    for k in range(10): bot_state.set_status("1", {"message": f"step {k}"})
+    assert feed.wait(version, 1) == (version + 10, None)
+    assert feed.wait(version + 20, 1) == (version + 10, None)  # From a newer store, e.g. after a restore
+    assert parse(feed.wait(version + 8, 1)[1]) == [("status", version + 10, {"1": {"message": "step 9"}})]
+
+def test_stream_starts_with_a_snapshot(bot, bot_state, feed):
+    bot_state.add_trade_item({"id": "1", "symbol": "ETHUSDT", "interval": "60"}, {"message": "Waiting..."})
+    response = bot.app.test_client().get("/api/trade_list/stream")
+    try:
+        assert response.mimetype == "text/event-stream"
+        event, version, snapshot = parse(next(response.iter_encoded()).decode())[0]
+        assert event == "snapshot" and version == bot_state.feed_version()
+        assert snapshot["trade_list"] == bot_state.trade_list() and snapshot["bot_status"] == {"1": {"message": "Waiting..."}}
+    finally:
+        response.close()